@@ -17,5 +17,6 @@
 from __future__ import annotations
 from .task import Task
 from .run import Housekeeping
+from .filters import IncludeExcludeFilter
 
-__all__ = ["Task", "Housekeeping"]
+__all__ = ["Task", "Housekeeping", "IncludeExcludeFilter"]
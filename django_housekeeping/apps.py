@@ -0,0 +1,24 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+from django.apps import AppConfig
+
+
+class HousekeepingConfig(AppConfig):
+    name = "django_housekeeping"
+    verbose_name = "Housekeeping"
+    default_auto_field = "django.db.models.AutoField"
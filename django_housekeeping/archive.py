@@ -0,0 +1,144 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+from concurrent import futures
+import io
+import logging
+import os
+import os.path
+import shutil
+import tarfile
+from .streams import BUFSIZE, COMPRESSION_EXTENSIONS, ClosingReader, open_compressed
+
+log = logging.getLogger(__name__)
+
+
+def compress_file(pathname, compression):
+    """
+    Compress a file, replacing it with its compressed version.
+
+    Returns the pathname of the compressed file.
+    """
+    dest = pathname + COMPRESSION_EXTENSIONS[compression]
+    tmpname = dest + ".tmp"
+    with io.open(pathname, "rb") as src:
+        with open_compressed(tmpname, "wb", compression) as out:
+            shutil.copyfileobj(src, out, BUFSIZE)
+    shutil.copystat(pathname, tmpname)
+    os.replace(tmpname, dest)
+    os.unlink(pathname)
+    return dest
+
+
+def archive_directory(path, compression):
+    """
+    Stream a directory into a compressed tar archive next to it, check that
+    the archive can be read back in full, and remove the directory.
+
+    Returns the pathname of the archive.
+    """
+    path = os.path.normpath(path)
+    arcname = os.path.basename(path)
+    dest = "{}.tar{}".format(path, COMPRESSION_EXTENSIONS[compression])
+    tmpname = dest + ".tmp"
+
+    # Names and sizes of all archived files
+    members = []
+
+    def add_member(tarinfo):
+        members.append((tarinfo.name, tarinfo.size))
+        return tarinfo
+
+    with open_compressed(tmpname, "wb", compression) as out:
+        with tarfile.open(fileobj=out, mode="w|") as tar:
+            tar.add(path, arcname=arcname, filter=add_member)
+
+    # Reading the whole stream also verifies the integrity checks of the
+    # compressed data
+    found = []
+    with open_compressed(tmpname, "rb", compression) as fd:
+        with tarfile.open(fileobj=fd, mode="r|") as tar:
+            for tarinfo in tar:
+                found.append((tarinfo.name, tarinfo.size))
+    if found != members:
+        os.unlink(tmpname)
+        raise Exception("{}: archive does not match the contents of {}".format(dest, path))
+
+    # Never replace an existing archive
+    try:
+        os.link(tmpname, dest)
+    except FileExistsError:
+        raise Exception("{}: archive already exists".format(dest))
+    finally:
+        os.unlink(tmpname)
+    shutil.rmtree(path)
+    log.info("archived %s into %s", path, dest)
+    return dest
+
+
+def open_archived(archive, name, compression):
+    """
+    Open a file inside a compressed tar archive for streaming binary reads,
+    without extracting it.
+
+    Raises FileNotFoundError if the archive does not contain the file.
+    """
+    fd = open_compressed(archive, "rb", compression)
+    try:
+        tar = tarfile.open(fileobj=fd, mode="r|")
+        for tarinfo in tar:
+            if tarinfo.name == name and tarinfo.isfile():
+                return ClosingReader(tar.extractfile(tarinfo), tar, fd)
+        raise FileNotFoundError("{} not found in {}".format(name, archive))
+    except BaseException:
+        fd.close()
+        raise
+
+
+class BackgroundCompressor:
+    """
+    Compress files in a background thread, while tasks keep running
+    """
+    def __init__(self):
+        self.executor = None
+        self.futures = []
+
+    def compress(self, pathname, compression="xz"):
+        """
+        Schedule compressing pathname, returning a concurrent.futures.Future
+        with the pathname of the compressed file
+        """
+        if self.executor is None:
+            self.executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="housekeeping-compress")
+        future = self.executor.submit(compress_file, pathname, compression)
+        self.futures.append(future)
+        return future
+
+    def wait(self):
+        """
+        Wait for all scheduled compressions to finish, logging failures
+        """
+        if self.executor is None:
+            return
+        for future in futures.as_completed(self.futures):
+            try:
+                log.debug("compressed %s", future.result())
+            except Exception:
+                log.exception("background compression failed")
+        self.executor.shutdown()
+        self.executor = None
+        self.futures = []
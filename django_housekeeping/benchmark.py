@@ -0,0 +1,245 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+from . import toposort
+from .task import Task
+from .run import Housekeeping
+import argparse
+import io
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def chain_graph(size):
+    """
+    Graph where each node depends on the previous one
+    """
+    graph = {}
+    for node in range(size):
+        graph[node] = {node + 1} if node < size - 1 else set()
+    return graph
+
+
+def fan_out_graph(size):
+    """
+    Graph where a single node is followed by all the others
+    """
+    graph = {0: set(range(1, size))}
+    for node in range(1, size):
+        graph[node] = set()
+    return graph
+
+
+def random_dag(size, edges_per_node=3, seed=0):
+    """
+    Random acyclic graph, with edges only going from lower to higher nodes
+    """
+    rnd = random.Random(seed)
+    graph = {}
+    for node in range(size):
+        candidates = range(node + 1, size)
+        graph[node] = set(rnd.sample(candidates, min(edges_per_node, len(candidates))))
+    return graph
+
+
+GRAPHS = {
+    "chain": chain_graph,
+    "fan-out": fan_out_graph,
+    "random": random_dag,
+}
+
+
+def timed(func, *args):
+    """
+    Call func(*args), returning the elapsed time in seconds
+    """
+    clock_start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - clock_start
+
+
+def benchmark_toposort(sizes=(1000, 10000, 50000)):
+    """
+    Time toposort functions on synthetic graphs of the given sizes.
+
+    Returns a list of dicts, one for each graph.
+    """
+    results = []
+    for name, make_graph in GRAPHS.items():
+        for size in sizes:
+            graph = make_graph(size)
+            results.append({
+                "benchmark": "toposort",
+                "graph": name,
+                "nodes": size,
+                "edges": sum(len(x) for x in graph.values()),
+                "scc": timed(toposort.strongly_connected_components, graph),
+                "sort": timed(toposort.sort, graph),
+            })
+    return results
+
+
+class SyntheticTask(Task):
+    """
+    Base class for generated tasks
+    """
+    pass
+
+
+def _run_synthetic(self, stage):
+    pass
+
+
+def make_task_classes(tasks=1000, depth=10, fan_out=3, stages=3, seed=0):
+    """
+    Generate a hierarchy of Task classes.
+
+    Tasks are split in depth layers, and each task depends on up to fan_out
+    random tasks of the previous layer. All tasks run in all the stages.
+    """
+    rnd = random.Random(seed)
+    stage_names = ["stage{}".format(idx) for idx in range(stages)]
+    members = {"STAGES": stage_names, "__module__": __name__}
+    for name in stage_names:
+        members["run_{}".format(name)] = _run_synthetic
+
+    layers = [[] for idx in range(depth)]
+    classes = []
+    for idx in range(tasks):
+        layer = idx * depth // tasks
+        depends = []
+        if layer > 0:
+            previous = layers[layer - 1]
+            depends = rnd.sample(previous, min(fan_out, len(previous)))
+        cls = type("SyntheticTask{}".format(idx), (SyntheticTask,), dict(
+            members, IDENTIFIER="benchmark.SyntheticTask{}".format(idx), DEPENDS=depends))
+        layers[layer].append(cls)
+        classes.append(cls)
+    return classes
+
+
+def _run_stages(hk):
+    for name in hk.stage_schedule.sequence:
+        hk.stages[name].run()
+
+
+def _measure_phases(classes, root, trace_memory):
+    """
+    Run all the phases of a housekeeping run on a set of task classes,
+    returning a dict mapping phase names to elapsed time or peak memory
+    """
+    hk = Housekeeping(outdir=root, test_mock=SyntheticTask)
+
+    def discover():
+        for cls in classes:
+            hk.register_task(cls)
+
+    phases = [
+        ("discovery", discover),
+        ("init", hk.init),
+        ("get_schedule", lambda: list(hk.get_schedule())),
+        ("make_dot", lambda: hk.make_dot(io.StringIO())),
+        ("run", lambda: _run_stages(hk)),
+        ("report", lambda: hk.report.generate()),
+    ]
+
+    res = {}
+    for name, func in phases:
+        if trace_memory:
+            tracemalloc.reset_peak()
+            func()
+            res[name] = tracemalloc.get_traced_memory()[1]
+        else:
+            res[name] = timed(func)
+    return res
+
+
+def benchmark_tasks(tasks=1000, depth=10, fan_out=3, stages=3, seed=0):
+    """
+    Measure time and peak memory of the phases of a mock housekeeping run on
+    synthetic task classes.
+
+    Returns a list of dicts, one for each phase.
+    """
+    classes = make_task_classes(tasks=tasks, depth=depth, fan_out=fan_out, stages=stages, seed=seed)
+
+    root = tempfile.mkdtemp()
+    try:
+        # Measure time and memory separately, since tracing memory
+        # allocations slows down execution
+        times = _measure_phases(classes, root, trace_memory=False)
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        try:
+            memory = _measure_phases(classes, root, trace_memory=True)
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+    finally:
+        shutil.rmtree(root)
+
+    results = []
+    for name, elapsed in times.items():
+        results.append({
+            "benchmark": "tasks",
+            "phase": name,
+            "tasks": tasks,
+            "depth": depth,
+            "fan_out": fan_out,
+            "stages": stages,
+            "time": elapsed,
+            "peak_memory": memory[name],
+        })
+    return results
+
+
+def run_all(out=sys.stdout, sizes=(1000, 10000, 50000), tasks=1000, depth=10, fan_out=3, stages=3):
+    """
+    Run all benchmarks, writing results to out as one JSON object per line
+    """
+    for result in benchmark_toposort(sizes):
+        print(json.dumps(result), file=out)
+    for result in benchmark_tasks(tasks=tasks, depth=depth, fan_out=fan_out, stages=stages):
+        print(json.dumps(result), file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark django_housekeeping scheduling")
+    parser.add_argument("--sizes", action="store", default="1000,10000,50000",
+                        help="Comma separated list of graph sizes. Default: %(default)s")
+    parser.add_argument("--tasks", action="store", type=int, default=1000,
+                        help="Number of synthetic tasks. Default: %(default)s")
+    parser.add_argument("--depth", action="store", type=int, default=10,
+                        help="Number of layers of dependencies between tasks. Default: %(default)s")
+    parser.add_argument("--fan-out", action="store", type=int, default=3,
+                        help="Number of dependencies of each task. Default: %(default)s")
+    parser.add_argument("--stages", action="store", type=int, default=3,
+                        help="Number of stages. Default: %(default)s")
+    args = parser.parse_args()
+
+    run_all(sizes=[int(x) for x in args.sizes.split(",")],
+            tasks=args.tasks, depth=args.depth, fan_out=args.fan_out, stages=args.stages)
+
+
+if __name__ == "__main__":
+    main()
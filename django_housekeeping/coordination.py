@@ -0,0 +1,240 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+from .db import close_db_connections
+import contextlib
+import datetime
+import json
+import logging
+import os
+import os.path
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def _encode_record(record):
+    return dict(record, start=record["start"].isoformat())
+
+
+def _decode_record(record):
+    return dict(record, start=datetime.datetime.fromisoformat(record["start"]))
+
+
+class Coordinator:
+    """
+    Shared state that several Housekeeping processes use to divide the tasks
+    of the same run among them.
+
+    A run is identified by a run_id shared by all processes, and each process
+    by its node name. A (stage, task) unit is run by the node that claims it
+    first, which keeps renewing its lease while the task runs, and then
+    publishes its outcome. If a node stops renewing its lease, the unit can
+    be claimed by another node after the lease expires.
+    """
+    def claim(self, run_id, stage, task, node, duration):
+        """
+        Try to claim running task in stage, for duration seconds.
+
+        Returns True if the claim succeeded, False if the task already has an
+        outcome or another node holds a valid lease on it.
+        """
+        raise NotImplementedError("claim is not implemented by {}".format(self.__class__.__name__))
+
+    def renew(self, run_id, stage, task, node, duration):
+        """
+        Extend a lease held by node for another duration seconds.
+
+        Returns False if the lease has been lost.
+        """
+        raise NotImplementedError("renew is not implemented by {}".format(self.__class__.__name__))
+
+    def publish(self, run_id, node, record):
+        """
+        Store the outcome of a task, as a record built by
+        history.make_record()
+        """
+        raise NotImplementedError("publish is not implemented by {}".format(self.__class__.__name__))
+
+    def outcome(self, run_id, stage, task):
+        """
+        Return the record published for a task, with the name of the node
+        that ran it in "node", or None if the task has no outcome yet
+        """
+        raise NotImplementedError("outcome is not implemented by {}".format(self.__class__.__name__))
+
+
+class FileCoordinator(Coordinator):
+    """
+    Coordination state stored in a directory, with one JSON file per run
+    protected by a file lock. It works for processes on the same host, or
+    sharing a filesystem with working fcntl locks.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    @contextlib.contextmanager
+    def _state(self, run_id, write=False):
+        """
+        Lock the state of a run, and yield it as a dict mapping "stage:task"
+        to dicts with node, expires and record. If write is True, save the
+        state when done.
+        """
+        import fcntl
+        os.makedirs(self.path, exist_ok=True)
+        pathname = os.path.join(self.path, "{}.json".format(run_id))
+        with open(pathname + ".lock", "ab") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(pathname, "rt", encoding="utf8") as fd:
+                        state = json.load(fd)
+                except FileNotFoundError:
+                    state = {}
+                yield state
+                if write:
+                    tmpname = pathname + ".tmp"
+                    with open(tmpname, "wt", encoding="utf8") as fd:
+                        json.dump(state, fd)
+                    os.replace(tmpname, pathname)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def claim(self, run_id, stage, task, node, duration):
+        now = time.time()
+        key = "{}:{}".format(stage, task)
+        with self._state(run_id, write=True) as state:
+            lease = state.get(key)
+            if lease is not None:
+                if lease["record"] is not None:
+                    return False
+                if lease["node"] != node and lease["expires"] > now:
+                    return False
+            state[key] = {"node": node, "expires": now + duration, "record": None}
+            return True
+
+    def renew(self, run_id, stage, task, node, duration):
+        key = "{}:{}".format(stage, task)
+        with self._state(run_id, write=True) as state:
+            lease = state.get(key)
+            if lease is None or lease["node"] != node or lease["record"] is not None:
+                return False
+            lease["expires"] = time.time() + duration
+            return True
+
+    def publish(self, run_id, node, record):
+        key = "{}:{}".format(record["stage"], record["task"])
+        with self._state(run_id, write=True) as state:
+            state[key] = {"node": node, "expires": time.time(), "record": _encode_record(record)}
+
+    def outcome(self, run_id, stage, task):
+        with self._state(run_id) as state:
+            lease = state.get("{}:{}".format(stage, task))
+        if lease is None or lease["record"] is None:
+            return None
+        return dict(_decode_record(lease["record"]), node=lease["node"])
+
+
+class DjangoCoordinator(Coordinator):
+    """
+    Coordination state stored in the database, using the TaskLease model
+    """
+    def claim(self, run_id, stage, task, node, duration):
+        from django.db import IntegrityError, transaction
+        from django.db.models import Q
+        from django.utils import timezone
+        from .models import TaskLease
+        now = timezone.now()
+        expires = now + datetime.timedelta(seconds=duration)
+        try:
+            with transaction.atomic():
+                TaskLease.objects.create(run_id=run_id, stage=stage, task=task, node=node, expires=expires)
+            return True
+        except IntegrityError:
+            pass
+        # Take over our own lease or an expired one, if the task has no
+        # outcome yet
+        updated = (TaskLease.objects.filter(run_id=run_id, stage=stage, task=task, outcome__isnull=True)
+                   .filter(Q(node=node) | Q(expires__lt=now))
+                   .update(node=node, expires=expires))
+        return updated == 1
+
+    def renew(self, run_id, stage, task, node, duration):
+        from django.utils import timezone
+        from .models import TaskLease
+        expires = timezone.now() + datetime.timedelta(seconds=duration)
+        updated = (TaskLease.objects.filter(run_id=run_id, stage=stage, task=task, node=node, outcome__isnull=True)
+                   .update(expires=expires))
+        return updated == 1
+
+    def publish(self, run_id, node, record):
+        from django.utils import timezone
+        from .models import TaskLease
+        TaskLease.objects.update_or_create(
+            run_id=run_id, stage=record["stage"], task=record["task"],
+            defaults={"node": node, "expires": timezone.now(), "outcome": record["outcome"],
+                      "record": _encode_record(record)})
+
+    def outcome(self, run_id, stage, task):
+        from .models import TaskLease
+        lease = (TaskLease.objects.filter(run_id=run_id, stage=stage, task=task, outcome__isnull=False)
+                 .values("node", "record").first())
+        if lease is None:
+            return None
+        return dict(_decode_record(lease["record"]), node=lease["node"])
+
+
+class Lease:
+    """
+    Context manager that keeps renewing a claimed lease in a background
+    thread while a task runs
+    """
+    def __init__(self, coordinator, run_id, stage, task, node, duration):
+        self.coordinator = coordinator
+        self.run_id = run_id
+        self.stage = stage
+        self.task = task
+        self.node = node
+        self.duration = duration
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _run(self):
+        try:
+            while not self.stopped.wait(self.duration / 3):
+                try:
+                    renewed = self.coordinator.renew(self.run_id, self.stage, self.task, self.node, self.duration)
+                except Exception:
+                    log.exception("%s:%s: cannot renew lease", self.stage, self.task)
+                    continue
+                if not renewed:
+                    log.warning("%s:%s: lease lost, the task may be run again by another node",
+                                self.stage, self.task)
+                    break
+        finally:
+            close_db_connections()
+
+    def __enter__(self):
+        self.thread = threading.Thread(
+                target=self._run, name="housekeeping-lease-{}".format(self.task), daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
@@ -0,0 +1,233 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+from .filters import IncludeExcludeFilter
+import datetime
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+CRON_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+}
+
+
+def parse_cron_field(field, min_value, max_value):
+    """
+    Parse a crontab field into the set of values it matches.
+
+    Supports *, single values, ranges (a-b), lists (a,b,c) and steps (*/n,
+    a-b/n).
+    """
+    values = set()
+    for item in field.split(","):
+        step = 1
+        if "/" in item:
+            item, step = item.split("/", 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError("invalid step in cron field {!r}".format(field))
+        if item == "*":
+            start, end = min_value, max_value
+        elif "-" in item:
+            start, end = (int(x) for x in item.split("-", 1))
+        else:
+            start = int(item)
+            end = max_value if step != 1 else start
+        if start < min_value or end > max_value or start > end:
+            raise ValueError("cron field {!r} out of range {}-{}".format(field, min_value, max_value))
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """
+    Crontab-style schedule, with the usual five fields: minute, hour, day of
+    month, month and day of week
+    """
+    def __init__(self, expr):
+        self.expr = expr
+        fields = CRON_ALIASES.get(expr, expr).split()
+        if len(fields) != 5:
+            raise ValueError("cron expression {!r} does not have 5 fields".format(expr))
+        self.minutes = parse_cron_field(fields[0], 0, 59)
+        self.hours = parse_cron_field(fields[1], 0, 23)
+        self.days = parse_cron_field(fields[2], 1, 31)
+        self.months = parse_cron_field(fields[3], 1, 12)
+        # 0 and 7 are both Sunday
+        self.weekdays = {x % 7 for x in parse_cron_field(fields[4], 0, 7)}
+        # Like cron, if both days of month and days of week are restricted,
+        # either of them can match
+        self.days_restricted = fields[2] != "*"
+        self.weekdays_restricted = fields[4] != "*"
+
+    def __str__(self):
+        return self.expr
+
+    def day_matches(self, dt):
+        day = dt.day in self.days
+        weekday = (dt.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day or weekday
+        return day and weekday
+
+    def next_after(self, dt):
+        """
+        Return the first time matching the schedule strictly after dt
+        """
+        dt = dt.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        # Every valid schedule matches at least once in a leap cycle
+        limit = dt + datetime.timedelta(days=366 * 4)
+        while dt < limit:
+            if dt.month not in self.months:
+                if dt.month == 12:
+                    dt = dt.replace(year=dt.year + 1, month=1, day=1, hour=0, minute=0)
+                else:
+                    dt = dt.replace(month=dt.month + 1, day=1, hour=0, minute=0)
+            elif not self.day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + datetime.timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += datetime.timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError("cron expression {!r} never matches".format(self.expr))
+
+
+class Job:
+    """
+    A subset of tasks run on a schedule
+    """
+    def __init__(self, cron, run_filter=None, name=None):
+        if isinstance(cron, str):
+            cron = CronSchedule(cron)
+        self.cron = cron
+        self.run_filter = run_filter
+        self.name = name or str(cron)
+        # Time of the next scheduled run
+        self.next_run = None
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create a Job from a dict with "cron", and optional "include",
+        "exclude" and "name" keys, as found in HOUSEKEEPING_SCHEDULES
+        """
+        include = config.get("include")
+        exclude = config.get("exclude")
+        run_filter = None
+        if include is not None or exclude is not None:
+            run_filter = IncludeExcludeFilter(include, exclude)
+        return cls(config["cron"], run_filter=run_filter, name=config.get("name"))
+
+
+class Daemon:
+    """
+    Keep an initialised Housekeeping object in memory, and run jobs on it
+    according to their schedules.
+
+    Jobs are run one at a time, so that runs never overlap. If a job becomes
+    due more than once while another run is in progress, it is only run once.
+    """
+    # Maximum time to sleep before checking the clock again
+    MAX_SLEEP = 60
+
+    def __init__(self, hk, jobs):
+        if not jobs:
+            raise ValueError("no jobs to schedule")
+        self.hk = hk
+        self.jobs = jobs
+        # Set to stop the daemon
+        self.stopped = threading.Event()
+        # Whether the output directory created by init() is still unused
+        self.fresh = False
+
+    def now(self):
+        return datetime.datetime.now()
+
+    def run_filter(self, name):
+        """
+        Select the tasks needed by any of the jobs
+        """
+        for job in self.jobs:
+            if job.run_filter is None or job.run_filter(name):
+                return True
+        return False
+
+    def init(self, import_tasks=True):
+        """
+        Instantiate the tasks needed by the jobs
+        """
+        if any(job.run_filter is None for job in self.jobs):
+            self.hk.init(import_tasks=import_tasks)
+        else:
+            self.hk.init(run_filter=self.run_filter, import_tasks=import_tasks)
+        self.fresh = True
+
+    def run_job(self, job):
+        """
+        Run a job, logging its exceptions
+        """
+        log.info("%s: starting run", job.name)
+        try:
+            if not self.fresh:
+                self.hk.reset()
+            self.fresh = False
+            self.hk.run(run_filter=job.run_filter)
+        except Exception:
+            log.exception("%s: run failed", job.name)
+        else:
+            log.info("%s: run finished", job.name)
+
+    def run_pending(self):
+        """
+        Run all the jobs that are due, and return the time of the next job to
+        run
+        """
+        for job in self.jobs:
+            if job.next_run is None:
+                job.next_run = job.cron.next_after(self.now())
+            elif job.next_run <= self.now():
+                self.run_job(job)
+                # Skip the runs missed while this or other jobs were running
+                job.next_run = job.cron.next_after(self.now())
+        return min(job.next_run for job in self.jobs)
+
+    def run_forever(self):
+        """
+        Run jobs until stop() is called
+        """
+        while not self.stopped.is_set():
+            next_run = self.run_pending()
+            delay = (next_run - self.now()).total_seconds()
+            if delay > 0:
+                log.debug("next run at %s", next_run)
+                self.stopped.wait(min(delay, self.MAX_SLEEP))
+
+    def stop(self):
+        """
+        Stop the daemon after the current run has finished
+        """
+        self.stopped.set()
@@ -0,0 +1,77 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+import contextlib
+import time
+
+
+def django_configured():
+    """
+    Check if Django is installed, and its settings are configured
+    """
+    try:
+        from django.conf import settings
+    except ImportError:
+        return False
+    return settings.configured
+
+
+def close_db_connections():
+    """
+    Close the Django database connections opened by the current thread, if
+    Django is in use
+    """
+    if not django_configured():
+        return
+    from django.db import connections
+    connections.close_all()
+
+
+class QueryCounter:
+    """
+    Count the Django database queries run by the current thread, and the time
+    spent running them
+    """
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        # Set to True if the counter could be installed
+        self.enabled = False
+
+    def __call__(self, execute, sql, params, many, context):
+        clock_start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - clock_start
+
+    @contextlib.contextmanager
+    def install(self):
+        """
+        Context manager that counts queries on all the database connections
+        of the current thread, if Django is in use
+        """
+        if not django_configured():
+            yield
+            return
+        from django.db import connections
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            self.enabled = True
+            yield
@@ -0,0 +1,194 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+from .task import Task
+from importlib import import_module
+import importlib.util
+import json
+import os
+import sys
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def _run_stub(self, stage):
+    raise RuntimeError("{} has not been imported and cannot be run".format(self.IDENTIFIER))
+
+
+class TaskStub(Task):
+    """
+    Stand-in for a task class known from the discovery manifest, that has not
+    been imported yet
+    """
+    # Module to import to get the real class
+    MODULE = None
+
+    # Name of the real class in MODULE
+    ATTRIBUTE = None
+
+    @classmethod
+    def resolve(cls):
+        """
+        Import and return the real task class
+        """
+        res = import_module(cls.MODULE)
+        for name in cls.ATTRIBUTE.split("."):
+            res = getattr(res, name)
+        res.IDENTIFIER = cls.IDENTIFIER
+        return res
+
+
+def find_module_origin(name):
+    """
+    Return the pathname of the source of a module without importing it, or
+    None if the module does not exist
+    """
+    try:
+        spec = importlib.util.find_spec(name)
+    except ModuleNotFoundError:
+        return None
+    if spec is None:
+        return None
+    return spec.origin
+
+
+def module_file(name):
+    """
+    Return the pathname of an imported module, or None if it has no file
+    """
+    module = sys.modules.get(name)
+    if module is None:
+        return None
+    return getattr(module, "__file__", None)
+
+
+class Manifest:
+    """
+    Cache of the results of task autodiscovery, so that tasks can be listed
+    and scheduled without importing their modules.
+
+    The manifest is invalidated when the list of apps changes, or when any of
+    the modules that it was built from are modified.
+    """
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, app_names):
+        """
+        Return the list of TaskStub classes for the tasks in the manifest, or
+        None if the manifest is missing or out of date
+        """
+        try:
+            with open(self.path, "rt", encoding="utf8") as fd:
+                data = json.load(fd)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            log.warning("%s: cannot parse discovery manifest: %s", self.path, e)
+            return None
+
+        if data.get("version") != self.VERSION or data["apps"] != list(app_names):
+            return None
+
+        # Check that no housekeeping module appeared, disappeared or moved
+        for name, origin in data["modules"].items():
+            if find_module_origin(name) != origin:
+                log.debug("%s: discovery manifest is out of date: %s has changed", self.path, name)
+                return None
+
+        # Check that no source file was modified
+        for path, mtime in data["files"].items():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    log.debug("%s: discovery manifest is out of date: %s has changed", self.path, path)
+                    return None
+            except FileNotFoundError:
+                return None
+
+        return self._make_stubs(data["tasks"])
+
+    def _make_stubs(self, entries):
+        stubs = {}
+        for entry in entries:
+            members = {
+                "IDENTIFIER": entry["identifier"],
+                "NAME": entry["name"],
+                "STAGES": entry["stages"],
+                "MODULE": entry["module"],
+                "ATTRIBUTE": entry["attribute"],
+                "__module__": entry["module"],
+                "__doc__": entry["doc"],
+            }
+            for stage in entry["run_stages"]:
+                members["run_{}".format(stage)] = _run_stub
+            stubs[entry["identifier"]] = type(entry["attribute"].rsplit(".", 1)[-1], (TaskStub,), members)
+
+        for entry in entries:
+            stubs[entry["identifier"]].DEPENDS = [stubs[x] for x in entry["depends"]]
+
+        return list(stubs.values())
+
+    def save(self, app_names, modules, task_classes, locations):
+        """
+        Write the manifest.
+
+        app_names: names of the apps that were searched for housekeeping
+                   modules
+        modules: dict mapping the names of the housekeeping modules that were
+                 tried to the pathname of their source, or None if they do not
+                 exist
+        task_classes: all the registered task classes, in registration order
+        locations: dict mapping task classes to the (module, attribute) where
+                   they were found. Classes not in locations are looked up
+                   where they are defined.
+        """
+        files = {}
+        for origin in modules.values():
+            if origin is not None:
+                files[origin] = os.stat(origin).st_mtime
+
+        tasks = []
+        for cls in task_classes:
+            module, attribute = locations.get(cls, (cls.__module__, cls.__qualname__))
+            pathname = module_file(cls.__module__)
+            if pathname is not None:
+                files[pathname] = os.stat(pathname).st_mtime
+            tasks.append({
+                "identifier": cls.IDENTIFIER,
+                "module": module,
+                "attribute": attribute,
+                "name": cls.NAME,
+                "stages": list(cls.get_class_stages()),
+                "run_stages": [x for x in cls.get_class_stages() if hasattr(cls, "run_{}".format(x))],
+                "depends": [x.IDENTIFIER for x in cls.DEPENDS],
+                "doc": cls.__doc__,
+            })
+
+        data = {
+            "version": self.VERSION,
+            "apps": list(app_names),
+            "modules": modules,
+            "files": files,
+            "tasks": tasks,
+        }
+
+        with open(self.path + ".tmp", "wt", encoding="utf8") as fd:
+            json.dump(data, fd, indent=1)
+        os.rename(self.path + ".tmp", self.path)
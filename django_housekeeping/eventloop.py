@@ -0,0 +1,68 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+from .db import close_db_connections
+import asyncio
+import threading
+
+
+class EventLoopThread:
+    """
+    asyncio event loop running in a background thread, shared by all the
+    async tasks of a housekeeping run
+    """
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+
+    def start(self):
+        """
+        Start the event loop thread, if it is not running yet
+        """
+        if self.loop is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name="housekeeping-asyncio", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            close_db_connections()
+
+    def submit(self, coro):
+        """
+        Schedule a coroutine in the event loop, returning a
+        concurrent.futures.Future with its result
+        """
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        """
+        Stop the event loop thread, if it was started
+        """
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        self.loop.close()
+        self.loop = None
+        self.thread = None
@@ -0,0 +1,71 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+import fnmatch
+import re
+
+
+def compile_patterns(patterns):
+    """
+    Compile a list of shell-style patterns into a single regular expression
+    matching any of them.
+
+    Returns None if patterns is None.
+    """
+    if patterns is None:
+        return None
+    if not patterns:
+        # Match nothing
+        return re.compile("(?!)")
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns))
+
+
+def read_patterns(pathname):
+    """
+    Read a list of patterns from a file, one per line, skipping empty lines
+    and comments
+    """
+    patterns = []
+    with open(pathname, "rt") as fd:
+        for line in fd:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            patterns.append(line)
+    return patterns
+
+
+class IncludeExcludeFilter:
+    """
+    Match stage:task names against lists of shell-style include and exclude
+    patterns.
+
+    A name matches if it matches any of the include patterns, or if include
+    is None, and none of the exclude patterns.
+    """
+    def __init__(self, include=None, exclude=None):
+        self.include = include
+        self.exclude = exclude
+        self.include_re = compile_patterns(include)
+        self.exclude_re = compile_patterns(exclude)
+
+    def __call__(self, name):
+        if self.include_re is not None and not self.include_re.match(name):
+            return False
+        if self.exclude_re is not None and self.exclude_re.match(name):
+            return False
+        return True
@@ -0,0 +1,208 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+from collections import deque
+import datetime
+import json
+import statistics
+import threading
+
+
+def make_record(run_info, dry_run=False):
+    """
+    Build a history record from a RunInfo.
+
+    Records are dicts with these keys:
+
+    * stage: stage name
+    * task: task IDENTIFIER
+    * start: datetime when the task was started
+    * elapsed: run time in seconds
+    * outcome: "success", "up-to-date", "skipped", "failed" or "timed-out"
+    * exception: name of the exception class if the task failed, else None
+    * dry_run: True if the task was run in dry run mode
+    * fingerprint: digest of the value returned by Task.fingerprint, or None
+    * cpu_user, cpu_system, rss_delta, peak_rss, db_queries, db_time: resources
+      used by the task, as measured by instrument.Usage, or None if they were
+      not measured
+    """
+    exception = None
+    if run_info.exception is not None:
+        exception = run_info.exception[0].__name__
+    res = {
+        "stage": run_info.stage.name,
+        "task": run_info.task.IDENTIFIER,
+        "start": run_info.start,
+        "elapsed": run_info.elapsed.total_seconds() if run_info.elapsed is not None else None,
+        "outcome": run_info.outcome,
+        "exception": exception,
+        "dry_run": dry_run,
+        "fingerprint": run_info.fingerprint,
+        "cpu_user": None,
+        "cpu_system": None,
+        "rss_delta": None,
+        "peak_rss": None,
+        "db_queries": None,
+        "db_time": None,
+    }
+    if run_info.usage is not None:
+        res.update(run_info.usage.as_dict())
+    return res
+
+
+class History:
+    """
+    Storage for the outcome of past task runs
+    """
+    def append(self, record):
+        """
+        Store a record built by make_record()
+        """
+        raise NotImplementedError("append is not implemented by {}".format(self.__class__.__name__))
+
+    def records(self, stage=None, task=None):
+        """
+        Generate stored records, oldest first, optionally only for the given
+        stage or task identifier
+        """
+        raise NotImplementedError("records is not implemented by {}".format(self.__class__.__name__))
+
+    def last_durations(self, stage, task, count=10):
+        """
+        Return the elapsed seconds of the last count successful runs of a task
+        in a stage, oldest first. Dry runs are not considered.
+        """
+        res = deque(maxlen=count)
+        for record in self.records(stage=stage, task=task):
+            if record["outcome"] == "success" and not record["dry_run"]:
+                res.append(record["elapsed"])
+        return list(res)
+
+    def last_fingerprint(self, stage, task):
+        """
+        Return the fingerprint of the last successful run of a task in a
+        stage, or None if there is none. Dry runs are not considered.
+        """
+        res = None
+        for record in self.records(stage=stage, task=task):
+            if record["outcome"] in ("success", "up-to-date") and not record["dry_run"]:
+                res = record.get("fingerprint")
+        return res
+
+    def durations(self, count=5):
+        """
+        Return a dict mapping "stage:task" names to the median run time of
+        their last count successful runs. Dry runs are not considered.
+        """
+        runs = {}
+        for record in self.records():
+            if record["outcome"] != "success" or record["dry_run"]:
+                continue
+            name = "{}:{}".format(record["stage"], record["task"])
+            elapsed = runs.get(name)
+            if elapsed is None:
+                runs[name] = elapsed = deque(maxlen=count)
+            elapsed.append(record["elapsed"])
+        return {name: statistics.median(elapsed) for name, elapsed in runs.items()}
+
+
+class JSONLinesHistory(History):
+    """
+    History stored as a file with one JSON record per line
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # Cached last fingerprint of each (stage, task), to avoid reading the
+        # whole file for each task
+        self.fingerprints = None
+
+    def append(self, record):
+        record = dict(record, start=record["start"].isoformat())
+        line = json.dumps(record, sort_keys=True) + "\n"
+        with self.lock:
+            with open(self.path, "at", encoding="utf8") as fd:
+                fd.write(line)
+            if self.fingerprints is not None:
+                self._cache_fingerprint(record)
+
+    def _cache_fingerprint(self, record):
+        if record["outcome"] in ("success", "up-to-date") and not record["dry_run"]:
+            self.fingerprints[(record["stage"], record["task"])] = record.get("fingerprint")
+
+    def last_fingerprint(self, stage, task):
+        with self.lock:
+            if self.fingerprints is None:
+                self.fingerprints = {}
+                for record in self.records():
+                    self._cache_fingerprint(record)
+            return self.fingerprints.get((stage, task))
+
+    def records(self, stage=None, task=None):
+        try:
+            fd = open(self.path, "rt", encoding="utf8")
+        except FileNotFoundError:
+            return
+        with fd:
+            for line in fd:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Skip lines truncated by an interrupted write
+                    continue
+                if stage is not None and record["stage"] != stage:
+                    continue
+                if task is not None and record["task"] != task:
+                    continue
+                record["start"] = datetime.datetime.fromisoformat(record["start"])
+                yield record
+
+
+class DjangoHistory(History):
+    """
+    History stored in the database, using the TaskRun model
+    """
+    FIELDS = (
+        "stage", "task", "start", "elapsed", "outcome", "exception", "dry_run", "fingerprint",
+        "cpu_user", "cpu_system", "rss_delta", "peak_rss", "db_queries", "db_time")
+
+    def append(self, record):
+        from .models import TaskRun
+        TaskRun.objects.create(**{name: record[name] for name in self.FIELDS})
+
+    def _queryset(self, stage=None, task=None):
+        from .models import TaskRun
+        res = TaskRun.objects.all()
+        if stage is not None:
+            res = res.filter(stage=stage)
+        if task is not None:
+            res = res.filter(task=task)
+        return res
+
+    def records(self, stage=None, task=None):
+        yield from self._queryset(stage, task).order_by("start").values(*self.FIELDS).iterator()
+
+    def last_durations(self, stage, task, count=10):
+        res = list(self._queryset(stage, task).filter(outcome="success", dry_run=False)
+                   .order_by("-start").values_list("elapsed", flat=True)[:count])
+        res.reverse()
+        return res
+
+    def last_fingerprint(self, stage, task):
+        return (self._queryset(stage, task).filter(outcome__in=("success", "up-to-date"), dry_run=False)
+                .order_by("-start").values_list("fingerprint", flat=True).first())
+
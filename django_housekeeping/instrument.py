@@ -0,0 +1,137 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+from .db import QueryCounter
+import contextlib
+import sys
+import os
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+def current_rss():
+    """
+    Return the current resident set size of the process in bytes, or None if
+    it is not available
+    """
+    try:
+        with open("/proc/self/statm", "rt") as fd:
+            return int(fd.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of the process in bytes, or None if it
+    is not available
+    """
+    if resource is None:
+        return None
+    res = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on Mac OS, and in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return res
+    return res * 1024
+
+
+def format_size(size):
+    for unit in ("", "K", "M", "G"):
+        if abs(size) < 1024:
+            break
+        size /= 1024
+    return "{:.1f}{}".format(size, unit)
+
+
+class Usage:
+    """
+    Resources used by a task, measured while it runs in the current thread,
+    using this object as a context manager
+    """
+    def __init__(self):
+        # CPU time in seconds
+        self.cpu_user = None
+        self.cpu_system = None
+        # Change in resident set size, and peak resident set size of the
+        # process, in bytes
+        self.rss_delta = None
+        self.peak_rss = None
+        # Number of database queries, and total time spent running them in
+        # seconds
+        self.db_queries = None
+        self.db_time = None
+
+        self._rusage_start = None
+        self._rss_start = None
+        self._queries = None
+        self._stack = None
+
+    def __enter__(self):
+        if resource is not None:
+            self._rusage_start = resource.getrusage(getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF))
+        self._rss_start = current_rss()
+        self._queries = QueryCounter()
+        self._stack = contextlib.ExitStack()
+        self._stack.enter_context(self._queries.install())
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stack.close()
+        if self._rusage_start is not None:
+            end = resource.getrusage(getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF))
+            self.cpu_user = end.ru_utime - self._rusage_start.ru_utime
+            self.cpu_system = end.ru_stime - self._rusage_start.ru_stime
+        rss = current_rss()
+        if rss is not None and self._rss_start is not None:
+            self.rss_delta = rss - self._rss_start
+        self.peak_rss = peak_rss()
+        if self._queries.enabled:
+            self.db_queries = self._queries.count
+            self.db_time = self._queries.time
+
+        # Only keep the results, so that this object can be pickled
+        self._rusage_start = None
+        self._rss_start = None
+        self._queries = None
+        self._stack = None
+
+    def as_dict(self):
+        """
+        Return the measurements as a dict
+        """
+        return {
+            "cpu_user": self.cpu_user,
+            "cpu_system": self.cpu_system,
+            "rss_delta": self.rss_delta,
+            "peak_rss": self.peak_rss,
+            "db_queries": self.db_queries,
+            "db_time": self.db_time,
+        }
+
+    def __str__(self):
+        res = []
+        if self.cpu_user is not None:
+            res.append("cpu {:.2f}s user {:.2f}s system".format(self.cpu_user, self.cpu_system))
+        if self.rss_delta is not None:
+            res.append("rss {}{}".format("+" if self.rss_delta >= 0 else "", format_size(self.rss_delta)))
+        if self.peak_rss is not None:
+            res.append("peak rss {}".format(format_size(self.peak_rss)))
+        if self.db_queries is not None:
+            res.append("{} queries in {:.3f}s".format(self.db_queries, self.db_time))
+        return ", ".join(res)
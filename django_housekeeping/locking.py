@@ -0,0 +1,201 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+import json
+import logging
+import os
+import os.path
+import socket
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# What to do when a lock is held by another process
+LOCK_MODES = ("fail", "wait", "skip")
+
+
+class LockedError(Exception):
+    """
+    Raised when a lock is held by another process
+    """
+    pass
+
+
+def pid_alive(pid):
+    """
+    Check if a process is running on this host
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class FileLock:
+    """
+    Lock held by creating a file, which contains the host name and process ID
+    of the holder. The holder touches the file every heartbeat seconds while
+    it holds the lock.
+
+    A lock is stale, and is broken by the next process that tries to acquire
+    it, if its holder is a process on this host that is not running anymore,
+    or if it has not been touched for stale_after seconds.
+    """
+    # Seconds between attempts to acquire a lock in wait mode
+    POLL_INTERVAL = 1
+
+    def __init__(self, pathname, heartbeat=30, stale_after=None):
+        self.pathname = pathname
+        self.heartbeat = heartbeat
+        self.stale_after = stale_after if stale_after is not None else heartbeat * 4
+        self.stopped = None
+        self.thread = None
+
+    def holder(self):
+        """
+        Return a dict with host and pid of the lock holder, or None if it is
+        not known
+        """
+        try:
+            with open(self.pathname, "rt", encoding="utf8") as fd:
+                return json.load(fd)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def describe_holder(self):
+        holder = self.holder()
+        if holder is None:
+            return "unknown process"
+        return "process {} on {}".format(holder["pid"], holder["host"])
+
+    def is_stale(self):
+        """
+        Check if the lock file was left behind by a holder that is not running
+        anymore
+        """
+        try:
+            st = os.stat(self.pathname)
+        except FileNotFoundError:
+            return False
+        if time.time() - st.st_mtime > self.stale_after:
+            return True
+        holder = self.holder()
+        if holder is not None and holder["host"] == socket.gethostname() and not pid_alive(holder["pid"]):
+            return True
+        return False
+
+    def _break_stale(self):
+        """
+        Remove the lock file if it is stale, returning True if it was removed.
+
+        Processes breaking a lock hold a lock on a separate file while they
+        check again that the lock is stale and remove it, so that they cannot
+        remove a lock that another process has just acquired.
+        """
+        import fcntl
+        with open(self.pathname + ".break", "ab") as guard:
+            fcntl.flock(guard, fcntl.LOCK_EX)
+            if not self.is_stale():
+                return False
+            log.warning("%s: breaking stale lock held by %s", self.pathname, self.describe_holder())
+            try:
+                os.unlink(self.pathname)
+            except FileNotFoundError:
+                pass
+            return True
+
+    def _try_acquire(self):
+        os.makedirs(os.path.dirname(self.pathname), exist_ok=True)
+        try:
+            fd = os.open(self.pathname, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            if not self.is_stale() or not self._break_stale():
+                return False
+            try:
+                fd = os.open(self.pathname, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                # Another process acquired the lock first
+                return False
+
+        with os.fdopen(fd, "wt", encoding="utf8") as out:
+            json.dump({"host": socket.gethostname(), "pid": os.getpid(), "acquired": time.time()}, out)
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._heartbeat, name="housekeeping-lock-heartbeat", daemon=True)
+        self.thread.start()
+        return True
+
+    def _heartbeat(self):
+        while not self.stopped.wait(self.heartbeat):
+            try:
+                os.utime(self.pathname)
+            except OSError as e:
+                log.warning("%s: cannot update lock heartbeat: %s", self.pathname, e)
+
+    def acquire(self, mode="fail", timeout=None):
+        """
+        Acquire the lock.
+
+        If it is held by another process, mode decides what to do: "fail"
+        raises LockedError, "skip" returns False, and "wait" retries until the
+        lock is acquired, raising LockedError after timeout seconds, if set.
+
+        Returns True if the lock has been acquired.
+        """
+        if mode not in LOCK_MODES:
+            raise ValueError("lock mode {!r} is not one of {}".format(mode, ", ".join(LOCK_MODES)))
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        logged = False
+        while not self._try_acquire():
+            if mode == "skip":
+                log.info("%s: locked by %s", self.pathname, self.describe_holder())
+                return False
+            if mode == "fail":
+                raise LockedError("{} is locked by {}".format(self.pathname, self.describe_holder()))
+            if deadline is not None and time.monotonic() > deadline:
+                raise LockedError("{} is still locked by {} after {}s".format(
+                    self.pathname, self.describe_holder(), timeout))
+            if not logged:
+                log.info("%s: waiting for %s to release the lock", self.pathname, self.describe_holder())
+                logged = True
+            time.sleep(self.POLL_INTERVAL)
+        return True
+
+    def release(self):
+        """
+        Release the lock
+        """
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        try:
+            os.unlink(self.pathname)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        self.acquire("wait")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
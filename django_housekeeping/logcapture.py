@@ -0,0 +1,257 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+import contextvars
+import io
+import logging
+import logging.handlers
+import os
+import os.path
+import queue
+import sys
+import threading
+
+# Pathname of the log file of the task running in the current thread or
+# asyncio task, if its log is being captured
+current_task_log = contextvars.ContextVar("current_task_log", default=None)
+
+# Logger used for the output printed by tasks
+stdout_log = logging.getLogger("django_housekeeping.stdout")
+
+FORMAT = "%(asctime)-15s %(levelname)s %(name)s %(message)s"
+
+
+class TaskLogFilter(logging.Filter):
+    """
+    Only let through the records logged while a task is running, tagging them
+    with the pathname of its log file
+    """
+    def filter(self, record):
+        pathname = getattr(record, "housekeeping_log", None) or current_task_log.get()
+        if pathname is None:
+            return False
+        record.housekeeping_log = pathname
+        return True
+
+
+class TaskLogHandler(logging.Handler):
+    """
+    Write each record to the log file of the task that emitted it
+    """
+    def __init__(self, level=logging.NOTSET):
+        super().__init__(level)
+        self.files = {}
+        self.setFormatter(logging.Formatter(FORMAT))
+
+    def handle(self, record):
+        # End of a task: close its log file
+        if getattr(record, "housekeeping_close", False):
+            fd = self.files.pop(record.housekeeping_log, None)
+            if fd is not None:
+                fd.close()
+            return True
+        return super().handle(record)
+
+    def emit(self, record):
+        try:
+            fd = self.files.get(record.housekeeping_log)
+            if fd is None:
+                fd = self.files[record.housekeeping_log] = io.open(
+                        record.housekeeping_log, "at", encoding="utf8")
+            fd.write(self.format(record) + "\n")
+            fd.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        for fd in self.files.values():
+            fd.close()
+        self.files = {}
+        super().close()
+
+
+class TaskStdout(io.TextIOBase):
+    """
+    Replacement for sys.stdout and sys.stderr that sends what is printed by
+    running tasks to their log, one line at a time, and everything else to
+    the original stream
+    """
+    def __init__(self, stream, level):
+        self.stream = stream
+        self.level = level
+        self.lock = threading.Lock()
+        # Incomplete lines, by log pathname
+        self.partial = {}
+
+    def write(self, text):
+        pathname = current_task_log.get()
+        if pathname is None:
+            return self.stream.write(text)
+        with self.lock:
+            lines = (self.partial.pop(pathname, "") + text).split("\n")
+            if lines[-1]:
+                self.partial[pathname] = lines[-1]
+        for line in lines[:-1]:
+            stdout_log.log(self.level, "%s", line)
+        return len(text)
+
+    def flush_task(self, pathname):
+        """
+        Log the last incomplete line printed by a task
+        """
+        with self.lock:
+            line = self.partial.pop(pathname, None)
+        if line is not None:
+            stdout_log.log(self.level, "%s", line, extra={"housekeeping_log": pathname})
+
+    def flush(self):
+        self.stream.flush()
+
+    @property
+    def encoding(self):
+        return self.stream.encoding
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        return self.stream.fileno()
+
+
+class LogCapture:
+    """
+    Capture the log records and the output of each task into its own file.
+
+    Records go through a queue to a listener thread, so that writing the log
+    files never blocks the tasks.
+    """
+    def __init__(self, root, level=logging.INFO):
+        self.root = root
+        self.level = level
+        self.queue = None
+        self.queue_handler = None
+        self.handler = None
+        self.listener = None
+        self.stdout = None
+        self.stderr = None
+        self.saved_level = None
+
+    def pathname(self, stage, task):
+        """
+        Return the log pathname for a task in a stage, creating its directory
+        """
+        dirname = os.path.join(self.root, stage.name)
+        os.makedirs(dirname, exist_ok=True)
+        return os.path.join(dirname, "{}.log".format(task.IDENTIFIER))
+
+    def start(self):
+        """
+        Start capturing
+        """
+        root_logger = logging.getLogger()
+        # Make sure that records reach the capture handler
+        if root_logger.getEffectiveLevel() > self.level:
+            self.saved_level = root_logger.level
+            root_logger.setLevel(self.level)
+        stdout_log.setLevel(self.level)
+
+        self.queue = queue.SimpleQueue()
+        self.handler = TaskLogHandler()
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        self.queue_handler.setLevel(self.level)
+        self.queue_handler.addFilter(TaskLogFilter())
+        root_logger.addHandler(self.queue_handler)
+        self.listener = logging.handlers.QueueListener(self.queue, self.handler)
+        self.listener.start()
+
+        self.stdout = sys.stdout = TaskStdout(sys.stdout, logging.INFO)
+        self.stderr = sys.stderr = TaskStdout(sys.stderr, logging.WARNING)
+
+    def stop(self):
+        """
+        Stop capturing, waiting for all records to be written
+        """
+        if self.listener is None:
+            return
+        if sys.stdout is self.stdout:
+            sys.stdout = self.stdout.stream
+        if sys.stderr is self.stderr:
+            sys.stderr = self.stderr.stream
+        root_logger = logging.getLogger()
+        root_logger.removeHandler(self.queue_handler)
+        if self.saved_level is not None:
+            root_logger.setLevel(self.saved_level)
+            self.saved_level = None
+        self.listener.stop()
+        self.listener = None
+        self.handler.close()
+
+    def after_fork(self):
+        """
+        Reset the output capture in a forked process, whose log records are
+        sent to the parent process to be written
+        """
+        # Locks may have been held by other threads when forking
+        for stream in (self.stdout, self.stderr):
+            stream.lock = threading.Lock()
+
+    def flush_output(self, pathname):
+        """
+        Log the last incomplete lines printed by a task
+        """
+        for stream in (self.stdout, self.stderr):
+            stream.flush_task(pathname)
+
+    def task_started(self, stage, task):
+        """
+        Start capturing the log of a task in the current thread or asyncio
+        task, returning the pathname of its log file
+        """
+        pathname = self.pathname(stage, task)
+        current_task_log.set(pathname)
+        return pathname
+
+    def task_finished(self, pathname):
+        """
+        Stop capturing the log of a task in the current thread or asyncio task
+        """
+        self.flush_output(pathname)
+        current_task_log.set(None)
+        record = logging.LogRecord("django_housekeeping", logging.DEBUG, __file__, 0, "", None, None)
+        record.housekeeping_log = pathname
+        record.housekeeping_close = True
+        self.queue.put_nowait(record)
+
+
+async def with_task_log(coro, pathname):
+    """
+    Await a coroutine logging to the given task log, for coroutines that are
+    run in the event loop on behalf of a task running in another thread
+    """
+    current_task_log.set(pathname)
+    return await coro
+
+
+def tail(pathname, lines=20):
+    """
+    Return the last lines of a file, as a list of strings
+    """
+    try:
+        with io.open(pathname, "rt", encoding="utf8", errors="replace") as fd:
+            return [line.rstrip("\n") for line in fd.readlines()[-lines:]]
+    except FileNotFoundError:
+        return []
@@ -15,8 +15,11 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library.
 from __future__ import annotations
-from django.core.management.base import BaseCommand
-from django_housekeeping import Housekeeping
+from django.core.management.base import BaseCommand, CommandError
+from django_housekeeping import Housekeeping, IncludeExcludeFilter
+from django_housekeeping.filters import read_patterns
+from django_housekeeping.locking import LockedError
+from django_housekeeping.metrics import TextfileMetrics
 import datetime
 import sys
 import logging
@@ -24,27 +27,6 @@ import logging
 log = logging.getLogger(__name__)
 
 
-class IncludeExcludeFilter:
-    def __init__(self, include, exclude):
-        self.include = include
-        self.exclude = exclude
-
-    def __call__(self, name):
-        import fnmatch
-        if self.include is not None:
-            included = False
-            for pattern in self.include:
-                if fnmatch.fnmatch(name, pattern):
-                    included = True
-            if not included:
-                return False
-        if self.exclude is not None:
-            for pattern in self.exclude:
-                if fnmatch.fnmatch(name, pattern):
-                    return False
-        return True
-
-
 class Command(BaseCommand):
     help = 'Run site housekeeping'
 
@@ -55,22 +37,76 @@ class Command(BaseCommand):
                             help="Include stages/tasks matching this shell-like pattern. Can be used multiple times."),
         parser.add_argument("--exclude", action="append", dest="exclude", default=None,
                             help="Exclude stages/tasks matching this shell-like pattern. Can be used multiple times."),
+        parser.add_argument("--include-from", action="append", dest="include_from", default=None,
+                            help="Read include patterns from this file, one per line. Can be used multiple times."),
+        parser.add_argument("--exclude-from", action="append", dest="exclude_from", default=None,
+                            help="Read exclude patterns from this file, one per line. Can be used multiple times."),
         parser.add_argument("--list", action="store_true", dest="do_list", default=False,
                             help="List all available tasks"),
         parser.add_argument("--outdir", action="store", dest="outdir", default=None,
                             help="Store housekeeping output in a subdirectory of this directory."
                                  " Default is not to write any output."),
+        parser.add_argument("--resume", action="store", dest="resume", nargs="?", const=True, default=None,
+                            help="Resume an interrupted run, only running the tasks that did not complete"
+                                 " successfully. The argument is the run directory to resume;"
+                                 " the default is the most recent run."),
         parser.add_argument("--logfile", action="store", dest="logfile", default=None,
                             help="Also log all messages to the given file. You can use strftime escape sequences."),
         parser.add_argument("--logfile-debug", action="store_true", dest="logfile_debug", default=False,
                             help="Also log debug messages to the log file"),
+        parser.add_argument("--jobs", action="store", type=int, dest="jobs", default=1,
+                            help="Run up to this number of independent tasks at the same time. Default: 1"),
+        parser.add_argument("--resource", action="append", dest="resources", default=None,
+                            help="Capacity of a resource used by tasks, as TAG=AMOUNT, limiting the tasks run"
+                                 " at the same time with --jobs. Can be used multiple times."),
+        parser.add_argument("--task-timeout", action="store", type=float, dest="task_timeout", default=None,
+                            help="Cancel tasks that run for more than this number of seconds,"
+                                 " unless they set their own TIMEOUT. Default: no limit"),
+        parser.add_argument("--subprocess", action="append", dest="subprocess", default=None,
+                            help="Run stages/tasks matching this shell-like pattern in a separate process."
+                                 " Can be used multiple times."),
+        parser.add_argument("--by-duration", action="store_true", dest="by_duration", default=False,
+                            help="Use task durations from previous runs to start the longest chains of tasks first."
+                                 " With --list, also show the predicted run time and critical path of each stage"),
+        parser.add_argument("--profile", action="append", dest="profile", default=None,
+                            help="Profile stages/tasks matching this shell-like pattern, writing the profiles in the"
+                                 " output directory. Can be used multiple times."),
+        parser.add_argument("--profile-flamegraph", action="store_true", dest="profile_flamegraph", default=False,
+                            help="Also sample the stacks of profiled tasks, for use with flamegraph tools"),
         parser.add_argument("--graph", action="store_true", dest="do_graph", default=False,
                             help="Output all dependency graphs"),
+        parser.add_argument("--daemon", action="store_true", dest="daemon", default=False,
+                            help="Keep running, and run tasks according to the schedules in"
+                                 " HOUSEKEEPING_SCHEDULES or --schedule"),
+        parser.add_argument("--schedule", action="store", dest="schedule", default=None,
+                            help="With --daemon, run the tasks selected by --include and --exclude with this"
+                                 " crontab-style schedule, like '*/5 * * * *'"),
+        parser.add_argument("--distributed", action="store", dest="run_id", default=None,
+                            help="Share the tasks with the other housekeeping processes started with the same"
+                                 " RUN_ID, coordinating through HOUSEKEEPING_COORDINATOR or the database"),
+        parser.add_argument("--lock", action="store", dest="lock_mode", default=None, choices=("fail", "wait", "skip"),
+                            help="Lock the output directory during the run. If another run holds the lock, fail,"
+                                 " wait for it, or skip this run"),
+        parser.add_argument("--lock-timeout", action="store", type=float, dest="lock_timeout", default=None,
+                            help="With --lock=wait, maximum time in seconds to wait for the lock"),
+        parser.add_argument("--archive", action="store", dest="archive", default=None, choices=("xz", "zst"),
+                            help="At the end of the run, archive the run directory into a compressed tarball"),
+        parser.add_argument("--prune", action="store_true", dest="do_prune", default=False,
+                            help="Only remove the old runs that HOUSEKEEPING_RETENTION does not keep. With"
+                                 " --dry-run, list what would be removed"),
+        parser.add_argument("--metrics-file", action="store", dest="metrics_file", default=None,
+                            help="Write metrics about task runs to this file in the Prometheus text format,"
+                                 " updating it while the run progresses"),
+        parser.add_argument("--benchmark", action="store_true", dest="do_benchmark", default=False,
+                            help="Benchmark scheduling and mock runs on synthetic tasks, printing JSON results"),
 
     def handle(
             self, dry_run=False, include=None, exclude=None, logfile=None,
-            logfile_debug=False, do_list=False, do_graph=False, outdir=None,
-            *args, **opts):
+            logfile_debug=False, do_list=False, do_graph=False, do_benchmark=False, outdir=None,
+            jobs=1, subprocess=None, by_duration=False, resume=None, task_timeout=None, profile=None,
+            profile_flamegraph=False, include_from=None, exclude_from=None,
+            daemon=False, schedule=None, run_id=None, lock_mode=None, lock_timeout=None,
+            resources=None, metrics_file=None, archive=None, do_prune=False, *args, **opts):
         FORMAT = "%(asctime)-15s %(levelname)s %(message)s"
         handlers = []
 
@@ -107,16 +143,87 @@ class Command(BaseCommand):
             root_logger.addHandler(h)
         root_logger.setLevel(min(x.level for x in handlers))
 
+        if do_benchmark:
+            from django_housekeeping import benchmark
+            benchmark.run_all(out=sys.stdout)
+            return
+
+        for pathname in include_from or ():
+            include = (include or []) + read_patterns(pathname)
+        for pathname in exclude_from or ():
+            exclude = (exclude or []) + read_patterns(pathname)
+
         run_filter = None
         if include is not None or exclude is not None:
             run_filter = IncludeExcludeFilter(include, exclude)
-        hk = Housekeeping(dry_run=dry_run, outdir=outdir)
+        subprocess_filter = None
+        if subprocess is not None:
+            subprocess_filter = IncludeExcludeFilter(subprocess, None)
+        profile_filter = None
+        if profile is not None:
+            profile_filter = IncludeExcludeFilter(profile, None)
+        if resources is not None:
+            capacities = {}
+            for resource in resources:
+                tag, sep, amount = resource.partition("=")
+                try:
+                    capacities[tag] = int(amount)
+                except ValueError:
+                    raise CommandError("--resource {!r} is not in the form TAG=AMOUNT".format(resource))
+            resources = capacities
+        hk = Housekeeping(dry_run=dry_run, outdir=outdir, workers=jobs, subprocess_filter=subprocess_filter,
+                          resume=resume, task_timeout=task_timeout, profile_filter=profile_filter,
+                          profile_flamegraph=profile_flamegraph, run_id=run_id,
+                          lock_mode=lock_mode if not (do_list or do_graph) else None, lock_timeout=lock_timeout,
+                          resources=resources,
+                          metrics=TextfileMetrics(metrics_file) if metrics_file is not None else None,
+                          archive=archive)
         hk.autodiscover()
-        hk.init()
+        if by_duration:
+            hk.load_durations()
+        if do_prune:
+            if hk.retention is None:
+                raise CommandError("--prune needs HOUSEKEEPING_RETENTION")
+            for run in hk.prune():
+                print("{} {}".format("would remove" if dry_run else "removed", run.path))
+            return
+        if daemon:
+            if run_id is not None:
+                raise CommandError("--distributed cannot be used with --daemon")
+            self.run_daemon(hk, run_filter, schedule)
+            return
+        hk.init(run_filter=run_filter, import_tasks=not (do_list or do_graph))
         if do_list:
             for name in hk.list_run(run_filter=run_filter):
                 print(name)
+            if by_duration:
+                for stage, duration, critical_path in hk.predict():
+                    print("# {}: predicted run time {} with {} workers, critical path: {}".format(
+                        stage.name, duration, hk.workers, " -> ".join(critical_path)))
         elif do_graph:
             hk.make_dot(sys.stdout)
         else:
-            hk.run(run_filter=run_filter)
+            try:
+                hk.run(run_filter=run_filter)
+            except LockedError as e:
+                raise CommandError(str(e))
+
+    def run_daemon(self, hk, run_filter, schedule):
+        from django.conf import settings
+        from django_housekeeping.daemon import Daemon, Job
+        import signal
+
+        if schedule is not None:
+            jobs = [Job(schedule, run_filter=run_filter)]
+        else:
+            jobs = [Job.from_config(x) for x in getattr(settings, "HOUSEKEEPING_SCHEDULES", ())]
+        if not jobs:
+            raise CommandError("--daemon needs --schedule or HOUSEKEEPING_SCHEDULES")
+
+        daemon = Daemon(hk, jobs)
+        daemon.init()
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+        try:
+            daemon.run_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,165 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+from collections import Counter, defaultdict
+import bisect
+import os
+import re
+import threading
+import time
+
+# Upper bounds in seconds of the buckets of the task duration histogram
+DURATION_BUCKETS = (1, 5, 15, 60, 300, 900, 3600, 4 * 3600)
+
+LAST_SUCCESS_RE = re.compile(
+        r'^housekeeping_task_last_success_timestamp_seconds\{stage="((?:[^"\\]|\\.)*)",'
+        r'task="((?:[^"\\]|\\.)*)"\} (\S+)$')
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def unescape_label(value):
+    return re.sub(r"\\(.)", lambda mo: "\n" if mo.group(1) == "n" else mo.group(1), value)
+
+
+class Metrics:
+    """
+    Sink for metrics about task runs
+    """
+    def task_started(self, stage, task):
+        """
+        Called when a task starts running
+        """
+        pass
+
+    def task_finished(self, run_info):
+        """
+        Called every time a task has been run or skipped
+        """
+        pass
+
+
+class TextfileMetrics(Metrics):
+    """
+    Metrics written in the Prometheus text format, for the textfile collector
+    of node_exporter.
+
+    The file is rewritten atomically every time a task starts or finishes.
+    The timestamps of the last successful runs are read back from the
+    existing file, so that they are kept across runs.
+    """
+    def __init__(self, pathname):
+        self.pathname = pathname
+        self.lock = threading.Lock()
+        # (stage, task) -> count of runs by bucket, and sum of durations
+        self.buckets = defaultdict(lambda: [0] * (len(DURATION_BUCKETS) + 1))
+        self.durations = Counter()
+        # (stage, task, outcome) -> count
+        self.outcomes = Counter()
+        # (stage, task) -> timestamp
+        self.last_success = self.load_last_success()
+        # (stage, task) -> 1 if running, 0 if not
+        self.running = {}
+
+    def load_last_success(self):
+        res = {}
+        try:
+            with open(self.pathname, "rt", encoding="utf8") as fd:
+                for line in fd:
+                    mo = LAST_SUCCESS_RE.match(line.rstrip("\n"))
+                    if mo is None:
+                        continue
+                    res[(unescape_label(mo.group(1)), unescape_label(mo.group(2)))] = float(mo.group(3))
+        except FileNotFoundError:
+            pass
+        return res
+
+    def task_started(self, stage, task):
+        with self.lock:
+            self.running[(stage.name, task.IDENTIFIER)] = 1
+            self.write()
+
+    def task_finished(self, run_info):
+        key = (run_info.stage.name, run_info.task.IDENTIFIER)
+        with self.lock:
+            if key in self.running:
+                self.running[key] = 0
+            self.outcomes[key + (run_info.outcome,)] += 1
+            if run_info.executed and run_info.elapsed is not None:
+                elapsed = run_info.elapsed.total_seconds()
+                self.buckets[key][bisect.bisect_left(DURATION_BUCKETS, elapsed)] += 1
+                self.durations[key] += elapsed
+            if run_info.success:
+                self.last_success[key] = time.time()
+            self.write()
+
+    def format(self):
+        """
+        Return the metrics as a list of lines
+        """
+        def labels(stage, task, **kw):
+            res = ['stage="{}"'.format(escape_label(stage)), 'task="{}"'.format(escape_label(task))]
+            for name, value in kw.items():
+                res.append('{}="{}"'.format(name, escape_label(value)))
+            return "{" + ",".join(res) + "}"
+
+        lines = [
+            "# HELP housekeeping_task_duration_seconds Run time of housekeeping tasks",
+            "# TYPE housekeeping_task_duration_seconds histogram",
+        ]
+        for (stage, task), counts in sorted(self.buckets.items()):
+            total = 0
+            for le, count in zip(DURATION_BUCKETS + ("+Inf",), counts):
+                total += count
+                lines.append("housekeeping_task_duration_seconds_bucket{} {}".format(
+                    labels(stage, task, le=str(le)), total))
+            lines.append("housekeeping_task_duration_seconds_sum{} {}".format(
+                labels(stage, task), self.durations[(stage, task)]))
+            lines.append("housekeeping_task_duration_seconds_count{} {}".format(labels(stage, task), total))
+
+        lines.append("# HELP housekeeping_task_runs_total Outcomes of housekeeping tasks")
+        lines.append("# TYPE housekeeping_task_runs_total counter")
+        for (stage, task, outcome), count in sorted(self.outcomes.items()):
+            lines.append("housekeeping_task_runs_total{} {}".format(labels(stage, task, outcome=outcome), count))
+
+        lines.append("# HELP housekeeping_task_last_success_timestamp_seconds"
+                     " Time of the last successful run of housekeeping tasks")
+        lines.append("# TYPE housekeeping_task_last_success_timestamp_seconds gauge")
+        for (stage, task), ts in sorted(self.last_success.items()):
+            lines.append("housekeeping_task_last_success_timestamp_seconds{} {}".format(labels(stage, task), ts))
+
+        lines.append("# HELP housekeeping_task_running Whether housekeeping tasks are currently running")
+        lines.append("# TYPE housekeeping_task_running gauge")
+        for (stage, task), running in sorted(self.running.items()):
+            lines.append("housekeeping_task_running{} {}".format(labels(stage, task), running))
+
+        lines.append("# HELP housekeeping_tasks_running Number of housekeeping tasks currently running")
+        lines.append("# TYPE housekeeping_tasks_running gauge")
+        lines.append("housekeeping_tasks_running {}".format(sum(self.running.values())))
+        return lines
+
+    def write(self):
+        """
+        Atomically replace the metrics file
+        """
+        tmpname = "{}.{}.tmp".format(self.pathname, os.getpid())
+        with open(tmpname, "wt", encoding="utf8") as fd:
+            for line in self.format():
+                print(line, file=fd)
+        os.replace(tmpname, self.pathname)
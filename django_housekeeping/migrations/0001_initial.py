@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(max_length=255)),
+                ('task', models.CharField(max_length=255)),
+                ('start', models.DateTimeField()),
+                ('elapsed', models.FloatField(null=True)),
+                ('outcome', models.CharField(max_length=16)),
+                ('exception', models.CharField(max_length=255, null=True)),
+                ('dry_run', models.BooleanField(default=False)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['stage', 'task', 'start'], name='django_hous_stage_18d478_idx')],
+            },
+        ),
+    ]
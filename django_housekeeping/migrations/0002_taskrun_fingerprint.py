@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_housekeeping', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskrun',
+            name='fingerprint',
+            field=models.CharField(max_length=64, null=True),
+        ),
+    ]
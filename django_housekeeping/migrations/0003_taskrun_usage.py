@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_housekeeping', '0002_taskrun_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskrun',
+            name='cpu_system',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='taskrun',
+            name='cpu_user',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='taskrun',
+            name='db_queries',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='taskrun',
+            name='db_time',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='taskrun',
+            name='peak_rss',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='taskrun',
+            name='rss_delta',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
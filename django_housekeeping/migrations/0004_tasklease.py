@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_housekeeping', '0003_taskrun_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_id', models.CharField(max_length=255)),
+                ('stage', models.CharField(max_length=255)),
+                ('task', models.CharField(max_length=255)),
+                ('node', models.CharField(max_length=255)),
+                ('expires', models.DateTimeField()),
+                ('outcome', models.CharField(max_length=16, null=True)),
+                ('record', models.JSONField(null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('run_id', 'stage', 'task'), name='housekeeping_unique_lease')],
+            },
+        ),
+    ]
@@ -15,3 +15,54 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library.
 from __future__ import annotations
+from django.db import models
+
+
+class TaskRun(models.Model):
+    """
+    Outcome of a task run, stored by django_housekeeping.history.DjangoHistory
+    """
+    stage = models.CharField(max_length=255)
+    task = models.CharField(max_length=255)
+    start = models.DateTimeField()
+    elapsed = models.FloatField(null=True)
+    outcome = models.CharField(max_length=16)
+    exception = models.CharField(max_length=255, null=True)
+    dry_run = models.BooleanField(default=False)
+    fingerprint = models.CharField(max_length=64, null=True)
+    cpu_user = models.FloatField(null=True)
+    cpu_system = models.FloatField(null=True)
+    rss_delta = models.BigIntegerField(null=True)
+    peak_rss = models.BigIntegerField(null=True)
+    db_queries = models.IntegerField(null=True)
+    db_time = models.FloatField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["stage", "task", "start"]),
+        ]
+
+    def __str__(self):
+        return "{}:{} {} {}".format(self.stage, self.task, self.start, self.outcome)
+
+
+class TaskLease(models.Model):
+    """
+    Claim on running a task of a distributed run, used by
+    django_housekeeping.coordination.DjangoCoordinator
+    """
+    run_id = models.CharField(max_length=255)
+    stage = models.CharField(max_length=255)
+    task = models.CharField(max_length=255)
+    node = models.CharField(max_length=255)
+    expires = models.DateTimeField()
+    outcome = models.CharField(max_length=16, null=True)
+    record = models.JSONField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["run_id", "stage", "task"], name="housekeeping_unique_lease"),
+        ]
+
+    def __str__(self):
+        return "{} {}:{} {}".format(self.run_id, self.stage, self.task, self.node)
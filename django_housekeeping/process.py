@@ -0,0 +1,207 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+from .db import close_db_connections
+from .instrument import Usage
+from .logcapture import current_task_log
+import asyncio
+import contextlib
+import inspect
+import multiprocessing
+import pickle
+import signal
+import time
+import traceback
+import logging
+import logging.handlers
+
+log = logging.getLogger(__name__)
+
+
+class RemoteTraceback(Exception):
+    """
+    Traceback of an exception raised in a subprocess, set as the cause of the
+    exception seen by the parent process
+    """
+    def __init__(self, tb):
+        self.tb = tb
+
+    def __str__(self):
+        return self.tb
+
+
+class TaskProcessError(Exception):
+    """
+    A task run in a subprocess failed in a way that could not be sent back to
+    the parent process as it was
+    """
+    pass
+
+
+class ProcessResult:
+    """
+    Outcome of a task method run in a subprocess
+    """
+    def __init__(self, elapsed=None, exception=None, timed_out=False, usage=None):
+        # Run time in seconds measured by the child process
+        self.elapsed = elapsed
+        # Exception raised by the method, or None if it was successful
+        self.exception = exception
+        # True if the process ran past its timeout
+        self.timed_out = timed_out
+        # instrument.Usage with the resources used by the child process
+        self.usage = usage
+
+
+class TaskCancelled(Exception):
+    """
+    Raised in a task run in a subprocess when it runs past its timeout
+    """
+    pass
+
+
+class PipeHandler(logging.handlers.QueueHandler):
+    """
+    Send log records to the parent process through the result pipe
+    """
+    def enqueue(self, record):
+        self.queue.send(("log", record))
+
+
+def _run_child(conn, stage, method, profiler):
+    """
+    Body of the forked process: run the task method and send the outcome to
+    the parent
+    """
+    def on_sigterm(signum, frame):
+        method.__self__.cancelled.set()
+        raise TaskCancelled("task cancelled after running past its timeout")
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+    # Send log records to the parent process, instead of writing them with
+    # the inherited handlers, whose streams may have been in use by other
+    # threads when forking
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(PipeHandler(conn))
+    if stage.hk.log_capture is not None:
+        stage.hk.log_capture.after_fork()
+
+    usage = Usage()
+    clock_start = time.perf_counter()
+    try:
+        with usage, profiler or contextlib.nullcontext():
+            res = method(stage)
+            if inspect.iscoroutine(res):
+                asyncio.run(res)
+    except BaseException as e:
+        elapsed = time.perf_counter() - clock_start
+        if not isinstance(e, KeyboardInterrupt):
+            log.exception("%s: %s failed", method.__self__.IDENTIFIER, method.__name__)
+        # Make sure that the exception can make it to the parent, falling
+        # back to a summary of it
+        try:
+            payload = pickle.dumps(e)
+            pickle.loads(payload)
+        except Exception:
+            payload = pickle.dumps(TaskProcessError("{}: {}".format(e.__class__.__name__, e)))
+        result = (elapsed, payload, traceback.format_exc(), usage)
+    else:
+        result = (time.perf_counter() - clock_start, None, None, usage)
+    try:
+        if stage.hk.log_capture is not None:
+            stage.hk.log_capture.flush_output(current_task_log.get())
+        conn.send(("result", result))
+    finally:
+        conn.close()
+        close_db_connections()
+
+
+def _receive(conn, timeout):
+    """
+    Wait up to timeout seconds for the result of the child process, logging
+    the records that it sends in the meantime.
+
+    Returns the result, or None if the timeout expired. Raises EOFError if
+    the child process exited without sending a result.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        if deadline is not None and not conn.poll(max(0.0, deadline - time.monotonic())):
+            return None
+        kind, payload = conn.recv()
+        if kind == "result":
+            return payload
+        logging.getLogger(payload.name).handle(payload)
+
+
+def run(stage, method, timeout=None, grace=10, profiler=None):
+    """
+    Call method(stage) in a forked process.
+
+    If the process runs for more than timeout seconds, it is sent SIGTERM,
+    which raises TaskCancelled in it, and if it is still running after grace
+    more seconds, it is killed.
+
+    If profiler is a profiling.TaskProfiler, it is used to profile the child.
+
+    Returns a ProcessResult.
+    """
+    ctx = multiprocessing.get_context("fork")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(
+            target=_run_child, args=(child_conn, stage, method, profiler),
+            name="housekeeping-{}-{}".format(stage.name, method.__self__.IDENTIFIER))
+    proc.start()
+    child_conn.close()
+    timed_out = False
+    try:
+        result = _receive(parent_conn, timeout)
+        if result is None:
+            timed_out = True
+            log.warning("%s: %s is still running after %s seconds: cancelling it",
+                        method.__self__.IDENTIFIER, method.__name__, timeout)
+            proc.terminate()
+            if _receive(parent_conn, grace) is None:
+                log.error("%s: %s did not stop after being cancelled: killing it",
+                          method.__self__.IDENTIFIER, method.__name__)
+                proc.kill()
+    except EOFError:
+        result = None
+    except BaseException:
+        proc.terminate()
+        proc.join()
+        raise
+    finally:
+        parent_conn.close()
+    proc.join()
+
+    if timed_out:
+        return ProcessResult(timed_out=True)
+
+    if result is None:
+        return ProcessResult(exception=TaskProcessError(
+                "process exited with code {} without reporting a result".format(proc.exitcode)))
+
+    elapsed, payload, tb, usage = result
+    if payload is None:
+        return ProcessResult(elapsed=elapsed, usage=usage)
+
+    exception = pickle.loads(payload)
+    exception.__cause__ = RemoteTraceback(tb)
+    return ProcessResult(elapsed=elapsed, exception=exception, usage=usage)
@@ -0,0 +1,125 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+from collections import Counter
+import cProfile
+import os.path
+import pstats
+import sys
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class StackSampler(threading.Thread):
+    """
+    Periodically sample the stack of a thread, counting how many times each
+    stack has been seen
+    """
+    def __init__(self, thread_id, interval=0.005):
+        super().__init__(name="housekeeping-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[";".join(stack)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write_collapsed(self, pathname):
+        """
+        Write the samples in the collapsed stack format used by flamegraph
+        tools
+        """
+        with open(pathname, "wt") as out:
+            for stack, count in sorted(self.stacks.items()):
+                print(stack, count, file=out)
+
+
+class TaskProfiler:
+    """
+    Profile a task run in the current thread, using this object as a context
+    manager.
+
+    The cProfile output is written to pathname.prof, and if flamegraph is
+    True, sampled stacks are written to pathname.folded.
+    """
+    def __init__(self, pathname, flamegraph=False):
+        self.pathname = pathname
+        self.flamegraph = flamegraph
+        self.profile = None
+        self.sampler = None
+
+    @property
+    def prof_file(self):
+        return self.pathname + ".prof"
+
+    @property
+    def folded_file(self):
+        return self.pathname + ".folded"
+
+    def __enter__(self):
+        self.profile = cProfile.Profile()
+        try:
+            self.profile.enable()
+        except ValueError as e:
+            # Another profiler may already be active
+            log.warning("%s: cannot profile: %s", self.pathname, e)
+            self.profile = None
+        if self.flamegraph:
+            self.sampler = StackSampler(threading.get_ident())
+            self.sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler.write_collapsed(self.folded_file)
+            self.sampler = None
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.prof_file)
+            self.profile = None
+
+    def hotspots(self, count=10):
+        """
+        Return a list of (function, calls, own time, cumulative time) for the
+        count functions where the task spent most of its own time
+        """
+        if not os.path.exists(self.prof_file):
+            return []
+        stats = pstats.Stats(self.prof_file)
+        entries = sorted(stats.stats.items(), key=lambda x: x[1][2], reverse=True)
+        res = []
+        for func, (primitive_calls, calls, own_time, cumulative_time, callers) in entries[:count]:
+            res.append((pstats.func_std_string(func), calls, own_time, cumulative_time))
+        return res
@@ -16,17 +16,94 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library.
 from __future__ import annotations
+from collections import Counter
+import datetime
 import io
+import json
 import os
 import os.path
 import sys
+import threading
+from .instrument import format_size
+from .history import make_record
+from .logcapture import tail
 
 
 class Report:
+    # Number of functions listed for each profiled task
+    HOTSPOTS = 10
+    # Number of log lines shown for each failed task
+    LOG_TAIL = 20
+
     def __init__(self, hk):
         self.hk = hk
         self.dotfiles = []
         self.root = None
+        # JSON lines stream of run events, open while the run is in progress
+        self.stream = None
+        self.stream_lock = threading.Lock()
+        self.outcomes = Counter()
+
+    def write_event(self, event, **kw):
+        """
+        Write an event to the JSON lines stream, flushing it so that it can
+        be followed while the run is in progress
+        """
+        if self.stream is None:
+            return
+        kw["event"] = event
+        kw["time"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        line = json.dumps(kw, sort_keys=True, default=str) + "\n"
+        with self.stream_lock:
+            self.stream.write(line)
+            self.stream.flush()
+
+    def run_started(self):
+        """
+        Open report.jsonl in the report directory, and write the schedule of
+        the run in it
+        """
+        self.stream = io.open(
+                os.path.join(self.hk.outdir.path("report"), "report.jsonl"), "at", encoding="utf8")
+        self.outcomes = Counter()
+        stages = []
+        for name in self.hk.stage_schedule.sequence:
+            stage = self.hk.stages[name]
+            stages.append({
+                "name": name,
+                "tasks": [task.IDENTIFIER for task in stage.get_schedule()],
+            })
+        self.write_event(
+            "run-started", outdir=self.hk.outdir.path(), dry_run=self.hk.dry_run, workers=self.hk.workers,
+            stages=stages)
+
+    def task_finished(self, run_info):
+        """
+        Write the outcome of a task that has been run or skipped
+        """
+        record = make_record(run_info, dry_run=self.hk.dry_run)
+        record["start"] = record["start"].isoformat()
+        record["mock"] = bool(run_info.mock)
+        record["skipped_reason"] = run_info.skipped_reason
+        record["exception_message"] = None
+        if run_info.exception is not None:
+            record["exception_message"] = str(run_info.exception[1])
+        record["node"] = run_info.node
+        record["resource_wait"] = run_info.resource_wait
+        with self.stream_lock:
+            self.outcomes[run_info.outcome] += 1
+        self.write_event("task-finished", **record)
+
+    def run_finished(self):
+        """
+        Write a summary of the outcomes of the run, and close the stream
+        """
+        if self.stream is None:
+            return
+        self.write_event("run-finished", outcomes=dict(self.outcomes))
+        with self.stream_lock:
+            self.stream.close()
+            self.stream = None
 
     def make_dotfile(self, name):
         self.dotfiles.append(name)
@@ -99,9 +176,137 @@ class Report:
             self.print_depgraph_legend(file=file)
             print("", file=file)
 
+            self.print_run_info(stage, file=file)
+            self.print_resource_wait(stage, file=file)
+            self.print_hotspots(stage, file=file)
+            self.print_logs(stage, file=file)
+
             # TODO: add task docstring
-            # TODO: add task run info
-            # TODO: add task log
+
+    def print_table(self, title, rows, file=sys.stdout):
+        """
+        Print a list-table, using the first row as header
+        """
+        print(".. list-table:: {}".format(title), file=file)
+        print("   :header-rows: 1", file=file)
+        print("", file=file)
+        for row in rows:
+            print("   * - {}".format(row[0]), file=file)
+            for cell in row[1:]:
+                print("     - {}".format(cell), file=file)
+        print("", file=file)
+
+    def print_run_info(self, stage, file=sys.stdout):
+        """
+        Print a table with the outcome and resource usage of each task in a
+        stage
+        """
+        def fmt(value, format="{:.2f}s"):
+            if value is None:
+                return ""
+            return format.format(value)
+
+        rows = [("Task", "Outcome", "Elapsed", "CPU user", "CPU system", "RSS change", "Peak RSS",
+                 "Queries", "Query time")]
+        for task in stage.get_schedule():
+            run_info = stage.get_results(task)
+            if run_info is None:
+                rows.append((task.IDENTIFIER, "not run", "", "", "", "", "", "", ""))
+                continue
+            outcome = run_info.outcome
+            if run_info.node is not None:
+                outcome = "{} on {}".format(outcome, run_info.node)
+            usage = run_info.usage
+            if usage is None:
+                rows.append((task.IDENTIFIER, outcome, run_info.elapsed, "", "", "", "", "", ""))
+                continue
+            rows.append((
+                task.IDENTIFIER, outcome, run_info.elapsed,
+                fmt(usage.cpu_user), fmt(usage.cpu_system),
+                format_size(usage.rss_delta) if usage.rss_delta is not None else "",
+                format_size(usage.peak_rss) if usage.peak_rss is not None else "",
+                fmt(usage.db_queries, "{}"), fmt(usage.db_time, "{:.3f}s")))
+        self.print_table("Task results", rows, file=file)
+
+    def print_resource_wait(self, stage, file=sys.stdout):
+        """
+        Print a table with the time tasks spent waiting for each resource
+        """
+        tags = set()
+        for run_info in stage.results.values():
+            tags.update(run_info.resource_wait)
+        if not tags:
+            return
+        tags = sorted(tags)
+
+        rows = [["Task"] + tags]
+        totals = dict.fromkeys(tags, 0.0)
+        for task in stage.get_schedule():
+            run_info = stage.get_results(task)
+            if run_info is None or not run_info.resource_wait:
+                continue
+            row = [task.IDENTIFIER]
+            for tag in tags:
+                wait = run_info.resource_wait.get(tag)
+                if wait is None:
+                    row.append("")
+                else:
+                    row.append("{:.2f}s".format(wait))
+                    totals[tag] += wait
+            rows.append(row)
+        rows.append(["Total"] + ["{:.2f}s".format(totals[tag]) for tag in tags])
+        self.print_table("Time waiting for resources", rows, file=file)
+
+    def print_hotspots(self, stage, file=sys.stdout):
+        """
+        Print the functions where profiled tasks spent most of their time
+        """
+        for task in stage.get_schedule():
+            run_info = stage.get_results(task)
+            if run_info is None or run_info.profiler is None:
+                continue
+            hotspots = run_info.profiler.hotspots(self.HOTSPOTS)
+            if not hotspots:
+                continue
+            self.print_title("Profile of {}".format(task.IDENTIFIER), "~", file=file)
+            print("Full profile: ``{}``".format(
+                os.path.relpath(run_info.profiler.prof_file, self.hk.outdir.path())), file=file)
+            print("", file=file)
+            rows = [("Function", "Calls", "Own time", "Cumulative time")]
+            for func, calls, own_time, cumulative_time in hotspots:
+                rows.append(("``{}``".format(func), calls, "{:.3f}s".format(own_time),
+                             "{:.3f}s".format(cumulative_time)))
+            self.print_table("Hotspots", rows, file=file)
+
+    def print_logs(self, stage, file=sys.stdout):
+        """
+        Link the captured log of each task, showing its last lines for the
+        tasks that did not run successfully
+        """
+        rows = [("Task", "Log")]
+        failures = []
+        for task in stage.get_schedule():
+            run_info = stage.get_results(task)
+            if run_info is None or run_info.log_file is None or not os.path.exists(run_info.log_file):
+                continue
+            relpath = os.path.relpath(run_info.log_file, self.hk.outdir.path())
+            rows.append((task.IDENTIFIER, "`{0} <../{0}>`_".format(relpath)))
+            if run_info.executed and not run_info.success:
+                failures.append((task, run_info))
+        if len(rows) == 1:
+            return
+        self.print_table("Task logs", rows, file=file)
+
+        for task, run_info in failures:
+            lines = tail(run_info.log_file, self.LOG_TAIL)
+            if not lines:
+                continue
+            self.print_title("Log of {}".format(task.IDENTIFIER), "~", file=file)
+            print("::", file=file)
+            print("", file=file)
+            for line in lines:
+                print("   " + line, file=file)
+            print("", file=file)
 
     def generate_dotfiles(self):
         """
@@ -0,0 +1,189 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+import datetime
+import logging
+import os
+import os.path
+import re
+import shutil
+from .streams import COMPRESSION_EXTENSIONS
+
+log = logging.getLogger(__name__)
+
+# Run directories created by Outdir, and their archives
+RUN_RE = re.compile(r"^(?P<date>\d{{8}})(?:-(?P<time>\d{{6}}))?(?:\.tar(?:{}))?$".format(
+    "|".join(re.escape(ext) for ext in sorted(COMPRESSION_EXTENSIONS.values()))))
+
+
+def disk_usage(path):
+    """
+    Return the total size in bytes of the files in a directory tree, or of a
+    file, without following symlinks
+    """
+    try:
+        st = os.stat(path, follow_symlinks=False)
+    except FileNotFoundError:
+        return 0
+    if not os.path.isdir(path) or os.path.islink(path):
+        return st.st_size
+    total = 0
+    pending = [path]
+    while pending:
+        with os.scandir(pending.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                else:
+                    total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
+class Run:
+    """
+    A past run in the output directory root, as a directory or an archive
+    """
+    def __init__(self, path, time):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.time = time
+        self._size = None
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = disk_usage(self.path)
+        return self._size
+
+    def __repr__(self):
+        return "Run({!r})".format(self.name)
+
+
+def list_runs(root):
+    """
+    Return the runs found in root, newest first
+    """
+    res = []
+    with os.scandir(root) as it:
+        for entry in it:
+            mo = RUN_RE.match(entry.name)
+            if mo is None:
+                continue
+            try:
+                time = datetime.datetime.strptime(mo.group("date") + (mo.group("time") or "000000"), "%Y%m%d%H%M%S")
+            except ValueError:
+                continue
+            res.append(Run(entry.path, time))
+    res.sort(key=lambda run: (run.time, run.name), reverse=True)
+    return res
+
+
+class RetentionPolicy:
+    """
+    Decide which past runs to keep.
+
+    keep_last: number of most recent runs to keep
+    keep_daily: number of days for which the last run of each day is kept
+    keep_weekly: number of weeks for which the last run of each week is kept
+    max_size: maximum total size in bytes of the kept runs. The oldest runs
+              are removed until the rest fits, but the most recent run is
+              always kept.
+
+    Runs not selected by any of keep_last, keep_daily or keep_weekly are
+    removed, unless none of them is set. The most recent run is always kept.
+    """
+    def __init__(self, keep_last=None, keep_daily=None, keep_weekly=None, max_size=None):
+        self.keep_last = keep_last
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self.max_size = max_size
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create a policy from a dict like the HOUSEKEEPING_RETENTION setting
+        """
+        unknown = set(config) - {"keep_last", "keep_daily", "keep_weekly", "max_size"}
+        if unknown:
+            raise ValueError("unknown retention options: {}".format(", ".join(sorted(unknown))))
+        return cls(**config)
+
+    def select(self, runs, now=None):
+        """
+        Return the list of runs to remove, from a list of runs sorted newest
+        first
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+
+        if self.keep_last is None and self.keep_daily is None and self.keep_weekly is None:
+            keep = list(runs)
+        else:
+            keep = set(runs[:1])
+            if self.keep_last is not None:
+                keep.update(runs[:self.keep_last])
+            if self.keep_daily is not None:
+                since = (now - datetime.timedelta(days=self.keep_daily)).date()
+                days = set()
+                for run in runs:
+                    day = run.time.date()
+                    if day > since and day not in days:
+                        days.add(day)
+                        keep.add(run)
+            if self.keep_weekly is not None:
+                since = (now - datetime.timedelta(weeks=self.keep_weekly)).date()
+                weeks = set()
+                for run in runs:
+                    week = run.time.isocalendar()[:2]
+                    if run.time.date() > since and week not in weeks:
+                        weeks.add(week)
+                        keep.add(run)
+            keep = [run for run in runs if run in keep]
+
+        if self.max_size is not None:
+            total = 0
+            for idx, run in enumerate(keep):
+                total += run.size
+                if total > self.max_size and idx > 0:
+                    keep = keep[:idx]
+                    break
+
+        keep = set(keep)
+        return [run for run in runs if run not in keep]
+
+
+def prune(root, policy, dry_run=False, exclude=()):
+    """
+    Remove the runs in root that policy does not keep. The pathnames in
+    exclude, like the current run, count towards the policy but are never
+    removed.
+
+    If dry_run is True, only log what would be removed.
+
+    Returns the list of removed runs.
+    """
+    removed = [run for run in policy.select(list_runs(root)) if run.path not in exclude]
+    for run in removed:
+        if dry_run:
+            log.info("would remove old run %s", run.path)
+            continue
+        log.info("removing old run %s", run.path)
+        if os.path.isdir(run.path) and not os.path.islink(run.path):
+            shutil.rmtree(run.path)
+        else:
+            os.unlink(run.path)
+    return removed
@@ -18,17 +18,44 @@ from __future__ import annotations
 from .task import Task
 from . import toposort
 from .report import Report
-from collections import defaultdict
+from .db import close_db_connections
+from .eventloop import EventLoopThread
+from .history import JSONLinesHistory, make_record
+from .instrument import Usage
+from .profiling import TaskProfiler
+from .discovery import Manifest, TaskStub
+from .coordination import Lease
+from .locking import FileLock, LockedError
+from .metrics import TextfileMetrics
+from .logcapture import LogCapture, current_task_log, with_task_log
+from .archive import BackgroundCompressor, archive_directory, open_archived
+from .streams import COMPRESSION_EXTENSIONS, guess_compression, open_reader, open_stream
+from .retention import RetentionPolicy, prune
+from . import process
+from collections import defaultdict, Counter
+from importlib import import_module
+from concurrent import futures
+import contextlib
+import contextvars
+import hashlib
+import asyncio
+import heapq
 import os
 import os.path
+import re
+import shutil
 import datetime
 import sys
+import threading
 import time
 import inspect
 import logging
 
 log = logging.getLogger(__name__)
 
+# Names of the directories created by Outdir for each run
+RUN_DIR_RE = re.compile(r"^\d{8}(?:-\d{6})?$")
+
 
 class RunInfo:
     """
@@ -42,25 +69,131 @@ class RunInfo:
         self.skipped_reason = None
         self.exception = None
         self.success = False
+        self.up_to_date = False
+        self.timed_out = False
+        self.restored = False
+        # Node that ran the task, if it was run by another process of a
+        # distributed run
+        self.node = None
+        # Seconds spent waiting for each resource before starting
+        self.resource_wait = {}
+        # Pathname of the captured log of the task, if any
+        self.log_file = None
+        self.fingerprint = None
+        # Resources used by the task, as an instrument.Usage object, if they
+        # have been measured
+        self.usage = None
+        # profiling.TaskProfiler used to profile the task, if it was profiled
+        self.profiler = None
+        # Thread still running the task after giving up on it for timing out
+        self.abandoned = None
         self.elapsed = None
+        self.start = datetime.datetime.now(datetime.timezone.utc)
         self.clock_start = time.perf_counter()
 
-    def set_success(self):
-        self.elapsed = datetime.timedelta(seconds=time.perf_counter() - self.clock_start)
+    @property
+    def outcome(self):
+        """
+        Short description of the result of the run
+        """
+        if self.up_to_date:
+            return "up-to-date"
+        if self.timed_out:
+            return "timed-out"
+        if self.success:
+            return "success"
+        if not self.executed:
+            return "skipped"
+        return "failed"
+
+    def _set_elapsed(self, elapsed=None):
+        if elapsed is None:
+            elapsed = time.perf_counter() - self.clock_start
+        self.elapsed = datetime.timedelta(seconds=elapsed)
+
+    def describe(self):
+        """
+        Describe the run time and the resources used by the task
+        """
+        if self.usage is None:
+            return str(self.elapsed)
+        usage = str(self.usage)
+        if not usage:
+            return str(self.elapsed)
+        return "{}, {}".format(self.elapsed, usage)
+
+    def set_success(self, elapsed=None):
+        self._set_elapsed(elapsed)
         self.exception = None
         self.skipped_reason = None
         self.success = True
         self.executed = True
         log.info(
-            "%s:%s:run_%s: ran successfully, %s", self.stage.name, self.task.IDENTIFIER, self.stage.name, self.elapsed)
+            "%s:%s:run_%s: ran successfully, %s", self.stage.name, self.task.IDENTIFIER, self.stage.name,
+            self.describe())
 
-    def set_exception(self, type, value, traceback):
-        self.elapsed = datetime.timedelta(seconds=time.perf_counter() - self.clock_start)
+    def set_exception(self, type, value, traceback, elapsed=None):
+        self._set_elapsed(elapsed)
         self.exception = (type, value, traceback)
         self.skipped_reason = None
         self.success = False
         self.executed = True
-        log.info("%s:%s:run_%s: failed, %s", self.stage.name, self.task.IDENTIFIER, self.stage.name, self.elapsed)
+        log.info("%s:%s:run_%s: failed, %s", self.stage.name, self.task.IDENTIFIER, self.stage.name, self.describe())
+
+    def set_timed_out(self, elapsed=None):
+        self._set_elapsed(elapsed)
+        self.exception = None
+        self.skipped_reason = None
+        self.success = False
+        self.executed = True
+        self.timed_out = True
+        log.info("%s:%s:run_%s: timed out, %s", self.stage.name, self.task.IDENTIFIER, self.stage.name, self.elapsed)
+
+    def set_up_to_date(self):
+        self._set_elapsed()
+        self.exception = None
+        self.skipped_reason = "it is up to date"
+        self.success = True
+        self.executed = False
+        self.up_to_date = True
+        log.info(
+            "%s:%s:run_%s: skipped: %s", self.stage.name, self.task.IDENTIFIER, self.stage.name, self.skipped_reason)
+
+    def set_restored(self, record):
+        """
+        Fill in the outcome of a task that ran successfully in a previous,
+        interrupted run, from its checkpoint record
+        """
+        self.start = record["start"]
+        self.elapsed = datetime.timedelta(seconds=record["elapsed"] or 0.0)
+        self.exception = None
+        self.skipped_reason = None
+        self.success = True
+        self.up_to_date = record["outcome"] == "up-to-date"
+        self.executed = not self.up_to_date
+        self.fingerprint = record.get("fingerprint")
+        self.restored = True
+        log.info(
+            "%s:%s:run_%s: already run in the resumed run", self.stage.name, self.task.IDENTIFIER, self.stage.name)
+
+    def set_remote(self, record):
+        """
+        Fill in the outcome of a task run by another node of a distributed
+        run, from the record it published
+        """
+        outcome = record["outcome"]
+        self.start = record["start"]
+        self.elapsed = datetime.timedelta(seconds=record["elapsed"] or 0.0)
+        self.exception = None
+        self.skipped_reason = "skipped by {}".format(record["node"]) if outcome == "skipped" else None
+        self.success = outcome in ("success", "up-to-date")
+        self.up_to_date = outcome == "up-to-date"
+        self.timed_out = outcome == "timed-out"
+        self.executed = outcome in ("success", "failed", "timed-out")
+        self.fingerprint = record.get("fingerprint")
+        self.node = record["node"]
+        log.info(
+            "%s:%s:run_%s: %s on %s", self.stage.name, self.task.IDENTIFIER, self.stage.name, outcome, self.node)
 
     def set_skipped(self, reason):
         self.elapsed = datetime.timedelta(seconds=0.0)
@@ -76,6 +209,13 @@ class Schedule:
     def __init__(self):
         self.graph = defaultdict(set)
         self.sequence = None
+        # Index of each node in sequence
+        self.position = None
+        # Expected run time of each node, if known
+        self.weights = None
+        # Length of the heaviest path starting from each node, if weights are
+        # known
+        self.priority = None
 
     def add_node(self, node):
         self.graph.setdefault(node, set())
@@ -83,8 +223,68 @@ class Schedule:
     def add_edge(self, node_prev, node_next):
         self.graph[node_prev].add(node_next)
 
-    def schedule(self):
-        self.sequence = toposort.sort(self.graph)
+    def schedule(self, weights=None):
+        """
+        Compute the sequence of nodes.
+
+        If weights is given, among the nodes that are ready to run, the ones
+        starting the heaviest path are scheduled first.
+        """
+        self.weights = weights
+        if weights is None:
+            self.priority = None
+        else:
+            self.priority = toposort.longest_paths(self.graph, weights)
+        self.sequence = toposort.sort(self.graph, self.priority)
+        self.position = {node: idx for idx, node in enumerate(self.sequence)}
+
+    def rank(self, node):
+        """
+        Sort key for choosing which node to run first among those that are
+        ready
+        """
+        if self.priority is None:
+            return (0.0, self.position[node])
+        return (-self.priority[node], self.position[node])
+
+    def critical_path(self):
+        """
+        Return the list of nodes in the heaviest path of the graph
+        """
+        if not self.priority:
+            return []
+        node = max(self.sequence, key=lambda x: self.priority[x])
+        res = [node]
+        while self.graph[node]:
+            node = max(self.graph[node], key=lambda x: self.priority[x])
+            res.append(node)
+        return res
+
+    def predict_duration(self, workers=1):
+        """
+        Simulate running the schedule with the given number of workers, and
+        return the predicted total run time in seconds
+        """
+        weights = self.weights or {}
+        waiting = Counter()
+        for node in self.sequence:
+            for successor in self.graph[node]:
+                waiting[successor] += 1
+        ready = [(self.rank(node), node) for node in self.sequence if waiting[node] == 0]
+        heapq.heapify(ready)
+
+        now = 0.0
+        running = []
+        while ready or running:
+            while ready and len(running) < workers:
+                rank, node = heapq.heappop(ready)
+                heapq.heappush(running, (now + weights.get(node, 0.0), rank, node))
+            now, rank, node = heapq.heappop(running)
+            for successor in self.graph[node]:
+                waiting[successor] -= 1
+                if waiting[successor] == 0:
+                    heapq.heappush(ready, (self.rank(successor), successor))
+        return now
 
     def make_dot(self, out, formatter=str):
         for node in self.sequence:
@@ -139,7 +339,13 @@ class Stage:
                     continue
                 self.task_schedule.add_edge(prev, next)
 
-        self.task_schedule.schedule()
+        weights = None
+        if self.hk.durations is not None:
+            weights = {}
+            for identifier in self.tasks:
+                weights[identifier] = self.hk.durations.get("{}:{}".format(self.name, identifier), 0.0)
+
+        self.task_schedule.schedule(weights=weights)
 
     def get_schedule(self):
         """
@@ -154,6 +360,14 @@ class Stage:
         """
         return self.results.get(task.IDENTIFIER, None)
 
+    def set_results(self, run_info):
+        """
+        Store the RunInfo of a task that has finished running or has been
+        skipped
+        """
+        self.results[run_info.task.IDENTIFIER] = run_info
+        self.hk.task_finished(run_info)
+
     def reason_task_should_not_run(self, task, run_filter=None):
         """
         If the task can run, it returns None.
@@ -177,8 +391,12 @@ class Stage:
             exinfo = self.get_results(t)
             if exinfo is None:
                 return "its dependency {} has not been run".format(t.IDENTIFIER)
+            if exinfo.up_to_date:
+                continue
             if not exinfo.executed:
                 return "its dependency {} has not been run".format(t.IDENTIFIER)
+            if exinfo.timed_out:
+                return "its dependency {} timed out".format(t.IDENTIFIER)
             if not exinfo.success:
                 return "its dependency {} has not run successfully".format(t.IDENTIFIER)
         return None
@@ -186,47 +404,540 @@ class Stage:
     def run_task(self, task, mock):
         run_info = RunInfo(self, task, mock=mock)
 
-        # TODO: also store and log execution time
-
         meth_name = "run_{}".format(self.name)
         method = getattr(task, meth_name, None)
         if method is None:
-            run_info.set_skipped("%s has no method %s", self.task.IDENTIFIER, meth_name)
+            run_info.set_skipped("{} has no method {}".format(task.IDENTIFIER, meth_name))
             return run_info
 
         if mock:
             run_info.set_success()
+            return run_info
+
+        with self.capture_log(task, run_info):
+            lock = self.get_task_lock(task)
+            if lock is not None:
+                try:
+                    acquired = lock.acquire(self.hk.lock_mode or "wait", timeout=self.hk.lock_timeout)
+                except LockedError:
+                    log.error("%s: %s", task.IDENTIFIER, sys.exc_info()[1])
+                    run_info.set_exception(*sys.exc_info())
+                    return run_info
+                if not acquired:
+                    run_info.set_skipped("it is running in another process")
+                    return run_info
+
+            try:
+                self.run_task_method(task, method, run_info)
+            finally:
+                if lock is not None:
+                    self.release_task_lock(task, lock, run_info)
+        return run_info
+
+    def release_task_lock(self, task, lock, run_info):
+        """
+        Release the lock of an EXCLUSIVE task, waiting in the background for
+        the task to stop if it has been abandoned
+        """
+        if run_info.abandoned is None:
+            lock.release()
+            return
+
+        def release():
+            run_info.abandoned.join()
+            lock.release()
+
+        log.warning("%s: keeping its lock until the abandoned task stops", task.IDENTIFIER)
+        threading.Thread(target=release, name="housekeeping-unlock-{}".format(task.IDENTIFIER), daemon=True).start()
+
+    @contextlib.contextmanager
+    def capture_log(self, task, run_info):
+        """
+        Capture the log and output of a task in its own file, if log capture
+        is enabled
+        """
+        capture = self.hk.log_capture
+        if capture is None:
+            yield
+            return
+        run_info.log_file = capture.task_started(self, task)
+        try:
+            yield
+        finally:
+            capture.task_finished(run_info.log_file)
+
+    def run_task_method(self, task, method, run_info):
+        """
+        Run the run_<stage> method of a task, unless it is up to date, storing
+        the outcome in run_info
+        """
+        self.hk.task_started(self, task)
+        try:
+            fingerprint = task.fingerprint(self)
+        except Exception:
+            log.exception("%s: fingerprint failed, running the task anyway", task.IDENTIFIER)
+            fingerprint = None
+        if self.check_fingerprint(run_info, fingerprint):
+            return
+
+        task.cancelled = threading.Event()
+        timeout = self.get_timeout(task)
+        run_info.profiler = self.get_profiler(task)
+        if self.should_run_in_subprocess(task):
+            self.run_task_in_subprocess(task, method, run_info, timeout)
+        elif timeout is not None:
+            self.run_task_with_timeout(task, method, run_info, timeout)
         else:
+            run_info.usage = Usage()
             try:
-                if not mock:
-                    method(self)
+                with run_info.usage, run_info.profiler or contextlib.nullcontext():
+                    self.call_method(method)
             except KeyboardInterrupt:
                 raise
             except Exception:
-                log.exception("%s: %s failed", task.IDENTIFIER, meth_name)
+                log.exception("%s: %s failed", task.IDENTIFIER, method.__name__)
                 run_info.set_exception(*sys.exc_info())
             else:
                 run_info.set_success()
 
+    def get_task_lock(self, task):
+        """
+        Return the FileLock to hold while running an EXCLUSIVE task, or None
+        """
+        if not task.EXCLUSIVE or not self.hk.outdir:
+            return None
+        return FileLock(os.path.join(self.hk.outdir.root, "locks", "{}.lock".format(task.IDENTIFIER)))
+
+    def call_method(self, method):
+        """
+        Call a run_<stage> method, running it in the event loop if it is a
+        coroutine function
+        """
+        if inspect.iscoroutinefunction(method):
+            coro = method(self)
+            # Coroutines do not inherit the context of this thread
+            pathname = current_task_log.get()
+            if pathname is not None:
+                coro = with_task_log(coro, pathname)
+            self.hk.event_loop.submit(coro).result()
+        else:
+            method(self)
+
+    def get_profiler(self, task):
+        """
+        Return a TaskProfiler if the task should be profiled, else None
+        """
+        if self.hk.profile_filter is None or self.hk.outdir is None:
+            return None
+        if not self.hk.profile_filter("{}:{}".format(self.name, task.IDENTIFIER)):
+            return None
+        if self.is_async(task):
+            log.warning("%s: async tasks share the event loop thread, and cannot be profiled", task.IDENTIFIER)
+            return None
+        return TaskProfiler(
+                os.path.join(self.hk.outdir.path("profiles"), "{}-{}".format(self.name, task.IDENTIFIER)),
+                flamegraph=self.hk.profile_flamegraph)
+
+    def get_timeout(self, task):
+        """
+        Return the maximum run time of a task in seconds, or None if it can run
+        for as long as it wants
+        """
+        if task.TIMEOUT is not None:
+            return task.TIMEOUT
+        return self.hk.task_timeout
+
+    def run_task_with_timeout(self, task, method, run_info, timeout):
+        """
+        Run a task method in a separate thread, filling run_info with its
+        outcome, and giving up on it if it runs for longer than timeout seconds
+        """
+        outcome = []
+        usage = Usage()
+
+        def target():
+            try:
+                with usage, run_info.profiler or contextlib.nullcontext():
+                    self.call_method(method)
+            except BaseException:
+                outcome.append(sys.exc_info())
+            else:
+                outcome.append(None)
+            finally:
+                close_db_connections()
+
+        # Run in a copy of the current context, to keep capturing the task log
+        thread = threading.Thread(
+                target=contextvars.copy_context().run, args=(target,),
+                name="housekeeping-{}-{}".format(self.name, task.IDENTIFIER), daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            log.warning("%s: %s is still running after %s seconds: cancelling it",
+                        task.IDENTIFIER, method.__name__, timeout)
+            task.cancelled.set()
+            thread.join(self.hk.timeout_grace)
+            if thread.is_alive():
+                log.error("%s: %s did not stop after being cancelled: abandoning it",
+                          task.IDENTIFIER, method.__name__)
+                run_info.abandoned = thread
+            run_info.set_timed_out()
+            return
+
+        run_info.usage = usage
+        exc_info = outcome[0]
+        # Only propagate KeyboardInterrupt, SystemExit and the like
+        if exc_info is not None and not issubclass(exc_info[0], Exception):
+            raise exc_info[1]
+        if exc_info is None:
+            run_info.set_success()
+        else:
+            log.error("%s: %s failed", task.IDENTIFIER, method.__name__, exc_info=exc_info)
+            run_info.set_exception(*exc_info)
+
+    def check_fingerprint(self, run_info, fingerprint):
+        """
+        Store the digest of a task fingerprint in run_info, and mark the task
+        as up to date if it matches the fingerprint of its last successful run.
+
+        Returns True if the task is up to date.
+        """
+        if fingerprint is None:
+            return False
+        run_info.fingerprint = hashlib.sha256(str(fingerprint).encode()).hexdigest()
+        if self.hk.history is None:
+            return False
+        if self.hk.history.last_fingerprint(self.name, run_info.task.IDENTIFIER) != run_info.fingerprint:
+            return False
+        run_info.set_up_to_date()
+        return True
+
+    async def run_task_async(self, task, mock):
+        """
+        Coroutine version of run_task, for tasks with an async run_<stage>
+        method
+        """
+        run_info = RunInfo(self, task, mock=mock)
+        meth_name = "run_{}".format(self.name)
+        method = getattr(task, meth_name)
+
+        if mock:
+            run_info.set_success()
+            return run_info
+
+        with self.capture_log(task, run_info):
+            await self.run_task_method_async(task, method, run_info)
         return run_info
 
+    async def run_task_method_async(self, task, method, run_info):
+        """
+        Coroutine version of run_task_method
+        """
+        self.hk.task_started(self, task)
+        try:
+            fingerprint = task.fingerprint(self)
+            if inspect.isawaitable(fingerprint):
+                fingerprint = await fingerprint
+        except Exception:
+            log.exception("%s: fingerprint failed, running the task anyway", task.IDENTIFIER)
+            fingerprint = None
+        if self.check_fingerprint(run_info, fingerprint):
+            return
+
+        task.cancelled = threading.Event()
+        timeout = self.get_timeout(task)
+        try:
+            if timeout is None:
+                await method(self)
+            elif not await self.await_with_timeout(task, method(self), timeout):
+                run_info.set_timed_out()
+                return
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            log.exception("%s: %s failed", task.IDENTIFIER, method.__name__)
+            run_info.set_exception(*sys.exc_info())
+        else:
+            run_info.set_success()
+
+    async def await_with_timeout(self, task, coro, timeout):
+        """
+        Await a coroutine, cancelling it if it runs for longer than timeout
+        seconds.
+
+        Returns False if the coroutine timed out.
+        """
+        future = asyncio.ensure_future(coro)
+        done, pending = await asyncio.wait({future}, timeout=timeout)
+        if done:
+            future.result()
+            return True
+
+        log.warning("%s: run_%s is still running after %s seconds: cancelling it", task.IDENTIFIER, self.name, timeout)
+        task.cancelled.set()
+        future.cancel()
+        done, pending = await asyncio.wait({future}, timeout=self.hk.timeout_grace)
+        if pending:
+            log.error("%s: run_%s did not stop after being cancelled: abandoning it", task.IDENTIFIER, self.name)
+        elif not future.cancelled() and future.exception() is not None:
+            log.error("%s: run_%s failed while being cancelled", task.IDENTIFIER, self.name,
+                      exc_info=future.exception())
+        return False
+
+    def is_async(self, task):
+        """
+        Check if the task method for this stage is a coroutine function
+        """
+        return inspect.iscoroutinefunction(getattr(task, "run_{}".format(self.name), None))
+
+    def should_run_in_subprocess(self, task):
+        """
+        Check if a task should be run in a separate process
+        """
+        if task.RUN_IN_SUBPROCESS:
+            return True
+        if self.hk.subprocess_filter is None:
+            return False
+        return self.hk.subprocess_filter("{}:{}".format(self.name, task.IDENTIFIER))
+
+    def run_task_in_subprocess(self, task, method, run_info, timeout=None):
+        """
+        Run a task method in a forked process, filling run_info with its outcome
+        """
+        # Do not share database connections with the child process
+        close_db_connections()
+        result = process.run(
+                self, method, timeout=timeout, grace=self.hk.timeout_grace, profiler=run_info.profiler)
+        run_info.usage = result.usage
+        if result.timed_out:
+            run_info.set_timed_out()
+        elif result.exception is None:
+            run_info.set_success(elapsed=result.elapsed)
+        elif isinstance(result.exception, KeyboardInterrupt):
+            raise result.exception
+        else:
+            run_info.set_exception(
+                    type(result.exception), result.exception, result.exception.__traceback__, elapsed=result.elapsed)
+
+    def run_task_in_thread(self, task, mock):
+        """
+        Run a task in a worker thread, closing the database connections that it
+        opened before returning the thread to the pool
+        """
+        try:
+            return self.run_task(task, mock)
+        finally:
+            close_db_connections()
+
+    def start_task(self, executor, task, mock):
+        """
+        Start running a task, returning a concurrent.futures.Future with its
+        RunInfo.
+
+        Async tasks are run in the event loop, and all other tasks in executor.
+        """
+        # Exclusive tasks wait for their lock in a worker thread
+        if self.is_async(task) and not self.should_run_in_subprocess(task) and not task.EXCLUSIVE:
+            return self.hk.event_loop.submit(self.run_task_async(task, mock))
+        return executor.submit(self.run_task_in_thread, task, mock)
+
     def run(self, run_filter=None):
+        if self.hk.coordinator is not None:
+            self.run_distributed(run_filter=run_filter)
+            return
+
+        # Async tasks can only run at the same time as other tasks with the
+        # dependency-aware scheduler
+        if self.hk.workers > 1 or any(self.is_async(task) for task in self.tasks.values()):
+            self.run_parallel(run_filter=run_filter)
+            return
+
         for identifier in self.task_schedule.sequence:
+            # Skip tasks restored from a resumed run
+            if identifier in self.results:
+                continue
             task = self.tasks[identifier]
             should_not_run = self.reason_task_should_not_run(task, run_filter=run_filter)
             if should_not_run is not None:
                 run_info = RunInfo(self, task)
                 run_info.set_skipped(should_not_run)
-                self.results[identifier] = run_info
+                self.set_results(run_info)
                 continue
             mock = self.hk.test_mock and isinstance(task, self.hk.test_mock)
-            self.results[identifier] = self.run_task(task, mock)
+            self.set_results(self.run_task(task, mock))
+
+    def run_distributed(self, run_filter=None):
+        """
+        Run tasks together with the other Housekeeping processes that share
+        the same coordinator and run_id.
+
+        Each task is run by the first process that claims it, and the
+        outcomes published by the other processes are used to check
+        dependencies. Tasks are taken in schedule order, skipping those that
+        are running elsewhere or whose dependencies have not finished yet.
+        """
+        hk = self.hk
+        pending = [x for x in self.task_schedule.sequence if x not in self.results]
+        while pending:
+            progress = False
+            for identifier in list(pending):
+                task = self.tasks[identifier]
+                # Wait for dependencies that are still running
+                if any(t.IDENTIFIER in self.tasks and t.IDENTIFIER not in self.results for t in task.DEPENDS):
+                    continue
+
+                name = "{}:{}".format(self.name, identifier)
+                record = hk.coordinator.outcome(hk.run_id, self.name, identifier)
+                if record is not None:
+                    run_info = RunInfo(self, task)
+                    run_info.set_remote(record)
+                    self.set_results(run_info)
+                elif run_filter and not run_filter(name):
+                    # Tasks filtered out on this node are not claimed, so
+                    # that other nodes can run them
+                    run_info = RunInfo(self, task)
+                    run_info.set_skipped("does to match current stage/task filter")
+                    self.set_results(run_info)
+                elif hk.coordinator.claim(hk.run_id, self.name, identifier, hk.node, hk.lease_duration):
+                    with Lease(hk.coordinator, hk.run_id, self.name, identifier, hk.node, hk.lease_duration):
+                        should_not_run = self.reason_task_should_not_run(task)
+                        if should_not_run is not None:
+                            run_info = RunInfo(self, task)
+                            run_info.set_skipped(should_not_run)
+                        else:
+                            mock = hk.test_mock and isinstance(task, hk.test_mock)
+                            run_info = self.run_task(task, mock)
+                    hk.coordinator.publish(hk.run_id, hk.node, make_record(run_info, dry_run=hk.dry_run))
+                    self.set_results(run_info)
+                else:
+                    # Another node is running it
+                    continue
+
+                pending.remove(identifier)
+                progress = True
+
+            if pending and not progress:
+                time.sleep(hk.poll_interval)
+
+    def run_parallel(self, run_filter=None):
+        """
+        Run tasks using a pool of worker threads, starting each task as soon as
+        all its dependencies in this stage have been run.
+
+        Async tasks are run concurrently in the event loop, and do not take up
+        worker threads.
+
+        Tasks declaring RESOURCES are only started if the resources they need
+        are available, according to the capacities in Housekeeping.resources.
+        While they wait, lower ranked tasks that fit can be started instead.
+        """
+        sequence = self.task_schedule.sequence
+        graph = self.task_schedule.graph
+
+        # Start ready tasks in the order that the schedule prefers
+        rank = {identifier: self.task_schedule.rank(identifier) for identifier in sequence}
+
+        # Count the dependencies that have not been run yet for each task
+        waiting = Counter()
+        for identifier in sequence:
+            for successor in graph[identifier]:
+                waiting[successor] += 1
+        ready = [(rank[x], x) for x in sequence if waiting[x] == 0]
+        heapq.heapify(ready)
+
+        def mark_done(identifier):
+            for successor in graph[identifier]:
+                waiting[successor] -= 1
+                if waiting[successor] == 0:
+                    heapq.heappush(ready, (rank[successor], successor))
+
+        # Available amount of each resource with a configured capacity
+        capacity = self.hk.resources or {}
+        available = dict(capacity)
+        # Resources held by running tasks
+        held = {}
+        # Ready tasks that wait for resources, mapped to the time when they
+        # started waiting and the resources they were short of
+        blocked = {}
+        # Time spent waiting for each resource by each task
+        resource_wait = defaultdict(Counter)
+
+        def requirements(task):
+            # A task cannot need more than the whole capacity of a resource
+            return {tag: min(amount, capacity[tag]) for tag, amount in task.RESOURCES.items() if tag in capacity}
+
+        def release(identifier):
+            for tag, amount in held.pop(identifier, {}).items():
+                available[tag] += amount
+            # Check again the tasks that are waiting for resources
+            now = time.perf_counter()
+            for other, (since, short) in blocked.items():
+                for tag in short:
+                    resource_wait[other][tag] += now - since
+                heapq.heappush(ready, (rank[other], other))
+            blocked.clear()
+
+        running = {}
+        executor = futures.ThreadPoolExecutor(
+                max_workers=self.hk.workers, thread_name_prefix="housekeeping-{}".format(self.name))
+        try:
+            while ready or running:
+                while ready:
+                    identifier = heapq.heappop(ready)[1]
+                    # Skip tasks restored from a resumed run
+                    if identifier in self.results:
+                        mark_done(identifier)
+                        continue
+                    task = self.tasks[identifier]
+                    should_not_run = self.reason_task_should_not_run(task, run_filter=run_filter)
+                    if should_not_run is not None:
+                        run_info = RunInfo(self, task)
+                        run_info.set_skipped(should_not_run)
+                        self.set_results(run_info)
+                        mark_done(identifier)
+                        continue
+                    needed = requirements(task)
+                    short = [tag for tag, amount in needed.items() if available[tag] < amount]
+                    if short:
+                        log.debug("%s:%s: waiting for %s", self.name, identifier, ", ".join(short))
+                        blocked[identifier] = (time.perf_counter(), short)
+                        continue
+                    for tag, amount in needed.items():
+                        available[tag] -= amount
+                    held[identifier] = needed
+                    mock = self.hk.test_mock and isinstance(task, self.hk.test_mock)
+                    running[self.start_task(executor, task, mock)] = identifier
+
+                if not running:
+                    break
+
+                done, pending = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    identifier = running.pop(future)
+                    release(identifier)
+                    run_info = future.result()
+                    run_info.resource_wait = dict(resource_wait.pop(identifier, {}))
+                    self.set_results(run_info)
+                    mark_done(identifier)
+        except BaseException:
+            for future in running:
+                future.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        else:
+            executor.shutdown()
 
 
 class Outdir(object):
-    def __init__(self, root):
+    def __init__(self, root, archive=None):
         self.root = root
         self.outdir = None
+        # Compression format used to archive the run directory at the end of
+        # the run, or None to keep it as it is
+        self.archive = archive
+        self.compressor = BackgroundCompressor()
+        # Pathname of the archive of the run directory, once it is archived
+        self.archive_path = None
 
     def init(self, hk):
         # Ensure the root dir exists
@@ -234,6 +945,23 @@ class Outdir(object):
             log.warning("output directory %s does not exist: creating it", self.root)
             os.makedirs(self.root, 0o777)
 
+        # Reuse the directory of the run that we are resuming
+        if hk.resume is not None:
+            if hk.resume is True:
+                self.outdir = self.latest()
+                if self.outdir is None:
+                    raise Exception("cannot resume: no previous runs found in {}".format(self.root))
+                if not os.path.isdir(self.outdir):
+                    raise Exception("cannot resume: the latest run {} has been archived".format(self.outdir))
+            elif os.path.isdir(hk.resume):
+                self.outdir = hk.resume
+            else:
+                self.outdir = os.path.join(self.root, hk.resume)
+                if not os.path.isdir(self.outdir):
+                    raise Exception("cannot resume: {} is not a directory".format(self.outdir))
+            log.info("resuming run in %s", self.outdir)
+            return
+
         # Create a new directory for this maintenance run
         candidate = None
         while True:
@@ -242,6 +970,9 @@ class Outdir(object):
             else:
                 time.sleep(0.5)
                 candidate = os.path.join(self.root, datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S"))
+            # The names of archived runs are taken too
+            if any(os.path.exists("{}.tar{}".format(candidate, ext)) for ext in COMPRESSION_EXTENSIONS.values()):
+                continue
             try:
                 os.mkdir(candidate, 0o777)
                 break
@@ -252,6 +983,30 @@ class Outdir(object):
 
         self.outdir = candidate
 
+    def runs(self):
+        """
+        Generate (name, path) for the run directories and archives in root
+        """
+        for entry in os.scandir(self.root):
+            if entry.is_dir():
+                name = entry.name
+            else:
+                name, sep, ext = entry.name.partition(".tar")
+                if not sep or ext not in COMPRESSION_EXTENSIONS.values():
+                    continue
+            if RUN_DIR_RE.match(name):
+                yield name, entry.path
+
+    def latest(self):
+        """
+        Return the path of the run directory, or of the archive, of the most
+        recent run, or None if there are none
+        """
+        runs = list(self.runs())
+        if not runs:
+            return None
+        return max(runs)[1]
+
     def path(self, relpath=None):
         """
         Make sure the given subpath exists inside the output directory, and
@@ -264,16 +1019,84 @@ class Outdir(object):
             os.makedirs(res, 0o777)
         return res
 
+    def previous(self):
+        """
+        Return the path of the run directory, or of the archive, of the most
+        recent run before the current one, or None if there are none
+        """
+        current = os.path.basename(self.outdir)
+        runs = [(name, path) for name, path in self.runs() if name < current]
+        if not runs:
+            return None
+        return max(runs)[1]
+
+    def open_stream(self, relpath, mode="wb", **kw):
+        """
+        Open a file inside the run directory for streaming, compressed
+        according to its extension (.gz, .xz, .zst).
+
+        Files open for writing appear atomically when closed, and can have a
+        checksum sidecar file. See streams.open_stream for the options.
+        """
+        return open_stream(os.path.join(self.outdir, relpath), mode, **kw)
+
+    def open_previous(self, relpath, mode="rb", compression=None, encoding="utf8"):
+        """
+        Open a file of the previous run for streaming reads, from its run
+        directory or from its archive.
+
+        Raises FileNotFoundError if there is no previous run, or if it does
+        not have the file.
+        """
+        previous = self.previous()
+        if previous is None:
+            raise FileNotFoundError("no previous runs found in {}".format(self.root))
+        if os.path.isdir(previous):
+            return open_stream(os.path.join(previous, relpath), mode, compression=compression, encoding=encoding)
+
+        # Stream the file out of the archive
+        name = os.path.basename(previous).partition(".tar")[0]
+        member = "/".join([name] + os.path.normpath(relpath).split(os.sep))
+        fd = open_archived(previous, member, guess_compression(previous))
+        if compression is None:
+            compression = guess_compression(relpath)
+        return open_reader(fd, mode, compression, encoding=encoding)
+
+    def compress(self, pathname):
+        """
+        Compress a file in the background, replacing it with its compressed
+        version. Relative pathnames are relative to the run directory.
+
+        Returns a concurrent.futures.Future with the pathname of the
+        compressed file.
+        """
+        return self.compressor.compress(os.path.join(self.outdir, pathname), self.archive or "xz")
+
+    def discard(self):
+        """
+        Remove the run directory of a run that did not take place
+        """
+        shutil.rmtree(self.outdir, ignore_errors=True)
+
     def cleanup(self):
-        pass
-        # TODO: optionally tar everything and remove the directory
+        """
+        Wait for background compressions, and archive the run directory if
+        requested
+        """
+        self.compressor.wait()
+        if self.archive is not None:
+            self.archive_path = archive_directory(self.outdir, self.archive)
 
 
 class Housekeeping:
     """
     Housekeeping runner, that runs all Tasks from all installed apps
     """
-    def __init__(self, outdir=None, dry_run=False, test_mock=None):
+    def __init__(self, outdir=None, dry_run=False, test_mock=None, workers=1, subprocess_filter=None,
+                 durations=None, history=None, resume=None, task_timeout=None, timeout_grace=10,
+                 profile_filter=None, profile_flamegraph=False, manifest=None, coordinator=None, run_id=None,
+                 node=None, lease_duration=60, poll_interval=1, lock_mode=None, lock_timeout=None,
+                 resources=None, metrics=None, capture_logs=True, archive=None, retention=None):
         """
         dry_run: if true, everything will be done except permanent changes
         outdir: root directory where we can create one directory for each
@@ -285,16 +1108,117 @@ class Housekeeping:
                    they are dependencies of tasks that will be run. Used during
                    tests when you know what you are doing, for example to skip
                    a database backup phase.
+        workers: number of tasks of the same stage that can be run at the same
+                 time in separate threads. A task is started as soon as all
+                 its dependencies in the stage have been run.
+        subprocess_filter: function called with "stage:task" names, returning
+                           True for the tasks that should be run in a forked
+                           process, besides those with RUN_IN_SUBPROCESS set.
+        durations: dict mapping "stage:task" names to their expected run time
+                   in seconds. If set, tasks that start the longest chain of
+                   dependencies are run first. See also load_durations().
+        history: django_housekeeping.history.History object used to record
+                 the outcome of each task. By default, if there is an output
+                 directory, history is stored in history.jsonl in its root.
+        resume: directory of a previous, interrupted run to resume, or True
+                for the most recent one. Tasks that ran successfully according
+                to its checkpoint are not run again.
+        task_timeout: maximum run time in seconds for tasks that do not set
+                      TIMEOUT. Default: no limit.
+        timeout_grace: time in seconds that a task that ran past its timeout
+                       is given to stop after being cancelled. After that, the
+                       run moves on and a task run in a subprocess is killed.
+        profile_filter: function called with "stage:task" names, returning
+                        True for the tasks that should be profiled. Profiles
+                        are written in the profiles directory of the output
+                        directory.
+        profile_flamegraph: if true, also sample the stacks of profiled tasks,
+                            writing them in collapsed format for flamegraphs
+        manifest: pathname of a discovery manifest used to cache the results
+                  of autodiscover(), so that tasks can be listed and scheduled
+                  without importing their modules
+        coordinator: django_housekeeping.coordination.Coordinator used to
+                     share the tasks of the run with other Housekeeping
+                     processes using the same run_id
+        run_id: name of the distributed run, the same for all processes
+                taking part in it. Setting it without a coordinator uses the
+                one in the HOUSEKEEPING_COORDINATOR setting, or the database.
+        node: name of this process in a distributed run. Default: hostname
+              and process ID
+        lease_duration: time in seconds after which a task claimed by a
+                        process that stopped renewing its lease can be run
+                        by another process
+        poll_interval: time in seconds to wait before checking again for
+                       tasks run by other processes
+        lock_mode: if set, hold a lock in the output directory root during
+                   the run, so that only one run at a time can use it. It
+                   says what to do if another run holds the lock: "fail"
+                   raises locking.LockedError, "wait" waits for the lock,
+                   and "skip" does not run anything. It also applies to
+                   EXCLUSIVE tasks, which wait by default.
+        lock_timeout: maximum time in seconds to wait for a lock
+        resources: dict mapping resource tags to their capacity. When running
+                   tasks in parallel, tasks are only started if the sum of
+                   their RESOURCES, together with those of the running tasks,
+                   fits the capacity. Tags without a capacity are unlimited.
+        metrics: django_housekeeping.metrics.Metrics object updated as tasks
+                 start and finish
+        capture_logs: if true and there is an output directory, write the
+                      log records and the output of each task in the logs
+                      directory of the output directory
+        archive: compression format ("xz", or "zst" if the zstandard module
+                 is installed) used to archive the run directory into a
+                 tarball at the end of the run, removing the directory.
+                 Files compressed with Outdir.compress also use it.
+        retention: retention.RetentionPolicy used to remove old runs from
+                   the output directory at the end of each run
         """
 
         self.dry_run = dry_run
         self.test_mock = test_mock
+        self.workers = workers
+        self.subprocess_filter = subprocess_filter
+        self.durations = durations
+        self.history = history
+        self.resume = resume
+        self.task_timeout = task_timeout
+        self.timeout_grace = timeout_grace
+        self.profile_filter = profile_filter
+        self.profile_flamegraph = profile_flamegraph
+        self.manifest = Manifest(manifest) if manifest is not None else None
+        self.coordinator = coordinator
+        self.run_id = run_id
+        if node is None:
+            import socket
+            node = "{}:{}".format(socket.gethostname(), os.getpid())
+        self.node = node
+        self.lease_duration = lease_duration
+        self.poll_interval = poll_interval
+        self.lock_mode = lock_mode
+        self.lock_timeout = lock_timeout
+        self.resources = resources
+        self.metrics = metrics
+        self.capture_logs = capture_logs
+        self.retention = retention
+        # logcapture.LogCapture used during the run, if capturing logs
+        self.log_capture = None
+        # Lock held during the run, if lock_mode is set
+        self.run_lock = None
+        # Set to True if the run has been skipped because another run holds
+        # the lock
+        self.locked_out = False
+        # Outcome of the tasks of this run, used to resume it if interrupted
+        self.checkpoint = None
+        self.archive = archive
         if outdir is not None:
-            self.outdir = Outdir(outdir)
+            self.outdir = Outdir(outdir, archive=archive)
         else:
             self.outdir = None
         self.report = None
 
+        # Event loop used to run async tasks
+        self.event_loop = EventLoopThread()
+
         # All registered task classes
         self.task_classes = set()
 
@@ -313,34 +1237,177 @@ class Housekeeping:
         """
         from django.conf import settings
         from django.apps import apps
-        from importlib import import_module
 
+        self.configure(settings)
+        self.discover([app.name for app in apps.get_app_configs()])
+
+    def configure(self, settings):
+        """
+        Use the HOUSEKEEPING_* Django settings for the options that have not
+        been set
+        """
         # Try to use the HOUSEKEEPING_ROOT Django setting to instantiate a
         # outdir, if we do not have one yet
         if self.outdir is None:
             outdir = getattr(settings, "HOUSEKEEPING_ROOT", None)
             if outdir is not None:
-                self.outdir = Outdir(outdir)
+                self.outdir = Outdir(outdir, archive=self.archive)
+
+        # Try to use the HOUSEKEEPING_ARCHIVE Django setting to archive run
+        # directories, if no archive format has been set
+        if self.archive is None:
+            self.archive = getattr(settings, "HOUSEKEEPING_ARCHIVE", None)
+            if self.outdir is not None:
+                self.outdir.archive = self.archive
+
+        # Try to use the HOUSEKEEPING_HISTORY Django setting to instantiate a
+        # history backend, if we do not have one yet
+        if self.history is None:
+            history = getattr(settings, "HOUSEKEEPING_HISTORY", None)
+            if history is not None:
+                from django.utils.module_loading import import_string
+                self.history = import_string(history)()
+
+        # Try to use the HOUSEKEEPING_MANIFEST Django setting to cache
+        # discovery results, if we do not have a manifest yet
+        if self.manifest is None:
+            manifest = getattr(settings, "HOUSEKEEPING_MANIFEST", None)
+            if manifest is not None:
+                self.manifest = Manifest(manifest)
+
+        # Try to use the HOUSEKEEPING_RESOURCES Django setting for resource
+        # capacities, if we do not have them yet
+        if self.resources is None:
+            self.resources = getattr(settings, "HOUSEKEEPING_RESOURCES", None)
+
+        # Try to use the HOUSEKEEPING_RETENTION Django setting to prune old
+        # runs, if we do not have a retention policy yet
+        if self.retention is None:
+            retention = getattr(settings, "HOUSEKEEPING_RETENTION", None)
+            if retention is not None:
+                self.retention = RetentionPolicy.from_config(retention)
+
+        # Try to use the HOUSEKEEPING_METRICS_FILE Django setting to export
+        # metrics, if we do not have a metrics sink yet
+        if self.metrics is None:
+            metrics_file = getattr(settings, "HOUSEKEEPING_METRICS_FILE", None)
+            if metrics_file is not None:
+                self.metrics = TextfileMetrics(metrics_file)
+
+        # Use the HOUSEKEEPING_COORDINATOR Django setting to coordinate a
+        # distributed run, defaulting to the database. The
+        # HOUSEKEEPING_COORDINATOR_OPTIONS setting has the keyword arguments
+        # of its constructor
+        if self.run_id is not None and self.coordinator is None:
+            from django.utils.module_loading import import_string
+            coordinator = getattr(
+                    settings, "HOUSEKEEPING_COORDINATOR", "django_housekeeping.coordination.DjangoCoordinator")
+            options = getattr(settings, "HOUSEKEEPING_COORDINATOR_OPTIONS", {})
+            self.coordinator = import_string(coordinator)(**options)
+
+    def discover(self, app_names):
+        """
+        Register the tasks found in the housekeeping module of each of the
+        given apps.
 
+        If a valid discovery manifest is available, register stand-ins for
+        the tasks listed in it instead, without importing any module.
+        """
+        if self.manifest is not None:
+            stubs = self.manifest.load(app_names)
+            if stubs is not None:
+                log.debug("autodiscover: using manifest %s", self.manifest.path)
+                for stub in stubs:
+                    self.register_task(stub)
+                return
+
+        # Source of each module tried, and where each task class was found
+        modules = {}
+        locations = {}
         seen = set()
-        for app in apps.get_app_configs():
-            mod_name = "{}.housekeeping".format(app.name)
+        for app_name in app_names:
+            mod_name = "{}.housekeeping".format(app_name)
             try:
                 mod = import_module(mod_name)
             except ImportError as e:
                 if e.name != mod_name:
                     raise
+                modules[mod_name] = None
                 continue
+            modules[mod_name] = getattr(mod, "__file__", None)
             log.debug("autodiscover: found module %s", mod_name)
             for cls_name, cls in inspect.getmembers(mod, inspect.isclass):
                 if issubclass(cls, Task) and cls != Task:
                     if cls in seen:
                         continue
                     seen.add(cls)
-                    cls.IDENTIFIER = "{}.{}".format(app.name, cls_name)
+                    cls.IDENTIFIER = "{}.{}".format(app_name, cls_name)
+                    locations[cls] = (mod_name, cls_name)
                     log.debug("autodiscover: found task %s", cls.IDENTIFIER)
                     self.register_task(cls)
 
+        if self.manifest is not None:
+            self.manifest.save(app_names, modules, list(self.task_schedule.graph), locations)
+
+    def load_durations(self):
+        """
+        Use the task durations recorded in the run history for scheduling.
+        This needs to be called before init().
+        """
+        self.durations = {}
+        self.init_history()
+        if self.history is not None:
+            self.durations = self.history.durations()
+
+    def init_history(self):
+        """
+        Store history in the output directory root, if no other history
+        backend has been set
+        """
+        if self.history is None and self.outdir is not None:
+            self.history = JSONLinesHistory(os.path.join(self.outdir.root, "history.jsonl"))
+
+    def task_started(self, stage, task):
+        """
+        Called every time a task starts running
+        """
+        if self.metrics is not None:
+            self.metrics.task_started(stage, task)
+
+    def task_finished(self, run_info):
+        """
+        Called every time a task has been run or skipped
+        """
+        # Tasks run by another node of a distributed run are in its history
+        # and metrics already
+        remote = run_info.node is not None
+        if self.metrics is not None and not remote:
+            self.metrics.task_finished(run_info)
+        if self.history is not None and not run_info.mock and not remote:
+            self.history.append(make_record(run_info, dry_run=self.dry_run))
+        if self.checkpoint is not None:
+            self.checkpoint.append(make_record(run_info, dry_run=self.dry_run))
+        if self.report is not None:
+            self.report.task_finished(run_info)
+
+    def load_checkpoint(self):
+        """
+        Restore the results of the tasks that ran successfully in the run
+        being resumed
+        """
+        for record in self.checkpoint.records():
+            if record["outcome"] not in ("success", "up-to-date"):
+                continue
+            stage = self.stages.get(record["stage"])
+            if stage is None:
+                continue
+            task = stage.tasks.get(record["task"])
+            if task is None:
+                continue
+            run_info = RunInfo(stage, task)
+            run_info.set_restored(record)
+            stage.results[task.IDENTIFIER] = run_info
+
     def _register_stage_dependencies(self, stages):
         """
         Add stage information to the stage graph
@@ -378,20 +1445,126 @@ class Housekeeping:
             for task in stage.get_schedule():
                 yield stage, task
 
-    def init(self):
+    def select_task_classes(self, run_filter):
+        """
+        Return the set of task classes needed to run the stages and tasks
+        matched by run_filter: the matching ones, the ones that share
+        themselves with other tasks through their NAME, and all their
+        dependencies.
+        """
+        # Tasks can use named tasks without listing them in DEPENDS
+        pending = [task_cls for task_cls in self.task_schedule.sequence if task_cls.NAME is not None]
+        for task_cls in self.task_schedule.sequence:
+            for stage in task_cls.get_class_stages():
+                if not hasattr(task_cls, "run_{}".format(stage)):
+                    continue
+                if run_filter("{}:{}".format(stage, task_cls.IDENTIFIER)):
+                    pending.append(task_cls)
+                    break
+
+        selected = set()
+        while pending:
+            task_cls = pending.pop()
+            if task_cls in selected:
+                continue
+            selected.add(task_cls)
+            pending.extend(task_cls.DEPENDS)
+        return selected
+
+    def _add_stages(self, stages):
+        """
+        Make sure there is a Stage object for each of the given stage names,
+        and add their order to the stage graph
         """
-        Instantiate all Task objects, and schedule their execution
+        self._register_stage_dependencies(stages)
+        for name in stages:
+            if name not in self.stages:
+                self.stages[name] = Stage(self, name)
+
+    def init_outdir(self):
+        """
+        Create the output directory of a new run, with its report and
+        checkpoint
+        """
+        if not self.outdir:
+            return
+        self.outdir.init(self)
+        self.report = Report(self)
+        self.checkpoint = JSONLinesHistory(os.path.join(self.outdir.path(), "checkpoint.jsonl"))
+
+    def reset(self):
+        """
+        Forget the results of the previous run, and prepare for running again
+        with the same tasks, in a new output directory
+        """
+        if self.resume is not None:
+            raise Exception("cannot run again while resuming a run")
+        for stage in self.stages.values():
+            stage.results = {}
+        self.init_outdir()
+
+    def lock_run(self):
+        """
+        Acquire the run lock, if lock_mode is set.
+
+        Returns False if the run should be skipped because another run holds
+        the lock.
+        """
+        if self.lock_mode is None or not self.outdir or self.run_lock is not None:
+            return True
+        lock = FileLock(os.path.join(self.outdir.root, "housekeeping.lock"))
+        if not lock.acquire(self.lock_mode, timeout=self.lock_timeout):
+            log.warning("another housekeeping run is in progress: skipping this run")
+            return False
+        self.run_lock = lock
+        return True
+
+    def discard_outdir(self):
+        """
+        Remove the output directory of a run that did not take place, unless
+        it belongs to a resumed run
+        """
+        if self.outdir and self.resume is None:
+            self.outdir.discard()
+
+    def init(self, run_filter=None, import_tasks=True):
+        """
+        Instantiate all Task objects, and schedule their execution.
+
+        If run_filter is given, only instantiate the tasks that it matches,
+        and their dependencies.
+
+        If import_tasks is False, tasks known only from the discovery manifest
+        are not imported: they can be listed and scheduled, but not run.
         """
         # Schedule task instantiation
         self.task_schedule.schedule()
 
+        if self.coordinator is not None and self.run_id is None:
+            raise Exception("a distributed run needs a run_id")
+
         # Create output directory
-        if self.outdir:
-            self.outdir.init(self)
-            self.report = Report(self)
+        self.init_outdir()
+        if self.outdir is None and self.resume is not None:
+            raise Exception("cannot resume a run without an output directory")
+        self.init_history()
+
+        selected = None
+        if run_filter is not None:
+            selected = self.select_task_classes(run_filter)
+            log.debug("instantiating %d of %d tasks", len(selected), len(self.task_schedule.sequence))
 
         # Instantiate all tasks
         for task_cls in self.task_schedule.sequence:
+            if selected is not None and task_cls not in selected:
+                # Keep the order of stages given by all tasks
+                self._add_stages(task_cls.get_class_stages())
+                continue
+
+            # Import the tasks that are going to run
+            if import_tasks and issubclass(task_cls, TaskStub):
+                task_cls = task_cls.resolve()
+
             # Instantiate the task
             task = task_cls(self)
 
@@ -404,34 +1577,78 @@ class Housekeeping:
                 setattr(self, task.NAME, task)
 
             # Add stage information to the stage graph
-            self._register_stage_dependencies(task.get_stages())
+            self._add_stages(task.get_stages())
 
             # Add the task to all its stages
             for name in task.get_stages():
-                stage = self.stages.get(name, None)
-                if stage is None:
-                    self.stages[name] = stage = Stage(self, name)
                 if hasattr(task, "run_{}".format(name)):
-                    stage.add_task(task)
+                    self.stages[name].add_task(task)
 
         # Schedule execution of stages and tasks
         self.stage_schedule.schedule()
         for stage in self.stages.values():
             stage.schedule()
 
+        if self.resume is not None:
+            self.load_checkpoint()
+
     def run(self, run_filter=None):
         """
         Run all tasks, collecting run statistics.
 
         If some dependency of a task did not run correctly, the task is
         skipped.
+
+        If another run holds the lock, nothing is run, and the new run
+        directory is removed.
         """
-        for stage in self.stage_schedule.sequence:
-            self.stages[stage].run(run_filter=run_filter)
+        try:
+            self.locked_out = not self.lock_run()
+        except LockedError:
+            self.discard_outdir()
+            raise
+        if self.locked_out:
+            self.discard_outdir()
+            return
 
-        if self.outdir:
-            self.report.generate()
-            self.outdir.cleanup()
+        try:
+            if self.report is not None:
+                self.report.run_started()
+            if self.outdir and self.capture_logs:
+                self.log_capture = LogCapture(self.outdir.path("logs"))
+                self.log_capture.start()
+            try:
+                for stage in self.stage_schedule.sequence:
+                    self.stages[stage].run(run_filter=run_filter)
+            finally:
+                self.event_loop.stop()
+                if self.log_capture is not None:
+                    self.log_capture.stop()
+                    self.log_capture = None
+                if self.report is not None:
+                    self.report.run_finished()
+
+            if self.outdir:
+                self.report.generate()
+                self.outdir.cleanup()
+                self.prune()
+        finally:
+            if self.run_lock is not None:
+                self.run_lock.release()
+                self.run_lock = None
+
+    def prune(self):
+        """
+        Remove the old runs that the retention policy does not keep, never
+        removing the current one. With dry_run, only log what would be
+        removed.
+
+        Returns the list of retention.Run objects removed.
+        """
+        if self.outdir is None or self.retention is None or not os.path.isdir(self.outdir.root):
+            return []
+        exclude = {x for x in (self.outdir.outdir, self.outdir.archive_path) if x is not None}
+        return prune(self.outdir.root, self.retention, dry_run=self.dry_run, exclude=exclude)
 
     def list_run(self, run_filter=None):
         for stage, task in self.get_schedule():
@@ -440,6 +1657,21 @@ class Housekeeping:
                 continue
             yield(name)
 
+    def predict(self):
+        """
+        Generate (stage, duration, critical_path) for each stage, with the
+        predicted run time of the stage using the current number of workers,
+        and the list of task identifiers in its critical path.
+
+        This only works if durations are known: see load_durations().
+        """
+        for name in self.stage_schedule.sequence:
+            stage = self.stages[name]
+            yield (
+                stage,
+                datetime.timedelta(seconds=stage.task_schedule.predict_duration(self.workers)),
+                stage.task_schedule.critical_path())
+
     def make_dot(self, out):
         print("digraph TASKS {", file=out)
         print('  label="Tasks"', file=out)
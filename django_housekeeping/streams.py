@@ -0,0 +1,259 @@
+# Pluggable housekeeping framework for Django sites
+#
+# Copyright (C) 2013--2014  Enrico Zini <enrico@enricozini.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+from __future__ import annotations
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import os.path
+import tempfile
+
+# Default buffer size used when streaming files
+BUFSIZE = 1024 * 1024
+
+# Compression formats, and the extension of their files
+COMPRESSION_EXTENSIONS = {
+    "gzip": ".gz",
+    "xz": ".xz",
+    "zst": ".zst",
+}
+
+
+def guess_compression(pathname):
+    """
+    Return the compression format of a file from its extension, or None if it
+    is not compressed
+    """
+    for compression, ext in COMPRESSION_EXTENSIONS.items():
+        if pathname.endswith(ext):
+            return compression
+    return None
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("zstd compression needs the zstandard module")
+    return zstandard
+
+
+def open_compressed(pathname, mode, compression):
+    """
+    Open a compressed file for streaming binary reads (mode "rb") or writes
+    (mode "wb"). pathname can also be a binary file object.
+
+    compression is "gzip", "xz", or "zst" if the zstandard module is
+    installed.
+    """
+    if mode not in ("rb", "wb"):
+        raise ValueError("unsupported mode {!r}".format(mode))
+    if compression == "gzip":
+        return gzip.open(pathname, mode)
+    if compression == "xz":
+        return lzma.open(pathname, mode)
+    if compression == "zst":
+        zstandard = _zstandard()
+        if isinstance(pathname, (str, bytes, os.PathLike)):
+            fd = io.open(pathname, mode)
+            closefd = True
+        else:
+            fd = pathname
+            closefd = False
+        if mode == "rb":
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(fd, closefd=closefd))
+        return zstandard.ZstdCompressor().stream_writer(fd, closefd=closefd)
+    raise ValueError("unsupported compression {!r}".format(compression))
+
+
+class ClosingReader(io.BufferedIOBase):
+    """
+    Binary reader that also closes other objects, like the file it reads
+    from, when it is closed
+    """
+    def __init__(self, stream, *others):
+        self.stream = stream
+        self.others = others
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def read1(self, size=-1):
+        return self.stream.read1(size)
+
+    def readinto(self, b):
+        return self.stream.readinto(b)
+
+    def readline(self, size=-1):
+        return self.stream.readline(size)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.stream.close()
+            for other in self.others:
+                other.close()
+        finally:
+            super().close()
+
+
+class _HashingWriter:
+    """
+    Write to a file, updating a hash with all that is written
+    """
+    def __init__(self, file, hash):
+        self.file = file
+        self.hash = hash
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+
+class StreamWriter:
+    """
+    Write a file through a large buffer and optional compression, into a
+    temporary file that is renamed into place when closed.
+
+    If checksum is the name of a hashlib algorithm, like "sha256", a sidecar
+    file named after it is written next to the file, with the checksum of
+    its contents in the format used by sha256sum and similar tools.
+
+    Used as a context manager, if the block raises an exception the
+    temporary file is removed and nothing is written.
+    """
+    def __init__(self, pathname, compression=None, checksum=None, text=False, encoding="utf8",
+                 buffer_size=BUFSIZE):
+        self.pathname = pathname
+        self.checksum = checksum
+        self.text = text
+        self.encoding = encoding
+        self.closed = False
+        dirname, basename = os.path.split(pathname)
+        fd, self.tmpname = tempfile.mkstemp(dir=dirname or ".", prefix="." + basename + ".", suffix=".tmp")
+        self.file = io.open(fd, "wb", buffering=buffer_size)
+        self.hash = hashlib.new(checksum) if checksum is not None else None
+        target = _HashingWriter(self.file, self.hash) if self.hash is not None else self.file
+        if compression is None:
+            self.compressor = None
+        elif compression == "gzip":
+            self.compressor = gzip.GzipFile(filename=basename, mode="wb", fileobj=target)
+        elif compression == "xz":
+            self.compressor = lzma.LZMAFile(target, "wb")
+        elif compression == "zst":
+            self.compressor = _zstandard().ZstdCompressor().stream_writer(target, closefd=False)
+        else:
+            self.abort()
+            raise ValueError("unsupported compression {!r}".format(compression))
+        self.stream = self.compressor if self.compressor is not None else target
+
+    def write(self, data):
+        if self.text:
+            data = data.encode(self.encoding)
+        return self.stream.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def close(self):
+        """
+        Finish writing, and move the file into place
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.compressor is not None:
+            # This flushes the compressed data, and leaves self.file open
+            self.compressor.close()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.chmod(self.tmpname, 0o644)
+        os.replace(self.tmpname, self.pathname)
+
+        if self.hash is not None:
+            dirname, basename = os.path.split(self.pathname)
+            sidecar = "{}.{}".format(self.pathname, self.checksum)
+            fd, tmpname = tempfile.mkstemp(dir=dirname or ".", prefix="." + os.path.basename(sidecar) + ".")
+            with io.open(fd, "wt", encoding="utf8") as out:
+                print("{}  {}".format(self.hash.hexdigest(), basename), file=out)
+            os.chmod(tmpname, 0o644)
+            os.replace(tmpname, sidecar)
+
+    def abort(self):
+        """
+        Stop writing, and remove the temporary file
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.file.close()
+        os.unlink(self.tmpname)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def open_stream(pathname, mode="rb", compression=None, checksum=None, encoding="utf8", buffer_size=BUFSIZE):
+    """
+    Open a file for streaming, compressing or decompressing it according to
+    compression, or to its extension if compression is None.
+
+    mode can be "rb" or "rt" to read, and "wb" or "wt" to write. Files open
+    for writing are StreamWriter objects, written atomically, with an
+    optional checksum sidecar file.
+    """
+    if compression is None:
+        compression = guess_compression(pathname)
+    if mode in ("wb", "wt"):
+        dirname = os.path.dirname(pathname)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        return StreamWriter(pathname, compression=compression, checksum=checksum, text=mode == "wt",
+                            encoding=encoding, buffer_size=buffer_size)
+    return open_reader(io.open(pathname, "rb", buffering=buffer_size), mode, compression, encoding=encoding)
+
+
+def open_reader(fileobj, mode="rb", compression=None, encoding="utf8"):
+    """
+    Wrap a binary file object for streaming reads, decompressing it
+    according to compression. mode can be "rb" or "rt".
+
+    Closing the result also closes fileobj.
+    """
+    if mode not in ("rb", "rt"):
+        raise ValueError("unsupported mode {!r}".format(mode))
+    if compression is not None:
+        fileobj = ClosingReader(open_compressed(fileobj, "rb", compression), fileobj)
+    if mode == "rt":
+        return io.TextIOWrapper(fileobj, encoding=encoding)
+    return fileobj
@@ -42,6 +42,28 @@ class Task:
     # Task classes that should be run before this one
     DEPENDS = []
 
+    # Set to True to run this task in a forked process, for CPU-bound tasks
+    # that would otherwise hold the GIL while other tasks run in parallel
+    RUN_IN_SUBPROCESS = False
+
+    # Maximum run time in seconds for each run_<stage> method, or None to use
+    # the Housekeeping default
+    TIMEOUT = None
+
+    # Amount of each shared resource used by the task while it runs, like
+    # {"db": 1}. When tasks run in parallel, the amounts used by running tasks
+    # are kept within the capacities configured in Housekeeping.resources
+    RESOURCES = {}
+
+    # Set to True to never run this task at the same time as another
+    # housekeeping process, using a lock file in the output directory root
+    EXCLUSIVE = False
+
+    # threading.Event set when the task runs past its timeout. Long running
+    # tasks can check it to stop early: this is the only way to stop a task
+    # running in a thread
+    cancelled = None
+
     def __init__(self, hk, **kw):
         """
         Constructor
@@ -50,6 +72,17 @@ class Task:
         """
         self.hk = hk
 
+    def fingerprint(self, stage):
+        """
+        Return a cheap summary of the inputs of the task for the given stage,
+        like the latest modification time and the number of rows of the
+        tables it reads, or None to always run the task.
+
+        If the fingerprint is the same as in the last successful run, the task
+        is skipped as up to date.
+        """
+        return None
+
     def get_stages(self):
         """
         Get the ordered list of stages for this task.
@@ -59,7 +92,20 @@ class Task:
         if res is not None:
             return res
 
-        module = inspect.getmodule(self.__class__)
+        return self.get_class_stages()
+
+    @classmethod
+    def get_class_stages(cls):
+        """
+        Get the ordered list of stages for this task class, without
+        instantiating it.
+        """
+        # First look in the class
+        res = getattr(cls, "STAGES", None)
+        if res is not None:
+            return res
+
+        module = inspect.getmodule(cls)
 
         # If that fails, look in the module
         res = getattr(module, "STAGES", None)
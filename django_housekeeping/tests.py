@@ -17,6 +17,8 @@
 from __future__ import annotations
 from . import Task, Housekeeping
 from . import toposort
+import asyncio
+import threading
 import unittest
 import os.path
 
@@ -44,6 +46,65 @@ class TestToposort(unittest.TestCase):
         with self.assertRaises(ValueError):
             toposort.sort({0: [1], 1: [0], 2: [3], 3: [2]})
 
+    def test_large(self):
+        from . import benchmark
+        import sys
+        # Deeper than the recursion limit
+        size = sys.getrecursionlimit() * 3
+        self.assertEqual(toposort.sort(benchmark.chain_graph(size)), list(range(size)))
+        graph = benchmark.chain_graph(size)
+        graph[size - 1].add(0)
+        with self.assertRaises(ValueError):
+            toposort.sort(graph)
+        self.assertEqual(len(toposort.sort(benchmark.random_dag(1000))), 1000)
+
+    def test_benchmark(self):
+        from . import benchmark
+        results = benchmark.benchmark_toposort(sizes=(10,))
+        self.assertEqual([r["graph"] for r in results], ["chain", "fan-out", "random"])
+
+    def test_benchmark_tasks(self):
+        from . import benchmark
+        results = benchmark.benchmark_tasks(tasks=20, depth=4, fan_out=2, stages=2)
+        self.assertEqual([r["phase"] for r in results],
+                         ["discovery", "init", "get_schedule", "make_dot", "run", "report"])
+        for r in results:
+            self.assertGreater(r["peak_memory"], 0)
+
+    def test_priority(self):
+        graph = {0: [3], 1: [2], 2: [3], 3: []}
+        weights = {0: 1, 1: 2, 2: 10, 3: 1}
+        self.assertEqual(toposort.longest_paths(graph, weights), {0: 2, 1: 13, 2: 11, 3: 1})
+        self.assertEqual(toposort.sort(graph), [0, 1, 2, 3])
+        self.assertEqual(toposort.sort(graph, toposort.longest_paths(graph, weights)), [1, 2, 0, 3])
+
+    def test_durations(self):
+        class Short(Task):
+            def run_main(self, stage): pass
+
+        class Long1(Task):
+            def run_main(self, stage): pass
+
+        class Long2(Task):
+            DEPENDS = [Long1]
+
+            def run_main(self, stage): pass
+
+        h = Housekeeping(workers=2)
+        h.register_task(Short)
+        h.register_task(Long2)
+        h.durations = {
+            "main:" + Short.IDENTIFIER: 5,
+            "main:" + Long1.IDENTIFIER: 3,
+            "main:" + Long2.IDENTIFIER: 4,
+        }
+        h.init()
+        order = [task.IDENTIFIER for stage, task in h.get_schedule()]
+        self.assertEqual(order, [Long1.IDENTIFIER, Short.IDENTIFIER, Long2.IDENTIFIER])
+        [(stage, duration, critical_path)] = list(h.predict())
+        self.assertEqual(duration.total_seconds(), 7)
+        self.assertEqual(critical_path, [Long1.IDENTIFIER, Long2.IDENTIFIER])
+
     def test_real(self):
         class Backup1(Task):
             STAGES = ["backup", "main"]
@@ -133,6 +194,367 @@ class TestDependencies(unittest.TestCase):
         self.assertEqual(Associator.call_history, ["foo"])
 
 
+class TestLazyInit(unittest.TestCase):
+    def test_filtered_init(self):
+        instantiated = []
+        ran = []
+
+        class Base(Task):
+            def __init__(self, *args, **kw):
+                super().__init__(*args, **kw)
+                instantiated.append(self.__class__.__name__)
+
+            def run_main(self, stage):
+                ran.append(self.__class__.__name__)
+
+        class Provider(Base):
+            NAME = "provider"
+            STAGES = ["main", "stats"]
+
+            def run_stats(self, stage):
+                ran.append("Provider.stats")
+
+        class Stats(Base):
+            DEPENDS = [Provider]
+            STAGES = ["main", "stats"]
+
+            def run_stats(self, stage):
+                ran.append("Stats.stats")
+
+        class Unrelated(Base):
+            pass
+
+        h = Housekeeping()
+        for cls in (Provider, Stats, Unrelated):
+            h.register_task(cls)
+        h.init(run_filter=lambda name: name.startswith("stats:"))
+
+        self.assertEqual(instantiated, ["Provider", "Stats"])
+        self.assertFalse(hasattr(h, "unrelated"))
+        self.assertIsInstance(h.provider, Provider)
+        h.run(run_filter=lambda name: name.startswith("stats:"))
+        self.assertEqual(ran, ["Provider.stats", "Stats.stats"])
+
+    def test_named_tasks(self):
+        class Helper(Task):
+            def run_main(self, stage): pass
+
+        class Shared(Task):
+            NAME = "shared"
+            DEPENDS = [Helper]
+
+            def run_main(self, stage): pass
+
+        class Reader(Task):
+            def run_main(self, stage):
+                self.found = self.hk.shared
+
+        class Unrelated(Task):
+            def run_main(self, stage): pass
+
+        h = Housekeeping()
+        for cls in (Helper, Shared, Reader, Unrelated):
+            h.register_task(cls)
+        h.init(run_filter=lambda name: name == "main:" + Reader.IDENTIFIER)
+
+        # Named tasks are instantiated even if nothing depends on them
+        tasks = {task.IDENTIFIER for task in h.stages["main"].tasks.values()}
+        self.assertEqual(tasks, {Helper.IDENTIFIER, Shared.IDENTIFIER, Reader.IDENTIFIER})
+        h.run(run_filter=lambda name: name == "main:" + Reader.IDENTIFIER)
+        self.assertTrue(h.stages["main"].results[Reader.IDENTIFIER].success)
+        self.assertIs(h.stages["main"].tasks[Reader.IDENTIFIER].found, h.shared)
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        import sys
+        import tempfile
+        self.root = tempfile.mkdtemp()
+        for app, source in (
+                ("hktestapp1", "class Base(hk.Task):\n    def run_main(self, stage): pass\n"),
+                ("hktestapp2", "from hktestapp1.housekeeping import Base\n"
+                               "class Dependent(hk.Task):\n    DEPENDS = [Base]\n"
+                               "    def run_main(self, stage): pass\n")):
+            os.mkdir(os.path.join(self.root, app))
+            with open(os.path.join(self.root, app, "__init__.py"), "wt"):
+                pass
+            with open(os.path.join(self.root, app, "housekeeping.py"), "wt") as fd:
+                fd.write("import django_housekeeping as hk\n")
+                fd.write(source)
+        # An app without housekeeping tasks
+        os.mkdir(os.path.join(self.root, "hktestapp3"))
+        with open(os.path.join(self.root, "hktestapp3", "__init__.py"), "wt"):
+            pass
+        sys.path.insert(0, self.root)
+
+    def tearDown(self):
+        import shutil
+        import sys
+        sys.path.remove(self.root)
+        for name in ("hktestapp1", "hktestapp1.housekeeping", "hktestapp2", "hktestapp2.housekeeping",
+                     "hktestapp3"):
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.root)
+
+    def test_manifest(self):
+        import sys
+        manifest = os.path.join(self.root, "manifest.json")
+        apps = ["hktestapp1", "hktestapp2", "hktestapp3"]
+
+        h = Housekeeping(manifest=manifest)
+        h.discover(apps)
+        h.init()
+        order = [task.IDENTIFIER for stage, task in h.get_schedule()]
+        self.assertEqual(order, ["hktestapp1.Base", "hktestapp2.Dependent"])
+        self.assertTrue(os.path.exists(manifest))
+
+        # Discovery from the manifest does not import modules
+        for name in ("hktestapp1.housekeeping", "hktestapp2.housekeeping"):
+            del sys.modules[name]
+        h = Housekeeping(manifest=manifest)
+        h.discover(apps)
+        h.init(import_tasks=False)
+        self.assertEqual([task.IDENTIFIER for stage, task in h.get_schedule()], order)
+        self.assertNotIn("hktestapp1.housekeeping", sys.modules)
+
+        # Only the modules needed to run the selected tasks are imported
+        h = Housekeeping(manifest=manifest)
+        h.discover(apps)
+        h.init(run_filter=lambda name: name == "main:hktestapp1.Base")
+        self.assertIn("hktestapp1.housekeeping", sys.modules)
+        self.assertNotIn("hktestapp2.housekeeping", sys.modules)
+        h.run(run_filter=lambda name: name == "main:hktestapp1.Base")
+        self.assertTrue(h.stages["main"].results["hktestapp1.Base"].success)
+
+        # Changing a module invalidates the manifest
+        pathname = os.path.join(self.root, "hktestapp2", "housekeeping.py")
+        st = os.stat(pathname)
+        os.utime(pathname, (st.st_atime, st.st_mtime + 10))
+        from .discovery import Manifest
+        self.assertIsNone(Manifest(manifest).load(apps))
+
+
+class TestParallel(unittest.TestCase):
+    def test_run_parallel(self):
+        barrier = threading.Barrier(2, timeout=5)
+        ran = []
+
+        class Failing(Task):
+            def run_main(self, stage):
+                raise RuntimeError("test failure")
+
+        class Dependent(Task):
+            DEPENDS = [Failing]
+
+            def run_main(self, stage):
+                ran.append("dependent")
+
+        # These two only succeed if they run at the same time
+        class Parallel1(Task):
+            def run_main(self, stage):
+                barrier.wait()
+                ran.append("parallel1")
+
+        class Parallel2(Task):
+            def run_main(self, stage):
+                barrier.wait()
+                ran.append("parallel2")
+
+        class Final(Task):
+            DEPENDS = [Parallel1, Parallel2]
+
+            def run_main(self, stage):
+                ran.append("final")
+
+        h = Housekeeping(workers=4)
+        for cls in (Failing, Dependent, Parallel1, Parallel2, Final):
+            h.register_task(cls)
+        h.init()
+        h.run()
+
+        self.assertEqual(sorted(ran[:2]), ["parallel1", "parallel2"])
+        self.assertEqual(ran[2:], ["final"])
+        results = h.stages["main"].results
+        self.assertIsNotNone(results[Failing.IDENTIFIER].exception)
+        self.assertFalse(results[Dependent.IDENTIFIER].executed)
+        self.assertEqual(
+            results[Dependent.IDENTIFIER].skipped_reason,
+            "its dependency {} has not run successfully".format(Failing.IDENTIFIER))
+        self.assertTrue(results[Final.IDENTIFIER].success)
+
+    def test_resources(self):
+        import time
+        lock = threading.Lock()
+        state = {"db": 0, "max_db": 0}
+
+        class DBTask(Task):
+            RESOURCES = {"db": 1}
+
+            def run_main(self, stage):
+                with lock:
+                    state["db"] += 1
+                    state["max_db"] = max(state["max_db"], state["db"])
+                time.sleep(0.05)
+                with lock:
+                    state["db"] -= 1
+
+        class DB1(DBTask):
+            pass
+
+        class DB2(DBTask):
+            pass
+
+        class DB3(DBTask):
+            pass
+
+        # Does not need the database, so it runs while the others wait
+        class Other(Task):
+            def run_main(self, stage):
+                pass
+
+        h = Housekeeping(workers=4, resources={"db": 1})
+        for cls in (DB1, DB2, DB3, Other):
+            h.register_task(cls)
+        h.init()
+        h.run()
+
+        self.assertEqual(state["max_db"], 1)
+        results = h.stages["main"].results
+        for cls in (DB1, DB2, DB3, Other):
+            self.assertTrue(results[cls.IDENTIFIER].success)
+        self.assertEqual(results[Other.IDENTIFIER].resource_wait, {})
+        waits = sorted(results[cls.IDENTIFIER].resource_wait.get("db", 0.0) for cls in (DB1, DB2, DB3))
+        self.assertEqual(waits[0], 0.0)
+        self.assertGreater(waits[2], waits[1])
+        self.assertGreater(waits[1], 0.0)
+
+
+class TestAsync(unittest.TestCase):
+    def test_run_async(self):
+        started1 = asyncio.Event()
+        started2 = asyncio.Event()
+        ran = []
+
+        # These two only succeed if they run at the same time
+        class Async1(Task):
+            async def run_main(self, stage):
+                started1.set()
+                await asyncio.wait_for(started2.wait(), 5)
+                ran.append("async1")
+
+        class Async2(Task):
+            async def run_main(self, stage):
+                started2.set()
+                await asyncio.wait_for(started1.wait(), 5)
+                ran.append("async2")
+
+        class AsyncFailing(Task):
+            async def run_main(self, stage):
+                raise RuntimeError("test failure")
+
+        class Sync(Task):
+            DEPENDS = [Async1, Async2]
+
+            def run_main(self, stage):
+                ran.append("sync")
+
+        class Dependent(Task):
+            DEPENDS = [AsyncFailing]
+
+            def run_main(self, stage):
+                ran.append("dependent")
+
+        h = Housekeeping()
+        for cls in (Async1, Async2, AsyncFailing, Sync, Dependent):
+            h.register_task(cls)
+        h.init()
+        h.run()
+
+        self.assertEqual(sorted(ran[:2]), ["async1", "async2"])
+        self.assertEqual(ran[2:], ["sync"])
+        results = h.stages["main"].results
+        self.assertTrue(results[Async1.IDENTIFIER].success)
+        self.assertIsNotNone(results[AsyncFailing.IDENTIFIER].exception)
+        self.assertFalse(results[Dependent.IDENTIFIER].executed)
+        self.assertIsNone(h.event_loop.loop)
+
+
+class TestSubprocess(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+
+    def test_run_in_subprocess(self):
+        pidfile = os.path.join(self.root, "pid")
+
+        class Forked(Task):
+            RUN_IN_SUBPROCESS = True
+
+            def run_main(self, stage):
+                with open(pidfile, "wt") as fd:
+                    fd.write(str(os.getpid()))
+
+        class ForkedFailing(Task):
+            DEPENDS = [Forked]
+
+            def run_main(self, stage):
+                raise ValueError("test failure")
+
+        class Dependent(Task):
+            DEPENDS = [ForkedFailing]
+
+            def run_main(self, stage): pass
+
+        h = Housekeeping(subprocess_filter=lambda name: name == "main:" + ForkedFailing.IDENTIFIER)
+        for cls in (Forked, ForkedFailing, Dependent):
+            h.register_task(cls)
+        h.init()
+        h.run()
+
+        with open(pidfile, "rt") as fd:
+            self.assertNotEqual(int(fd.read()), os.getpid())
+        results = h.stages["main"].results
+        self.assertTrue(results[Forked.IDENTIFIER].success)
+        self.assertIsNotNone(results[Forked.IDENTIFIER].elapsed)
+        exc_type, exc_value, tb = results[ForkedFailing.IDENTIFIER].exception
+        self.assertIs(exc_type, ValueError)
+        self.assertEqual(str(exc_value), "test failure")
+        self.assertIn("test failure", str(exc_value.__cause__))
+        self.assertFalse(results[Dependent.IDENTIFIER].executed)
+
+    def test_log_in_subprocess(self):
+        import logging
+        task_log = logging.getLogger("django_housekeeping.tests.forked")
+
+        class Forked(Task):
+            RUN_IN_SUBPROCESS = True
+
+            def run_main(self, stage):
+                task_log.warning("logged in pid %d", os.getpid())
+
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        task_log.addHandler(handler)
+        try:
+            h = Housekeeping()
+            h.register_task(Forked)
+            h.init()
+            h.run()
+        finally:
+            task_log.removeHandler(handler)
+
+        # Records logged in the child are handled by the parent
+        self.assertTrue(h.stages["main"].results[Forked.IDENTIFIER].success)
+        self.assertEqual(len(records), 1)
+        self.assertNotEqual(records[0].getMessage(), "logged in pid {}".format(os.getpid()))
+        self.assertTrue(records[0].getMessage().startswith("logged in pid "))
+
+
 class TestReport(unittest.TestCase):
     def setUp(self):
         import tempfile
@@ -159,3 +581,1022 @@ class TestReport(unittest.TestCase):
         self.assertTrue(os.path.isfile(os.path.join(h.outdir.outdir, "report/stages.dot")))
         self.assertTrue(os.path.isfile(os.path.join(h.outdir.outdir, "report/stage-main.dot")))
         self.assertTrue(os.path.isfile(os.path.join(h.outdir.outdir, "report/stage-stats.dot")))
+        with open(os.path.join(h.outdir.outdir, "report/report.rst"), "rt") as fd:
+            report = fd.read()
+        self.assertIn("* - {}\n     - success".format(TestTask.IDENTIFIER), report)
+
+        import json
+        with open(os.path.join(h.outdir.outdir, "report/report.jsonl"), "rt") as fd:
+            events = [json.loads(line) for line in fd]
+        self.assertEqual([e["event"] for e in events],
+                         ["run-started", "task-finished", "task-finished", "run-finished"])
+        self.assertEqual(events[0]["stages"], [
+            {"name": "main", "tasks": [TestTask.IDENTIFIER]}, {"name": "stats", "tasks": [TestTask.IDENTIFIER]}])
+        self.assertEqual((events[1]["stage"], events[1]["task"], events[1]["outcome"]),
+                         ("main", TestTask.IDENTIFIER, "success"))
+        self.assertEqual(events[3]["outcomes"], {"success": 2})
+
+        h = Housekeeping(outdir=self.root)
+        h.load_durations()
+        self.assertEqual(sorted(h.durations), ["main:" + TestTask.IDENTIFIER, "stats:" + TestTask.IDENTIFIER])
+
+
+class TestUsage(unittest.TestCase):
+    def test_usage(self):
+        from unittest import mock
+
+        class Busy(Task):
+            def run_main(self, stage):
+                self.data = bytearray(8 * 1024 * 1024)
+                sum(range(3000000))
+
+        class BusyProcess(Task):
+            RUN_IN_SUBPROCESS = True
+
+            def run_main(self, stage):
+                sum(range(3000000))
+
+        h = Housekeeping()
+        h.register_task(Busy)
+        h.register_task(BusyProcess)
+        h.init()
+        # Database queries are only counted when Django is configured
+        with mock.patch("django_housekeeping.db.django_configured", return_value=False):
+            h.run()
+
+        results = h.stages["main"].results
+        for cls in (Busy, BusyProcess):
+            usage = results[cls.IDENTIFIER].usage
+            self.assertGreater(usage.cpu_user + usage.cpu_system, 0)
+            self.assertGreater(usage.peak_rss, 0)
+            self.assertIsNone(usage.db_queries)
+        self.assertGreaterEqual(results[Busy.IDENTIFIER].usage.rss_delta, 4 * 1024 * 1024)
+        self.assertIn("peak rss", results[Busy.IDENTIFIER].describe())
+
+
+class TestTimeout(unittest.TestCase):
+    def test_timeout(self):
+        class Stuck(Task):
+            def run_main(self, stage):
+                self.cancelled.wait(5)
+
+        class StuckAsync(Task):
+            TIMEOUT = 0.1
+
+            async def run_main(self, stage):
+                await asyncio.sleep(5)
+
+        class StuckProcess(Task):
+            RUN_IN_SUBPROCESS = True
+
+            def run_main(self, stage):
+                import time
+                time.sleep(5)
+
+        class Quick(Task):
+            TIMEOUT = 5
+
+            def run_main(self, stage): pass
+
+        class Dependent(Task):
+            DEPENDS = [Stuck]
+
+            def run_main(self, stage): pass
+
+        h = Housekeeping(task_timeout=0.1, timeout_grace=1)
+        for cls in (Stuck, StuckAsync, StuckProcess, Quick, Dependent):
+            h.register_task(cls)
+        h.init()
+        h.run()
+
+        results = h.stages["main"].results
+        for cls in (Stuck, StuckAsync, StuckProcess):
+            self.assertTrue(results[cls.IDENTIFIER].timed_out)
+            self.assertEqual(results[cls.IDENTIFIER].outcome, "timed-out")
+            self.assertLess(results[cls.IDENTIFIER].elapsed.total_seconds(), 2)
+        self.assertTrue(results[Quick.IDENTIFIER].success)
+        self.assertEqual(
+            results[Dependent.IDENTIFIER].skipped_reason,
+            "its dependency {} timed out".format(Stuck.IDENTIFIER))
+
+    def test_exit(self):
+        class Exiting(Task):
+            TIMEOUT = 5
+
+            def run_main(self, stage):
+                raise SystemExit(1)
+
+        h = Housekeeping()
+        h.register_task(Exiting)
+        h.init()
+        with self.assertRaises(SystemExit):
+            h.run()
+
+    def test_abandoned_lock(self):
+        import tempfile
+        import shutil
+        import time
+        release = threading.Event()
+
+        class Stubborn(Task):
+            EXCLUSIVE = True
+            TIMEOUT = 0.1
+
+            def run_main(self, stage):
+                release.wait(5)
+
+        root = tempfile.mkdtemp()
+        try:
+            h = Housekeeping(outdir=root, timeout_grace=0.1)
+            h.register_task(Stubborn)
+            h.init()
+            h.run()
+            self.assertTrue(h.stages["main"].results[Stubborn.IDENTIFIER].timed_out)
+
+            # The lock is held until the abandoned task stops
+            pathname = os.path.join(root, "locks", "{}.lock".format(Stubborn.IDENTIFIER))
+            self.assertTrue(os.path.exists(pathname))
+            release.set()
+            deadline = time.monotonic() + 5
+            while os.path.exists(pathname) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(os.path.exists(pathname))
+        finally:
+            release.set()
+            shutil.rmtree(root)
+
+
+class TestResume(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+
+    def test_resume(self):
+        ran = []
+        broken = [True]
+
+        class Done(Task):
+            def run_main(self, stage):
+                ran.append("done")
+
+        class Broken(Task):
+            def run_main(self, stage):
+                ran.append("broken")
+                if broken[0]:
+                    raise RuntimeError("test failure")
+
+        class Dependent(Task):
+            DEPENDS = [Done, Broken]
+
+            def run_main(self, stage):
+                ran.append("dependent")
+
+        def run(resume=None):
+            h = Housekeeping(outdir=self.root, resume=resume)
+            h.register_task(Dependent)
+            h.init()
+            h.run()
+            return h
+
+        h = run()
+        self.assertEqual(ran, ["done", "broken"])
+        outdir = h.outdir.outdir
+
+        ran.clear()
+        broken[0] = False
+        h = run(resume=True)
+        self.assertEqual(h.outdir.outdir, outdir)
+        self.assertEqual(ran, ["broken", "dependent"])
+        results = h.stages["main"].results
+        self.assertTrue(results[Done.IDENTIFIER].restored)
+        self.assertTrue(results[Dependent.IDENTIFIER].success)
+
+        # Everything is done now
+        ran.clear()
+        run(resume=outdir)
+        self.assertEqual(ran, [])
+
+        # The latest run cannot be resumed once archived
+        import shutil
+        shutil.rmtree(outdir)
+        with open(outdir + ".tar.xz", "wb"):
+            pass
+        with self.assertRaisesRegex(Exception, "has been archived"):
+            run(resume=True)
+
+
+class TestProfile(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+
+    def test_profile(self):
+        def hotspot():
+            import time
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                pass
+
+        class Profiled(Task):
+            def run_main(self, stage):
+                hotspot()
+
+        class NotProfiled(Task):
+            def run_main(self, stage): pass
+
+        h = Housekeeping(
+                outdir=self.root, profile_filter=lambda name: name == "main:" + Profiled.IDENTIFIER,
+                profile_flamegraph=True)
+        h.register_task(Profiled)
+        h.register_task(NotProfiled)
+        h.init()
+        h.run()
+
+        profiles = h.outdir.path("profiles")
+        self.assertEqual(sorted(os.listdir(profiles)), [
+            "main-{}.folded".format(Profiled.IDENTIFIER),
+            "main-{}.prof".format(Profiled.IDENTIFIER),
+        ])
+        with open(os.path.join(profiles, "main-{}.folded".format(Profiled.IDENTIFIER)), "rt") as fd:
+            self.assertIn("tests.py:hotspot", fd.read())
+        with open(os.path.join(h.outdir.outdir, "report/report.rst"), "rt") as fd:
+            report = fd.read()
+        self.assertIn("Profile of {}".format(Profiled.IDENTIFIER), report)
+        self.assertIn("(hotspot)", report)
+
+
+class TestHistory(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+
+    def test_history(self):
+        from .history import JSONLinesHistory
+
+        class Good(Task):
+            def run_main(self, stage): pass
+
+        class Bad(Task):
+            def run_main(self, stage):
+                raise RuntimeError("test failure")
+
+        class Dependent(Task):
+            DEPENDS = [Bad]
+
+            def run_main(self, stage): pass
+
+        history = JSONLinesHistory(os.path.join(self.root, "history.jsonl"))
+        for dry_run in (False, False, True):
+            h = Housekeeping(history=history, dry_run=dry_run)
+            for cls in (Good, Bad, Dependent):
+                h.register_task(cls)
+            h.init()
+            h.run()
+
+        records = list(history.records(task=Good.IDENTIFIER))
+        self.assertEqual(len(records), 3)
+        self.assertEqual([r["dry_run"] for r in records], [False, False, True])
+        self.assertEqual(records[0]["stage"], "main")
+        self.assertEqual(records[0]["outcome"], "success")
+        self.assertIsNone(records[0]["exception"])
+        self.assertEqual(len(history.last_durations("main", Good.IDENTIFIER)), 2)
+        self.assertEqual(len(history.last_durations("main", Good.IDENTIFIER, count=1)), 1)
+        self.assertEqual(history.last_durations("main", Bad.IDENTIFIER), [])
+
+        [record] = list(history.records(task=Bad.IDENTIFIER))[:1]
+        self.assertEqual(record["outcome"], "failed")
+        self.assertEqual(record["exception"], "RuntimeError")
+        [record] = list(history.records(task=Dependent.IDENTIFIER))[:1]
+        self.assertEqual(record["outcome"], "skipped")
+
+        self.assertEqual(sorted(history.durations()), ["main:" + Good.IDENTIFIER])
+
+    def test_fingerprint(self):
+        from .history import JSONLinesHistory
+        ran = []
+        inputs = {"version": 1}
+
+        class Incremental(Task):
+            def fingerprint(self, stage):
+                return inputs["version"]
+
+            def run_main(self, stage):
+                ran.append("incremental")
+
+        class Dependent(Task):
+            DEPENDS = [Incremental]
+
+            def run_main(self, stage):
+                ran.append("dependent")
+
+        def run(dry_run=False):
+            h = Housekeeping(history=JSONLinesHistory(os.path.join(self.root, "history.jsonl")), dry_run=dry_run)
+            h.register_task(Dependent)
+            h.init()
+            h.run()
+            return h.stages["main"].results
+
+        run()
+        self.assertEqual(ran, ["incremental", "dependent"])
+
+        ran.clear()
+        results = run()
+        self.assertEqual(ran, ["dependent"])
+        self.assertTrue(results[Incremental.IDENTIFIER].up_to_date)
+        self.assertTrue(results[Dependent.IDENTIFIER].success)
+
+        # Dry runs do not count as successful runs
+        ran.clear()
+        inputs["version"] = 2
+        run(dry_run=True)
+        self.assertEqual(ran, ["incremental", "dependent"])
+        ran.clear()
+        run()
+        self.assertEqual(ran, ["incremental", "dependent"])
+
+
+class TestFilters(unittest.TestCase):
+    def test_include_exclude(self):
+        from .filters import IncludeExcludeFilter
+        f = IncludeExcludeFilter(["main:app.*", "backup:*"], ["*.Skip*"])
+        self.assertTrue(f("main:app.Task"))
+        self.assertTrue(f("backup:other.Task"))
+        self.assertFalse(f("main:other.Task"))
+        self.assertFalse(f("main:app.SkipMe"))
+        self.assertTrue(IncludeExcludeFilter(None, ["main:*"])("backup:app.Task"))
+        self.assertFalse(IncludeExcludeFilter([], None)("main:app.Task"))
+
+    def test_read_patterns(self):
+        import tempfile
+        from .filters import read_patterns
+        with tempfile.NamedTemporaryFile("wt", suffix=".txt") as fd:
+            fd.write("# comment\nmain:app.*\n\n  backup:*  \n")
+            fd.flush()
+            self.assertEqual(read_patterns(fd.name), ["main:app.*", "backup:*"])
+
+
+class TestDaemon(unittest.TestCase):
+    def test_cron(self):
+        import datetime
+        from .daemon import CronSchedule
+        now = datetime.datetime(2026, 10, 17, 10, 7, 30)
+        self.assertEqual(CronSchedule("*/5 * * * *").next_after(now), datetime.datetime(2026, 10, 17, 10, 10))
+        self.assertEqual(CronSchedule("0 3 * * *").next_after(now), datetime.datetime(2026, 10, 18, 3, 0))
+        self.assertEqual(CronSchedule("0 0 * * 1").next_after(now), datetime.datetime(2026, 10, 19, 0, 0))
+        self.assertEqual(CronSchedule("0 0 29 2 *").next_after(now), datetime.datetime(2028, 2, 29, 0, 0))
+        with self.assertRaises(ValueError):
+            CronSchedule("* * *")
+        with self.assertRaises(ValueError):
+            CronSchedule("61 * * * *")
+
+    def test_run_pending(self):
+        import datetime
+        from .daemon import Daemon, Job
+        from .filters import IncludeExcludeFilter
+
+        class Counted(Task):
+            run_count = 0
+
+            def run_main(self, stage):
+                Counted.run_count += 1
+
+        class Other(Task):
+            def run_main(self, stage):
+                pass
+
+        class FakeClockDaemon(Daemon):
+            clock = datetime.datetime(2026, 10, 17, 10, 7, 30)
+
+            def now(self):
+                return self.clock
+
+        h = Housekeeping()
+        h.register_task(Counted)
+        h.register_task(Other)
+        daemon = FakeClockDaemon(h, [Job("*/5 * * * *", IncludeExcludeFilter(["*.Counted"], None))])
+        daemon.init()
+        # Only the tasks needed by the jobs are instantiated
+        self.assertEqual([task.__class__ for stage, task in h.get_schedule()], [Counted])
+        self.assertEqual(daemon.run_pending(), datetime.datetime(2026, 10, 17, 10, 10))
+        self.assertEqual(Counted.run_count, 0)
+
+        # Runs missed while the daemon was busy are only done once
+        daemon.clock = datetime.datetime(2026, 10, 17, 10, 21)
+        self.assertEqual(daemon.run_pending(), datetime.datetime(2026, 10, 17, 10, 25))
+        self.assertEqual(Counted.run_count, 1)
+
+        # Results are reset between runs
+        daemon.clock = datetime.datetime(2026, 10, 17, 10, 25)
+        daemon.run_pending()
+        self.assertEqual(Counted.run_count, 2)
+
+    def test_locked_at_startup(self):
+        import datetime
+        import shutil
+        import tempfile
+        from .daemon import Daemon, Job
+        from .locking import FileLock
+
+        class Counted(Task):
+            run_count = 0
+
+            def run_main(self, stage):
+                Counted.run_count += 1
+
+        class FakeClockDaemon(Daemon):
+            clock = datetime.datetime(2026, 10, 17, 10, 7, 30)
+
+            def now(self):
+                return self.clock
+
+        root = tempfile.mkdtemp()
+        try:
+            other = FileLock(os.path.join(root, "housekeeping.lock"))
+            other.acquire()
+            h = Housekeeping(outdir=root, lock_mode="skip")
+            h.register_task(Counted)
+            daemon = FakeClockDaemon(h, [Job("*/5 * * * *", None)])
+            daemon.init()
+            daemon.run_pending()
+
+            # The run is skipped while another run holds the lock
+            daemon.clock = datetime.datetime(2026, 10, 17, 10, 10)
+            daemon.run_pending()
+            self.assertTrue(h.locked_out)
+            self.assertEqual(Counted.run_count, 0)
+            self.assertEqual(sorted(x for x in os.listdir(root) if not x.startswith("housekeeping.lock")), [])
+
+            # And runs normally once the lock is released
+            other.release()
+            daemon.clock = datetime.datetime(2026, 10, 17, 10, 15)
+            daemon.run_pending()
+            self.assertFalse(h.locked_out)
+            self.assertEqual(Counted.run_count, 1)
+        finally:
+            shutil.rmtree(root)
+
+
+class TestDistributed(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+
+    def test_file_coordinator(self):
+        import datetime
+        from .coordination import FileCoordinator
+        c = FileCoordinator(self.root)
+        self.assertTrue(c.claim("run", "main", "a.Task", "node1", 60))
+        self.assertFalse(c.claim("run", "main", "a.Task", "node2", 60))
+        self.assertTrue(c.renew("run", "main", "a.Task", "node1", 60))
+        self.assertFalse(c.renew("run", "main", "a.Task", "node2", 60))
+        self.assertIsNone(c.outcome("run", "main", "a.Task"))
+        # Expired leases can be taken over
+        self.assertTrue(c.claim("run", "main", "b.Task", "node1", -1))
+        self.assertTrue(c.claim("run", "main", "b.Task", "node2", 60))
+
+        start = datetime.datetime.now(datetime.timezone.utc)
+        c.publish("run", "node1", {"stage": "main", "task": "a.Task", "start": start, "outcome": "success"})
+        record = c.outcome("run", "main", "a.Task")
+        self.assertEqual(record["outcome"], "success")
+        self.assertEqual(record["start"], start)
+        self.assertEqual(record["node"], "node1")
+        self.assertFalse(c.claim("run", "main", "a.Task", "node2", 60))
+
+    def test_coordinator_setting(self):
+        import types
+        from .coordination import FileCoordinator
+        settings = types.SimpleNamespace(
+                HOUSEKEEPING_COORDINATOR="django_housekeeping.coordination.FileCoordinator",
+                HOUSEKEEPING_COORDINATOR_OPTIONS={"path": self.root})
+        h = Housekeeping(run_id="run")
+        h.configure(settings)
+        self.assertIsInstance(h.coordinator, FileCoordinator)
+        self.assertEqual(h.coordinator.path, self.root)
+
+    def test_run(self):
+        from .coordination import FileCoordinator
+        from .history import JSONLinesHistory
+        lock = threading.Lock()
+        ran = []
+
+        class First(Task):
+            def run_main(self, stage):
+                with lock:
+                    ran.append(("first", self.hk.node))
+
+        class Second(Task):
+            DEPENDS = [First]
+
+            def run_main(self, stage):
+                with lock:
+                    ran.append(("second", self.hk.node))
+
+        class Failing(Task):
+            def run_main(self, stage):
+                raise RuntimeError("test")
+
+        class AfterFailing(Task):
+            DEPENDS = [Failing]
+
+            def run_main(self, stage):
+                ran.append(("after-failing", self.hk.node))
+
+        hks = []
+        for node in ("node1", "node2"):
+            history = JSONLinesHistory(os.path.join(self.root, node + ".jsonl"))
+            h = Housekeeping(coordinator=FileCoordinator(self.root), run_id="test", node=node, poll_interval=0.01,
+                             history=history)
+            for cls in (First, Second, Failing, AfterFailing):
+                h.register_task(cls)
+            h.init()
+            hks.append(h)
+
+        threads = [threading.Thread(target=h.run) for h in hks]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # Each task ran only once, in dependency order
+        self.assertEqual([name for name, node in ran], ["first", "second"])
+        for h in hks:
+            results = {x.task.__class__: x for x in h.stages["main"].results.values()}
+            self.assertTrue(results[Second].success)
+            self.assertFalse(results[Failing].success)
+            self.assertEqual(results[AfterFailing].outcome, "skipped")
+
+        # Each task is recorded in the history of the node that ran it
+        records = [(x["task"], x["outcome"]) for h in hks for x in h.history.records()]
+        self.assertEqual(sorted(records), sorted([
+            (First.IDENTIFIER, "success"), (Second.IDENTIFIER, "success"),
+            (Failing.IDENTIFIER, "failed"), (AfterFailing.IDENTIFIER, "skipped")]))
+
+
+class TestLocking(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+
+    def test_file_lock(self):
+        import json
+        import socket
+        import subprocess
+        from .locking import FileLock, LockedError
+        pathname = os.path.join(self.root, "test.lock")
+        lock = FileLock(pathname)
+        self.assertTrue(lock.acquire())
+
+        other = FileLock(pathname)
+        self.assertFalse(other.acquire("skip"))
+        with self.assertRaises(LockedError):
+            other.acquire("fail")
+        other.POLL_INTERVAL = 0.01
+        with self.assertRaises(LockedError):
+            other.acquire("wait", timeout=0.05)
+        lock.release()
+        self.assertTrue(other.acquire("fail"))
+        other.release()
+        self.assertFalse(os.path.exists(pathname))
+
+        # Locks held by processes that are not running anymore are broken
+        proc = subprocess.Popen(["true"])
+        proc.wait()
+        with open(pathname, "wt") as fd:
+            json.dump({"host": socket.gethostname(), "pid": proc.pid}, fd)
+        self.assertTrue(lock.acquire("fail"))
+        lock.release()
+
+        # And so are locks that have not been touched for too long
+        with open(pathname, "wt") as fd:
+            json.dump({"host": "elsewhere", "pid": 1}, fd)
+        self.assertFalse(lock.acquire("skip"))
+        os.utime(pathname, (0, 0))
+        self.assertTrue(lock.acquire("skip"))
+        lock.release()
+
+    def test_break_stale_lock(self):
+        import json
+        from .locking import FileLock
+        pathname = os.path.join(self.root, "test.lock")
+        for i in range(20):
+            with open(pathname, "wt") as fd:
+                json.dump({"host": "elsewhere", "pid": 1}, fd)
+            os.utime(pathname, (0, 0))
+
+            # Only one of the processes breaking a stale lock acquires it
+            barrier = threading.Barrier(4)
+            locks = [FileLock(pathname) for i in range(4)]
+            acquired = []
+
+            def acquire(lock):
+                barrier.wait()
+                if lock.acquire("skip"):
+                    acquired.append(lock)
+
+            threads = [threading.Thread(target=acquire, args=(lock,)) for lock in locks]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(len(acquired), 1)
+            acquired[0].release()
+
+    def test_run_lock(self):
+        from .locking import FileLock, LockedError
+
+        class TestTask(Task):
+            run_count = 0
+
+            def run_main(self, stage):
+                TestTask.run_count += 1
+
+        class Exclusive(Task):
+            EXCLUSIVE = True
+
+            def run_main(self, stage):
+                pass
+
+        other = FileLock(os.path.join(self.root, "housekeeping.lock"))
+        other.acquire()
+        try:
+            h = Housekeeping(outdir=self.root, lock_mode="skip")
+            h.register_task(TestTask)
+            h.init()
+            h.run()
+            self.assertEqual(TestTask.run_count, 0)
+
+            # A run failing to get the lock leaves no output directory behind
+            h = Housekeeping(outdir=self.root, lock_mode="fail")
+            h.register_task(TestTask)
+            h.init()
+            with self.assertRaises(LockedError):
+                h.run()
+            self.assertEqual(TestTask.run_count, 0)
+            self.assertEqual(sorted(x for x in os.listdir(self.root) if not x.startswith("housekeeping.lock")), [])
+        finally:
+            other.release()
+
+        task_lock = FileLock(os.path.join(self.root, "locks", "django_housekeeping.tests.Exclusive.lock"))
+        task_lock.acquire()
+        try:
+            h = Housekeeping(outdir=self.root, lock_mode="skip")
+            h.register_task(TestTask)
+            h.register_task(Exclusive)
+            h.init()
+            h.run()
+            self.assertEqual(TestTask.run_count, 1)
+            run_info = h.stages["main"].results["django_housekeeping.tests.Exclusive"]
+            self.assertEqual(run_info.outcome, "skipped")
+            self.assertFalse(os.path.exists(os.path.join(self.root, "housekeeping.lock")))
+        finally:
+            task_lock.release()
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+
+    def test_textfile(self):
+        from .metrics import TextfileMetrics
+        seen = []
+
+        class Good(Task):
+            def run_main(self, stage):
+                with open(pathname, "rt") as fd:
+                    seen.append(fd.read())
+
+        class Bad(Task):
+            def run_main(self, stage):
+                raise RuntimeError("test")
+
+        pathname = os.path.join(self.root, "housekeeping.prom")
+        h = Housekeeping(metrics=TextfileMetrics(pathname))
+        h.register_task(Good)
+        h.register_task(Bad)
+        h.init()
+        h.run()
+
+        # The running gauge is updated while tasks run
+        self.assertIn('housekeeping_task_running{{stage="main",task="{}"}} 1'.format(Good.IDENTIFIER), seen[0])
+        with open(pathname, "rt") as fd:
+            metrics = fd.read()
+        self.assertIn('housekeeping_task_runs_total{{stage="main",task="{}",outcome="success"}} 1'.format(
+            Good.IDENTIFIER), metrics)
+        self.assertIn('housekeeping_task_runs_total{{stage="main",task="{}",outcome="failed"}} 1'.format(
+            Bad.IDENTIFIER), metrics)
+        self.assertIn('housekeeping_task_duration_seconds_bucket{{stage="main",task="{}",le="1"}} 1'.format(
+            Good.IDENTIFIER), metrics)
+        self.assertIn("housekeeping_tasks_running 0", metrics)
+        self.assertEqual(os.listdir(self.root), ["housekeeping.prom"])
+
+        # Last success times are kept across runs
+        self.assertEqual(list(TextfileMetrics(pathname).last_success), [("main", Good.IDENTIFIER)])
+
+
+class TestLogCapture(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+
+    def test_capture(self):
+        import logging
+        barrier = threading.Barrier(2, timeout=5)
+        task_log = logging.getLogger("django_housekeeping.tests.task")
+
+        class Printing(Task):
+            def run_main(self, stage):
+                barrier.wait()
+                print("printed by", "Printing")
+                task_log.info("logged by Printing")
+
+        class Failing(Task):
+            def run_main(self, stage):
+                barrier.wait()
+                task_log.warning("logged by Failing")
+                raise RuntimeError("test failure")
+
+        class Forked(Task):
+            RUN_IN_SUBPROCESS = True
+
+            def run_main(self, stage):
+                print("printed in a subprocess", end="")
+
+        class WithTimeout(Task):
+            TIMEOUT = 10
+
+            def run_main(self, stage):
+                print("printed with a timeout")
+                task_log.info("logged with a timeout")
+
+        h = Housekeeping(outdir=self.root, workers=2)
+        for cls in (Printing, Failing, Forked, WithTimeout):
+            h.register_task(cls)
+        h.init()
+        h.run()
+
+        def read_log(cls):
+            with open(os.path.join(h.outdir.path(), "logs", "main", cls.IDENTIFIER + ".log")) as fd:
+                return fd.read()
+
+        log = read_log(Printing)
+        self.assertIn("printed by Printing", log)
+        self.assertIn("logged by Printing", log)
+        self.assertNotIn("Failing", log)
+        log = read_log(Failing)
+        self.assertIn("logged by Failing", log)
+        self.assertIn("RuntimeError: test failure", log)
+        self.assertNotIn("Printing", log)
+        self.assertIn("printed in a subprocess", read_log(Forked))
+        log = read_log(WithTimeout)
+        self.assertIn("printed with a timeout", log)
+        self.assertIn("logged with a timeout", log)
+
+        with open(os.path.join(h.outdir.path(), "report", "report.rst")) as fd:
+            report = fd.read()
+        self.assertIn("Log of {}".format(Failing.IDENTIFIER), report)
+        self.assertIn("   " + "RuntimeError: test failure", report)
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+
+    def test_archive(self):
+        import tarfile
+        from .archive import open_compressed
+
+        class Dump(Task):
+            def run_main(self, stage):
+                pathname = os.path.join(self.hk.outdir.path("dumps"), "dump.sql")
+                with open(pathname, "wt") as fd:
+                    fd.write("INSERT INTO test VALUES (1);\n" * 1000)
+                self.hk.outdir.compress(pathname)
+
+        h = Housekeeping(outdir=self.root, archive="xz")
+        h.register_task(Dump)
+        h.init()
+        h.run()
+
+        name = os.path.basename(h.outdir.outdir)
+        self.assertFalse(os.path.exists(h.outdir.outdir))
+        archive = os.path.join(self.root, name + ".tar.xz")
+        with tarfile.open(archive, "r:xz") as tar:
+            names = tar.getnames()
+            self.assertIn(name + "/report/report.rst", names)
+            self.assertNotIn(name + "/dumps/dump.sql", names)
+            with tar.extractfile(name + "/dumps/dump.sql.xz") as fd:
+                with open_compressed(fd, "rb", "xz") as dump:
+                    self.assertEqual(dump.read().decode(), "INSERT INTO test VALUES (1);\n" * 1000)
+
+    def test_archive_same_day(self):
+        from .archive import archive_directory
+
+        class Noop(Task):
+            def run_main(self, stage):
+                pass
+
+        archives = []
+        for i in range(2):
+            h = Housekeeping(outdir=self.root, archive="xz")
+            h.register_task(Noop)
+            h.init()
+            h.run()
+            archives.append(h.outdir.archive_path)
+
+        # The second run does not reuse the name of the archived first run
+        self.assertNotEqual(archives[0], archives[1])
+        for archive in archives:
+            self.assertTrue(os.path.exists(archive))
+
+        # Existing archives are never replaced
+        path = archives[0][:-len(".tar.xz")]
+        os.mkdir(path)
+        with self.assertRaises(Exception):
+            archive_directory(path, "xz")
+        self.assertTrue(os.path.isdir(path))
+        self.assertFalse(os.path.exists(archives[0] + ".tmp"))
+
+
+class TestRetention(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+
+    def make_runs(self, names):
+        for name in names:
+            if ".tar." in name:
+                with open(os.path.join(self.root, name), "wb") as fd:
+                    fd.write(b"x" * 100)
+            else:
+                os.makedirs(os.path.join(self.root, name, "report"))
+                with open(os.path.join(self.root, name, "report", "report.rst"), "wb") as fd:
+                    fd.write(b"x" * 100)
+
+    def test_select(self):
+        import datetime
+        from .retention import RetentionPolicy, list_runs
+        self.make_runs([
+            "20261017-120000", "20261017", "20261016.tar.xz", "20261015", "20261012",
+            "20261005", "20260901", "unrelated"])
+        runs = list_runs(self.root)
+        self.assertEqual([r.name for r in runs], [
+            "20261017-120000", "20261017", "20261016.tar.xz", "20261015", "20261012", "20261005", "20260901"])
+        self.assertEqual(runs[1].size, 100)
+        now = datetime.datetime(2026, 10, 17, 13, 0)
+
+        def removed(**kw):
+            return [r.name for r in RetentionPolicy(**kw).select(runs, now=now)]
+
+        self.assertEqual(removed(), [])
+        self.assertEqual(removed(keep_last=2), ["20261016.tar.xz", "20261015", "20261012", "20261005", "20260901"])
+        self.assertEqual(removed(keep_daily=3), ["20261017", "20261012", "20261005", "20260901"])
+        self.assertEqual(removed(keep_weekly=2), ["20261017", "20261016.tar.xz", "20261015", "20261012", "20260901"])
+        self.assertEqual(removed(keep_last=3, keep_weekly=2), ["20261015", "20261012", "20260901"])
+        self.assertEqual(removed(max_size=250), [
+            "20261016.tar.xz", "20261015", "20261012", "20261005", "20260901"])
+        # The most recent run is always kept
+        self.assertEqual(removed(max_size=10), [r.name for r in runs[1:]])
+        now = datetime.datetime(2027, 1, 1)
+        self.assertEqual(removed(keep_daily=3), [r.name for r in runs[1:]])
+        self.assertEqual(removed(keep_weekly=1, max_size=10), [r.name for r in runs[1:]])
+
+    def test_list_runs(self):
+        from .retention import list_runs
+        self.make_runs(["20261015.tar.gz", "20261016.tar.xz", "20261017.tar.zst", "20261018.tar.bz2"])
+        self.assertEqual([r.name for r in list_runs(self.root)], [
+            "20261017.tar.zst", "20261016.tar.xz", "20261015.tar.gz"])
+
+    def test_prune(self):
+        from .retention import RetentionPolicy
+        self.make_runs(["20261015", "20261016", "20261017"])
+        h = Housekeeping(outdir=self.root, dry_run=True, retention=RetentionPolicy(keep_last=1))
+        self.assertEqual([r.name for r in h.prune()], ["20261016", "20261015"])
+        self.assertEqual(sorted(os.listdir(self.root)), ["20261015", "20261016", "20261017"])
+
+        # The current run is never removed
+        h = Housekeeping(outdir=self.root, retention=RetentionPolicy(keep_last=1))
+        h.init()
+        h.run()
+        self.assertEqual(os.listdir(self.root), [os.path.basename(h.outdir.path())])
+
+
+class TestStreams(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+
+    def test_roundtrip(self):
+        import hashlib
+        from .streams import open_stream
+
+        for name in ("dump.json", "dump.json.gz", "dump.json.xz"):
+            pathname = os.path.join(self.root, "dumps", name)
+            with open_stream(pathname, "wt", checksum="sha256") as out:
+                for i in range(1000):
+                    out.write("{}\n".format(i))
+                self.assertFalse(os.path.exists(pathname))
+            with open_stream(pathname, "rt") as fd:
+                self.assertEqual([int(line) for line in fd], list(range(1000)))
+            with open(pathname, "rb") as fd:
+                digest = hashlib.sha256(fd.read()).hexdigest()
+            with open(pathname + ".sha256", "rt") as fd:
+                self.assertEqual(fd.read(), "{}  {}\n".format(digest, name))
+
+        # A failure while writing leaves nothing behind
+        pathname = os.path.join(self.root, "failed.gz")
+        with self.assertRaises(RuntimeError):
+            with open_stream(pathname, "wb") as out:
+                out.write(b"test")
+                raise RuntimeError("test")
+        self.assertEqual(sorted(os.listdir(self.root)), ["dumps"])
+
+    def test_previous(self):
+        os.mkdir(os.path.join(self.root, "20200101"))
+
+        class Dump(Task):
+            def run_main(self, stage):
+                with self.hk.outdir.open_stream("dumps/users.txt.xz", "wt") as out:
+                    out.write("enrico\n")
+
+        h = Housekeeping(outdir=self.root)
+        h.register_task(Dump)
+        h.init()
+        with self.assertRaises(FileNotFoundError):
+            h.outdir.open_previous("dumps/users.txt.xz")
+        h.run()
+
+        with h.outdir.open_stream("dumps/users.txt.xz", "rt") as fd:
+            self.assertEqual(fd.read(), "enrico\n")
+
+        os.rename(h.outdir.outdir, os.path.join(self.root, "20200102"))
+        h.outdir.outdir = os.path.join(self.root, "20200103")
+        self.assertEqual(h.outdir.previous(), os.path.join(self.root, "20200102"))
+        with h.outdir.open_previous("dumps/users.txt.xz", "rt") as fd:
+            self.assertEqual(fd.read(), "enrico\n")
+
+    def test_previous_archived(self):
+        class Dump(Task):
+            previous = None
+
+            def run_main(self, stage):
+                try:
+                    with self.hk.outdir.open_previous("dumps/users.txt.xz", "rt") as fd:
+                        Dump.previous = list(fd)
+                except FileNotFoundError:
+                    pass
+                with self.hk.outdir.open_stream("dumps/users.txt.xz", "wt") as out:
+                    out.write("enrico\nanna\n")
+
+        for i in range(2):
+            h = Housekeeping(outdir=self.root, archive="xz")
+            h.register_task(Dump)
+            h.init()
+            h.run()
+
+        # The second run read the file from the archive of the first one
+        self.assertEqual(Dump.previous, ["enrico\n", "anna\n"])
+        self.assertTrue(h.outdir.previous().endswith(".tar.xz"))
+        with self.assertRaises(FileNotFoundError):
+            h.outdir.open_previous("dumps/missing.txt")
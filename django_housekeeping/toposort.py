@@ -23,71 +23,88 @@ from __future__ import annotations
 # From: http://www.logarithmic.net/pfh/blog/01208083168
 # and: http://www.logarithmic.net/pfh-files/blog/01208083168/tarjan.py
 
-from typing import Dict, Set, Any, List
+from typing import Dict, Set, Any, List, Optional
 from collections import Counter, deque
+import heapq
 
 Node = Any
 Graph = Dict[Node, Set[Node]]
 
 
-def strongly_connected_components(graph: Graph):
+def strongly_connected_components(graph: Graph) -> List[List[Node]]:
     """
     Tarjan's Algorithm (named for its discoverer, Robert Tarjan) is a graph theory algorithm
     for finding the strongly connected components of a graph.
 
     Based on: http://en.wikipedia.org/wiki/Tarjan%27s_strongly_connected_components_algorithm
+
+    This version uses an explicit stack instead of recursion, so that it works
+    on arbitrarily deep graphs, and runs in O(V+E).
     """
 
-    index_counter = [0]
-    stack = []
-    lowlinks = {}
-    index = {}
+    index: Dict[Node, int] = {}
+    lowlinks: Dict[Node, int] = {}
+    stack: List[Node] = []
+    on_stack: Set[Node] = set()
     result = []
 
-    def strongconnect(node: Node):
-        # set the depth index for this node to the smallest unused index
-        index[node] = index_counter[0]
-        lowlinks[node] = index_counter[0]
-        index_counter[0] += 1
-        stack.append(node)
-
-        # Consider successors of `node`
-        successors = graph.get(node, ())
-        for successor in successors:
-            if successor not in lowlinks:
-                # Successor has not yet been visited; recurse on it
-                strongconnect(successor)
-                lowlinks[node] = min(lowlinks[node], lowlinks[successor])
-            elif successor in stack:
-                # the successor is in the stack and hence in the current strongly connected component (SCC)
-                lowlinks[node] = min(lowlinks[node], index[successor])
-
-        # If `node` is a root node, pop the stack and generate an SCC
-        if lowlinks[node] == index[node]:
-            connected_component = []
-
-            while True:
-                successor = stack.pop()
-                connected_component.append(successor)
-                if successor == node:
+    for root in graph:
+        if root in index:
+            continue
+
+        # Each work item is a node being visited, and an iterator over the
+        # successors still to be considered
+        index[root] = lowlinks[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(graph.get(root, ())))]
+
+        while work:
+            node, successors = work[-1]
+            for successor in successors:
+                if successor not in index:
+                    # Successor has not yet been visited: descend into it
+                    index[successor] = lowlinks[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(graph.get(successor, ()))))
                     break
-
-            # storing the result
-            result.append(connected_component)
-
-    for node in graph:
-        if node not in lowlinks:
-            strongconnect(node)
+                elif successor in on_stack:
+                    # the successor is in the stack and hence in the current strongly connected component (SCC)
+                    lowlinks[node] = min(lowlinks[node], index[successor])
+            else:
+                # All successors of `node` have been considered
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlinks[parent] = min(lowlinks[parent], lowlinks[node])
+
+                # If `node` is a root node, pop the stack and generate an SCC
+                if lowlinks[node] == index[node]:
+                    connected_component = []
+
+                    while True:
+                        successor = stack.pop()
+                        on_stack.discard(successor)
+                        connected_component.append(successor)
+                        if successor == node:
+                            break
+
+                    # storing the result
+                    result.append(connected_component)
 
     return result
 
 
-def topological_sort(graph: Graph) -> List[Node]:
+def topological_sort(graph: Graph, priority: Optional[Dict[Node, float]] = None) -> List[Node]:
     count: Counter = Counter()
     for node in graph:
         for successor in graph[node]:
             count[successor] += 1
 
+    if priority is not None:
+        return _prioritized_topological_sort(graph, count, priority)
+
     # Use a deque to pop left efficiently, so we can preserve the graph
     # insertion order when no other dependency information kicks in
     ready = deque(node for node in graph if count[node] == 0)
@@ -105,14 +122,51 @@ def topological_sort(graph: Graph) -> List[Node]:
     return result
 
 
-def sort(graph: Graph) -> List[Node]:
+def _prioritized_topological_sort(graph: Graph, count: Counter, priority: Dict[Node, float]) -> List[Node]:
+    """
+    Topological sort that picks the ready node with the highest priority
+    first, falling back to graph insertion order
+    """
+    position = {node: idx for idx, node in enumerate(graph)}
+    ready = [(-priority.get(node, 0.0), position[node], node) for node in graph if count[node] == 0]
+    heapq.heapify(ready)
+
+    result = []
+    while ready:
+        node = heapq.heappop(ready)[2]
+        result.append(node)
+
+        for successor in graph[node]:
+            count[successor] -= 1
+            if count[successor] == 0:
+                heapq.heappush(ready, (-priority.get(successor, 0.0), position[successor], successor))
+
+    return result
+
+
+def longest_paths(graph: Graph, weights: Dict[Node, float]) -> Dict[Node, float]:
+    """
+    Compute, for each node of an acyclic graph, the total weight of the
+    heaviest path that starts from it, including the weight of the node itself.
+
+    Nodes missing from weights have weight 0.
+    """
+    res: Dict[Node, float] = {}
+    for node in reversed(topological_sort(graph)):
+        res[node] = weights.get(node, 0.0) + max((res[x] for x in graph[node]), default=0.0)
+    return res
+
+
+def sort(graph: Graph, priority: Optional[Dict[Node, float]] = None) -> List[Node]:
     """
     Linearize a dependency graph, throwing an exception if a cycle is detected.
 
-    When no dependencies intervene in ordering, the algorithm preserves the
-    original insertion order of the graph.
+    When no dependencies intervene in ordering, the algorithm picks nodes with
+    higher priority first, then preserves the original insertion order of the
+    graph.
 
     :arg graph: a dict mapping each node to a set() of adjacent nodes
+    :arg priority: optional dict mapping nodes to a priority value
     """
     # Compute the strongly connected components, throwing an exception if we
     # see cycles
@@ -129,4 +183,4 @@ def sort(graph: Graph) -> List[Node]:
 
     # We know that the graph does not have cycles, so we can run
     # topological_sort on it
-    return topological_sort(graph)
+    return topological_sort(graph, priority)
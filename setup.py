@@ -32,5 +32,9 @@ setup(
     license="https://www.gnu.org/licenses/lgpl.html",
     packages=["django_housekeeping",
               "django_housekeeping.management",
+              "django_housekeeping.migrations",
               "django_housekeeping.management.commands"],
+    extras_require={
+        "zstd": ["zstandard"],
+    },
 )